@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+#
+#   Benchmark the image decoders on a sample of your images, to find the fastest one for this machine
+#   Copyright EAVISE
+#
+
+import argparse
+import random
+import lightnet as ln
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the image decoders of lightnet')
+    parser.add_argument('files', nargs='+', help='Image files to decode (eg. a sample of your dataset)')
+    parser.add_argument('-s', '--sample', type=int, default=200, help='Maximal number of files to decode')
+    parser.add_argument('-n', '--number', type=int, default=3, help='Number of times each file gets decoded')
+    parser.add_argument('-d', '--decoders', nargs='+', choices=['pillow', 'opencv', 'torchvision'], default=None, help='Decoders to compare')
+    args = parser.parse_args()
+
+    files = args.files
+    if len(files) > args.sample:
+        files = random.sample(files, args.sample)
+
+    timings = ln.data.benchmark_decoders(files, args.decoders, args.number)
+    if len(timings) == 0:
+        print('None of the decoders could decode the images')
+        return
+
+    for decoder, duration in timings:
+        print(f'{repr(decoder):>30}: {duration * 1000:.3f} ms/image')
+    print(f'Fastest decoder: {timings[0][0]!r}')
+
+
+if __name__ == '__main__':
+    main()
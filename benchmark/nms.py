@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+#
+#   Benchmark the vectorized NonMaxSuppression against the original implementation, which loops over the images and boxes in Python
+#   Copyright EAVISE
+#
+
+import argparse
+import timeit
+import torch
+import lightnet as ln
+
+
+class LoopNonMaxSuppression:
+    """ Original NonMaxSuppression implementation. """
+    def __init__(self, nms_thresh, class_nms=True):
+        self.nms_thresh = nms_thresh
+        self.class_nms = class_nms
+
+    def __call__(self, boxes):
+        if boxes.numel() == 0:
+            return boxes
+
+        batches = boxes[:, 0]
+        keep = torch.empty(boxes.shape[0], dtype=torch.bool, device=boxes.device)
+        for batch in torch.unique(batches, sorted=False):
+            mask = batches == batch
+            keep[mask] = self._nms(boxes[mask])
+
+        return boxes[keep]
+
+    def _nms(self, boxes):
+        a = boxes[:, 1:3]
+        b = boxes[:, 3:5]
+        bboxes = torch.cat([a-b/2, a+b/2], 1)
+        scores, order = boxes[:, 5].sort(0, descending=True)
+        x1, y1, x2, y2 = bboxes[order].split(1, 1)
+
+        dx = (x2.min(x2.t()) - x1.max(x1.t())).clamp(min=0)
+        dy = (y2.min(y2.t()) - y1.max(y1.t())).clamp(min=0)
+        intersections = dx * dy
+        areas = (x2 - x1) * (y2 - y1)
+        unions = (areas + areas.t()) - intersections
+        ious = intersections / unions
+
+        conflicting = (ious > self.nms_thresh).triu(1)
+        if self.class_nms:
+            classes = boxes[order, 6]
+            conflicting = conflicting & (classes.unsqueeze(0) == classes.unsqueeze(1))
+
+        conflicting = conflicting.cpu()
+        keep = torch.zeros(len(conflicting), dtype=torch.bool)
+        supress = torch.zeros(len(conflicting), dtype=torch.bool)
+        for i, row in enumerate(conflicting):
+            if not supress[i]:
+                keep[i] = True
+                supress |= row
+
+        keep = keep.to(boxes.device)
+        return keep.scatter(0, order, keep)
+
+
+def random_boxes(num_boxes, batch, num_classes, device):
+    boxes = torch.empty(num_boxes, 7, device=device)
+    boxes[:, 0] = torch.randint(0, batch, (num_boxes,), device=device)
+    boxes[:, 1:3] = torch.rand(num_boxes, 2, device=device)
+    boxes[:, 3:5] = torch.rand(num_boxes, 2, device=device) * 0.2 + 0.01
+    boxes[:, 5] = torch.rand(num_boxes, device=device)
+    boxes[:, 6] = torch.randint(0, num_classes, (num_boxes,), device=device)
+    return boxes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the NonMaxSuppression transform')
+    parser.add_argument('-b', '--boxes', type=int, nargs='+', default=(100, 1000, 4000), help='Number of candidate boxes')
+    parser.add_argument('-B', '--batch', type=int, default=8, help='Number of images the boxes are spread over')
+    parser.add_argument('-c', '--classes', type=int, default=20, help='Number of classes')
+    parser.add_argument('-n', '--number', type=int, default=10, help='Number of runs to time')
+    parser.add_argument('--thresh', type=float, default=0.45, help='NMS threshold')
+    parser.add_argument('--device', default='cpu', help='Device to run on')
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    loop = LoopNonMaxSuppression(args.thresh)
+    vectorized = ln.data.transform.NonMaxSuppression(args.thresh)
+
+    for num_boxes in args.boxes:
+        boxes = random_boxes(num_boxes, args.batch, args.classes, device)
+        identical = torch.equal(loop(boxes), vectorized(boxes))
+
+        timings = []
+        for nms in (loop, vectorized):
+            nms(boxes)
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            timings.append(timeit.timeit(lambda: nms(boxes), number=args.number) / args.number * 1000)
+
+        print(f'{num_boxes:>6} boxes: loop {timings[0]:9.3f} ms, vectorized {timings[1]:9.3f} ms ({timings[0] / timings[1]:5.1f}x), identical results: {identical}')
+
+
+if __name__ == '__main__':
+    main()
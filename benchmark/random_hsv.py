@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+#
+#   Benchmark the Pillow and OpenCV code paths of the RandomHSV transform
+#   Copyright EAVISE
+#
+
+import argparse
+import random
+import timeit
+import numpy as np
+from PIL import Image
+import lightnet as ln
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the RandomHSV transform')
+    parser.add_argument('-s', '--size', type=int, nargs=2, default=(640, 480), help='Width and height of the images')
+    parser.add_argument('-n', '--number', type=int, default=200, help='Number of transforms to time')
+    parser.add_argument('--hsv', type=float, nargs=3, default=(0.1, 1.5, 1.5), help='Hue, saturation and value arguments of the transform')
+    args = parser.parse_args()
+
+    width, height = args.size
+    img_cv = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+    img_pil = Image.fromarray(img_cv)
+    hsv = ln.data.transform.RandomHSV(*args.hsv)
+
+    random.seed(0)
+    out_pil = np.asarray(hsv(img_pil))
+    random.seed(0)
+    out_cv = hsv(img_cv)
+    print(f'Identical results: {np.array_equal(out_pil, out_cv)}')
+
+    for name, img in (('Pillow', img_pil), ('OpenCV', img_cv)):
+        duration = timeit.timeit(lambda: hsv(img), number=args.number)
+        print(f'{name:>6}: {duration / args.number * 1000:.3f} ms/image')
+
+
+if __name__ == '__main__':
+    main()
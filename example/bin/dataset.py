@@ -1,3 +1,4 @@
+import os
 import copy
 import logging
 from PIL import Image
@@ -16,7 +17,7 @@ class VOCDataset(ln.models.BramboxDataset):
     """ Pascal VOC dataset, with annotations generated by `brambox.io.parser.box.PandasParser`
 
     Args:
-        anno_file (str or Path): Path to annotation file (must be parseable by PandasParser)
+        anno_file (str or Path): Path to annotation file (must be parseable by PandasParser) or to a folder with a `lightnet.data.AnnotationStore`
         params (lightnet.engine.HyperParameters): Hyperparameters for this data (See Note)
         augment (boolean): Whether to perform data augmentation
         kwargs (optional): extra keyword arguments to pass on to the `brambox.io.load()` function
@@ -32,19 +33,25 @@ class VOCDataset(ln.models.BramboxDataset):
         - params.hue (float): Hue change percentage
         - params.saturation (float): Saturation change percentage
         - params.value (float): Value change percentage
+
+    Note:
+        Annotation stores are used as is, so you should filter the difficult annotations before creating the store.
     """
     def __init__(self, anno_file, params, augment, **kwargs):
-        annos = bb.io.load('pandas', anno_file, **kwargs)
+        if os.path.isdir(anno_file):
+            annos = ln.data.AnnotationStore(anno_file)
+        else:
+            annos = bb.io.load('pandas', anno_file, **kwargs)
 
-        # Filter data
-        self.filter = getattr(params, 'filter_anno', 'none')
-        if not self.filter in ('ignore', 'rm', 'none'):
-            log.error(f'filter ({self.filter}) is not one of [ignore, rm, none]. Choosing default "none" value')
+            # Filter data
+            self.filter = getattr(params, 'filter_anno', 'none')
+            if not self.filter in ('ignore', 'rm', 'none'):
+                log.error(f'filter ({self.filter}) is not one of [ignore, rm, none]. Choosing default "none" value')
 
-        if self.filter == 'ignore':
-            annos.loc[annos.difficult, 'ignore'] = True
-        elif self.filter == 'rm':
-            annos = annos[~annos.difficult]
+            if self.filter == 'ignore':
+                annos.loc[annos.difficult, 'ignore'] = True
+            elif self.filter == 'rm':
+                annos = annos[~annos.difficult]
 
         # Data transformation pipeline
         lb  = ln.data.transform.Letterbox(dataset=self)
@@ -124,11 +124,6 @@ if __name__ == '__main__':
         visdom = None
 
     params = ln.engine.HyperParameters.from_file(args.network)
-    if args.weight is not None:
-        if args.weight.endswith('.state.pt'):
-            params.load(args.weight)
-        else:
-            params.network.load(args.weight, strict=False)  # Disable strict mode for loading partial weights
 
     # Dataloader
     training_loader = ln.data.DataLoader(
@@ -140,6 +135,13 @@ if __name__ == '__main__':
         pin_memory = True,
         collate_fn = ln.data.brambox_collate,
     )
+    params.dataloader = training_loader     # Save the dataloader state in the backups, to resume in the middle of an epoch
+
+    if args.weight is not None:
+        if args.weight.endswith('.state.pt'):
+            params.load(args.weight)
+        else:
+            params.network.load(args.weight, strict=False)  # Disable strict mode for loading partial weights
 
     # Start training
     eng = TrainEngine(
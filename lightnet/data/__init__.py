@@ -4,5 +4,9 @@ This module contains everything related to pre- and post-processing of your data
 It also has functionality to create datasets from images and annotations that are parseable with brambox_.
 """
 
+from ._boxes import *
 from ._dataloading import *
+from ._cache import *
+from ._decoder import *
+from ._annotation_store import *
 from . import transform
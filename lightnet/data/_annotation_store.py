@@ -0,0 +1,199 @@
+#
+#   Lightnet columnar annotation store
+#   Copyright EAVISE
+#
+
+import os
+import json
+import logging
+import numpy as np
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+__all__ = ['AnnotationStore']
+log = logging.getLogger(__name__)
+
+
+class AnnotationStore:
+    """ Columnar storage for brambox annotations, backed by memory-mapped numpy arrays. |br|
+    Each annotation column is stored as a separate ``.npy`` file, with the annotations sorted per image.
+    Loading a store does not require any parsing and all dataloader workers share the same memory pages,
+    as opposed to a pandas dataframe, whose python objects get copied in every worker process.
+
+    Args:
+        path (str or path-like): Folder containing the store (created with :meth:`~lightnet.data.AnnotationStore.from_brambox`)
+
+    Note:
+        The `image` column gets stored as a per-image offset array and the `class_label` column as integer class ids.
+        Other numerical and boolean columns (eg. x_top_left, ignore, ...) are stored as is, but columns with python objects are discarded.
+
+    Example:
+        >>> annos = bb.io.load('pandas', 'data/train.h5')                                      # doctest: +SKIP
+        >>> ln.data.AnnotationStore.from_brambox('data/train_store', annos, class_label_map)   # doctest: +SKIP
+        >>> store = ln.data.AnnotationStore('data/train_store')                                # doctest: +SKIP
+        >>> dataset = ln.models.BramboxDataset(store, (416, 416), class_label_map, identify)   # doctest: +SKIP
+    """
+    def __init__(self, path):
+        self.path = path
+
+        with open(os.path.join(self.path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        self.class_label_map = meta['class_label_map']
+        self.column_names = meta['columns']
+
+        self._class_labels = np.array(self.class_label_map, dtype=object)
+        self.__open()
+
+    def __getstate__(self):
+        """ Memory-mapped arrays get copied entirely when pickled, so we reopen them when unpickling instead. """
+        state = self.__dict__.copy()
+        for key in ('keys', 'offsets', 'columns'):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__open()
+
+    def __open(self):
+        self.keys = np.load(os.path.join(self.path, 'keys.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(self.path, 'offsets.npy'), mmap_mode='r')
+        self.columns = {name: np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode='r') for name in self.column_names}
+
+    def __len__(self):
+        """ Number of images in the store. """
+        return len(self.keys)
+
+    @property
+    def anno_start(self):
+        """ Index of the first annotation of each image. """
+        return self.offsets[:-1]
+
+    @property
+    def anno_stop(self):
+        """ Index after the last annotation of each image. """
+        return self.offsets[1:]
+
+    @classmethod
+    def from_brambox(cls, path, annotations, class_label_map):
+        """ Write brambox annotations to a store and open it.
+
+        Args:
+            path (str or path-like): Folder to write the store to (gets created if it does not exist)
+            annotations (dataframe): Dataframe containing brambox annotations
+            class_label_map (list): List of class_labels
+
+        Returns:
+            lightnet.data.AnnotationStore: Opened store
+
+        Note:
+            The images are stored in the order of the categories of the `image` column,
+            which is the same order as the :class:`~lightnet.models.BramboxDataset` uses.
+        """
+        os.makedirs(path, exist_ok=True)
+        class_label_map = list(class_label_map)
+
+        keys = annotations.image.cat.categories
+        order, offsets = index_annotations(annotations)
+        if order is None:
+            order = slice(None)
+        class_id = get_class_ids(annotations.class_label.values[order], class_label_map)
+
+        np.save(os.path.join(path, 'keys.npy'), np.array([str(k) for k in keys], dtype=str))
+        np.save(os.path.join(path, 'offsets.npy'), offsets)
+        np.save(os.path.join(path, 'class_id.npy'), class_id)
+
+        columns = ['class_id']
+        for name in annotations.columns:
+            if name in ('image', 'class_label', 'class_id'):
+                continue
+            values = annotations[name].values
+            if values.dtype.kind not in 'biuf':
+                log.warning(f'Column [{name}] does not contain numerical or boolean data and will not be stored')
+                continue
+            np.save(os.path.join(path, f'{name}.npy'), np.ascontiguousarray(values[order]))
+            columns.append(name)
+
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'class_label_map': class_label_map, 'columns': columns}, f)
+
+        return cls(path)
+
+    def to_brambox(self, index):
+        """ Get the annotations of one image as a brambox dataframe, like :func:`brambox.util.select_images` would return them.
+
+        Args:
+            index (int): Index of the image
+
+        Returns:
+            pandas.DataFrame: brambox annotations with an extra `class_id` column
+        """
+        if pd is None:
+            raise ImportError('Pandas needs to be installed to convert the annotations to a dataframe')
+
+        start, stop = self.offsets[index], self.offsets[index+1]
+        class_id = self.columns['class_id'][start:stop]
+
+        anno = {
+            'image': pd.Categorical.from_codes(np.zeros(stop - start, dtype=np.int8), categories=[str(self.keys[index])]),
+            'class_label': self._class_labels[class_id],
+        }
+        for name, values in self.columns.items():
+            if name != 'class_id':
+                anno[name] = np.array(values[start:stop])
+        anno['class_id'] = class_id.astype(np.int64)
+
+        return pd.DataFrame(anno)
+
+
+def index_annotations(annotations):
+    """ Sort brambox annotations per image, in the order of the categories of their `image` column. |br|
+    This is the columnar layout that is shared by the :class:`~lightnet.data.AnnotationStore`,
+    :class:`~lightnet.models.ShardWriter` and :class:`~lightnet.models.BramboxDataset`.
+
+    Args:
+        annotations (dataframe): Dataframe containing brambox annotations
+
+    Returns:
+        tuple: Order of the annotation rows (**None** if they are already sorted) and offsets array with length num_images + 1
+
+    Note:
+        The annotations of image `i` are the rows ``order[offsets[i]:offsets[i+1]]`` of the dataframe.
+        Annotations without an image (NaN in the `image` column) are left out of the order, with a warning.
+    """
+    codes = annotations.image.cat.codes.values
+    num_missing = int((codes < 0).sum())
+    if num_missing > 0:
+        log.warning(f'{num_missing} annotations do not have an image and will be ignored')
+
+    if num_missing == 0 and np.all(codes[:-1] <= codes[1:]):
+        order = None
+    else:
+        order = np.argsort(codes, kind='stable')[num_missing:]
+        codes = codes[order]
+
+    offsets = np.zeros(len(annotations.image.cat.categories) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(codes, minlength=len(offsets) - 1))
+    return order, offsets
+
+
+def get_class_ids(class_labels, class_label_map):
+    """ Convert class labels to integer class ids.
+
+    Args:
+        class_labels (array-like): Class labels to convert
+        class_label_map (list or dict): List of class_labels or dictionary that maps class_labels to ids
+
+    Returns:
+        numpy.ndarray: int32 array with the class ids
+    """
+    if not isinstance(class_label_map, dict):
+        class_label_map = dict((label, i) for i, label in enumerate(class_label_map))
+
+    try:
+        return np.array([class_label_map[label] for label in class_labels], dtype=np.int32)
+    except KeyError as err:
+        raise ValueError(f'Class label {err} not found in class_label_map') from err
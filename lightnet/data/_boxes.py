@@ -0,0 +1,157 @@
+#
+#   Lightnet compact bounding box container
+#   Copyright EAVISE
+#
+
+import logging
+import numpy as np
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+__all__ = ['BoxArray']
+log = logging.getLogger(__name__)
+
+
+class BoxArray:
+    """ Lightweight container for the bounding boxes of one image, backed by numpy arrays. |br|
+    The annotation transforms of lightnet accept and return these objects, just like brambox dataframes.
+    As there is no pandas overhead, transforming a few boxes is a lot faster this way.
+
+    Args:
+        coords (numpy.ndarray): [N, 4] array with the x_top_left, y_top_left, width and height of the boxes
+        class_id (numpy.ndarray, optional): [N] array with the class index of the boxes; Default **0**
+        ignore (numpy.ndarray, optional): [N] boolean array with the ignore flag of the boxes; Default **False**
+        truncated (numpy.ndarray, optional): [N] array with the truncated fraction of the boxes; Default **0**
+        image (str, optional): Identifier of the image; Default **None**
+        class_label_map (list, optional): List of class labels, to convert the class indices back to labels; Default **None**
+
+    Note:
+        The coordinates are stored as float32 and can be accessed directly in the ``coords`` attribute,
+        or per column with the `x_top_left`, `y_top_left`, `width` and `height` properties.
+
+    Example:
+        >>> boxes = ln.data.BoxArray([[10, 10, 20, 30], [50, 20, 10, 10]], class_id=[0, 1])
+        >>> flip = ln.data.transform.RandomFlip(1)
+        >>> img = flip(torch.zeros(100, 200, 3, dtype=torch.uint8).numpy())
+        >>> flip(boxes)
+        BoxArray [2 boxes]
+        >>> flip(boxes).x_top_left
+        array([170., 140.], dtype=float32)
+    """
+    __slots__ = ('coords', 'class_id', 'ignore', 'truncated', 'image', 'class_label_map')
+
+    def __init__(self, coords, class_id=None, ignore=None, truncated=None, image=None, class_label_map=None):
+        self.coords = np.asarray(coords, dtype=np.float32).reshape(-1, 4)
+        num_boxes = self.coords.shape[0]
+        self.class_id = np.zeros(num_boxes, dtype=np.int64) if class_id is None else np.asarray(class_id, dtype=np.int64)
+        self.ignore = np.zeros(num_boxes, dtype=bool) if ignore is None else np.asarray(ignore, dtype=bool)
+        self.truncated = np.zeros(num_boxes, dtype=np.float32) if truncated is None else np.asarray(truncated, dtype=np.float32)
+        self.image = image
+        self.class_label_map = class_label_map
+
+    def __len__(self):
+        return self.coords.shape[0]
+
+    def __getitem__(self, index):
+        """ Select boxes with an index, slice or mask. """
+        if isinstance(index, (int, np.integer)):
+            index = slice(index, index + 1)
+        return BoxArray(self.coords[index], self.class_id[index], self.ignore[index], self.truncated[index], self.image, self.class_label_map)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__} [{len(self)} boxes]'
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def copy(self):
+        """ Create a copy of the boxes. """
+        return BoxArray(self.coords.copy(), self.class_id.copy(), self.ignore.copy(), self.truncated.copy(), self.image, self.class_label_map)
+
+    @property
+    def x_top_left(self):
+        return self.coords[:, 0]
+
+    @property
+    def y_top_left(self):
+        return self.coords[:, 1]
+
+    @property
+    def width(self):
+        return self.coords[:, 2]
+
+    @property
+    def height(self):
+        return self.coords[:, 3]
+
+    @classmethod
+    def from_brambox(cls, anno, class_label_map=None):
+        """ Create a box array from the brambox annotations of one image.
+
+        Args:
+            anno (pandas.DataFrame): brambox annotations
+            class_label_map (list, optional): List of class labels, which is used if there is no `class_id` column; Default **None**
+
+        Returns:
+            lightnet.data.BoxArray: Boxes of the dataframe
+        """
+        if 'class_id' in anno.columns:
+            class_id = anno.class_id.values
+        elif class_label_map is not None:
+            class_id = anno.class_label.map(dict((label, i) for i, label in enumerate(class_label_map))).values
+        else:
+            raise ValueError('The annotations need a class_id column or a class_label_map is required')
+
+        image = None
+        if 'image' in anno.columns and len(anno.index) > 0:
+            image = str(anno.image.iloc[0])
+
+        return cls(
+            anno[['x_top_left', 'y_top_left', 'width', 'height']].values,
+            class_id,
+            anno.ignore.values if 'ignore' in anno.columns else None,
+            anno.truncated.values if 'truncated' in anno.columns else None,
+            image,
+            class_label_map,
+        )
+
+    def to_brambox(self):
+        """ Convert the boxes to a brambox dataframe.
+
+        Returns:
+            pandas.DataFrame: brambox annotations with an extra `class_id` column
+
+        Note:
+            The `class_label` column is only filled in if the box array has a `class_label_map`, otherwise it contains the class indices.
+        """
+        if pd is None:
+            raise ImportError('Pandas needs to be installed to convert the boxes to a dataframe')
+
+        if self.class_label_map is not None:
+            class_label = np.array(self.class_label_map, dtype=object)[self.class_id]
+        else:
+            class_label = self.class_id.astype(str).astype(object)
+
+        categories = [self.image] if self.image is not None else ['']
+        return pd.DataFrame({
+            'image': pd.Categorical.from_codes(np.zeros(len(self), dtype=np.int8), categories=categories),
+            'class_label': class_label,
+            'id': np.full(len(self), np.nan),
+            'x_top_left': self.coords[:, 0].astype(np.float64),
+            'y_top_left': self.coords[:, 1].astype(np.float64),
+            'width': self.coords[:, 2].astype(np.float64),
+            'height': self.coords[:, 3].astype(np.float64),
+            'occluded': np.zeros(len(self)),
+            'truncated': self.truncated.astype(np.float64),
+            'lost': np.zeros(len(self), dtype=bool),
+            'difficult': np.zeros(len(self), dtype=bool),
+            'ignore': self.ignore.copy(),
+            'class_id': self.class_id.copy(),
+        })
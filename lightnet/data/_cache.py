@@ -0,0 +1,199 @@
+#
+#   Lightnet shared memory image cache
+#   Copyright EAVISE
+#
+
+import logging
+import multiprocessing
+import numpy as np
+import torch
+from PIL import Image
+
+__all__ = ['SharedImageCache']
+log = logging.getLogger(__name__)
+
+DTYPES = (np.uint8, np.uint16, np.int32, np.float32, np.float64)
+MODES = ('L', 'LA', 'RGB', 'RGBA', 'I;16', 'I', 'F')
+
+
+class SharedImageCache:
+    """ Cache for decoded images that is shared between all :class:`~lightnet.data.DataLoader` workers. |br|
+    The images are stored in a shared memory arena with a fixed byte budget.
+    When the arena is full, the least recently used images get evicted.
+
+    Args:
+        size (int): Byte budget of the cache
+        num_images (int): Number of images in the dataset (aka. ``len(dataset)``)
+        block_size (int, optional): Size of the blocks in which the arena is divided; Default **64KiB**
+
+    Note:
+        The cache needs to be created in the main process, before the dataloader starts its worker processes.
+        The easiest way to do this, is to pass the cache to your dataset when creating it.
+
+    Note:
+        You should cache the decoded images before running any data augmentation on them,
+        so that the random transformations still happen for every sample. |br|
+        Pillow images (in the modes 'L', 'LA', 'RGB', 'RGBA', 'I;16', 'I' and 'F') and numpy arrays can be cached.
+        Other images are simply not cached.
+
+    Example:
+        >>> class CustomSet(ln.data.Dataset):
+        ...     def __init__(self, files, cache_size):
+        ...         super().__init__((416, 416))
+        ...         self.files = files
+        ...         self.cache = ln.data.SharedImageCache(cache_size, len(files))
+        ...     def __len__(self):
+        ...         return len(self.files)
+        ...     @ln.data.Dataset.resize_getitem
+        ...     def __getitem__(self, index):
+        ...         img = self.cache(index, self.load_image)    # Only calls load_image when the image is not cached
+        ...         return img                                  # Run augmentation transforms here
+        ...     def load_image(self, index):
+        ...         return torch.full((2, 2), index, dtype=torch.uint8).numpy()
+        >>> data = CustomSet(['a.png', 'b.png'], 2**20)
+        >>> data[1]
+        array([[1, 1],
+               [1, 1]], dtype=uint8)
+        >>> data.cache.get(1) is None
+        False
+    """
+    def __init__(self, size, num_images, block_size=2**16):
+        self.block_size = block_size
+        self.num_blocks = max(1, size // block_size)
+
+        self.arena = torch.zeros(self.num_blocks, block_size, dtype=torch.uint8).share_memory_()
+        self.owner = torch.full((self.num_blocks,), -1, dtype=torch.int64).share_memory_()
+        self.entries = torch.zeros(num_images, 7, dtype=torch.int64).share_memory_()    # nbytes, height, width, channels, dtype, mode, last_used
+        self.clock = torch.zeros(1, dtype=torch.int64).share_memory_()
+        self.lock = multiprocessing.Lock()
+
+    def __call__(self, index, load_fn):
+        """ Get an image from the cache and load (and cache) it if it is not present.
+
+        Args:
+            index (int): Index of the image
+            load_fn (callable): Function that gets called with the index to load the image
+        """
+        img = self.get(index)
+        if img is None:
+            img = load_fn(index)
+            self.put(index, img)
+        return img
+
+    def __len__(self):
+        """ Number of images that are currently cached. """
+        return int((self.entries[:, 0] > 0).sum())
+
+    @property
+    def nbytes(self):
+        """ Number of bytes of the arena that are currently in use. """
+        return int((self.owner >= 0).sum()) * self.block_size
+
+    def get(self, index):
+        """ Get an image from the cache.
+
+        Args:
+            index (int): Index of the image
+
+        Returns:
+            PIL.Image or numpy.ndarray: Cached image or **None** if the image is not in the cache.
+        """
+        entries = self.entries.numpy()
+        with self.lock:
+            nbytes, height, width, channels, dtype, mode = entries[index, :6]
+            if nbytes <= 0:
+                return None
+
+            blocks = np.flatnonzero(self.owner.numpy() == index)
+            data = self.arena.numpy()[blocks].reshape(-1)[:nbytes]
+            entries[index, 6] = self.__tick()
+
+        shape = (height, width) if channels == 0 else (height, width, channels)
+        img = data.view(DTYPES[dtype]).reshape(shape)
+        if mode >= 0:
+            return Image.fromarray(img, MODES[mode])
+        return img
+
+    def put(self, index, img):
+        """ Add an image to the cache, evicting the least recently used images if necessary.
+
+        Args:
+            index (int): Index of the image
+            img (PIL.Image or numpy.ndarray): Image to store
+
+        Returns:
+            Boolean: Whether the image was stored in the cache
+        """
+        if isinstance(img, Image.Image):
+            if img.mode not in MODES:
+                return False
+            mode = MODES.index(img.mode)
+            img = np.asarray(img)
+        elif isinstance(img, np.ndarray):
+            mode = -1
+        else:
+            return False
+
+        dtype = next((i for i, d in enumerate(DTYPES) if img.dtype == d), None)
+        if dtype is None or img.ndim not in (2, 3):
+            return False
+        num_blocks = -(-img.nbytes // self.block_size)
+        if num_blocks > self.num_blocks:
+            log.debug(f'Image is too big for the cache [{img.nbytes}/{self.num_blocks * self.block_size}]')
+            return False
+
+        # Reserve blocks
+        entries = self.entries.numpy()
+        owner = self.owner.numpy()
+        with self.lock:
+            if entries[index, 0] != 0:      # Cached or being cached by another worker
+                return False
+
+            free = np.flatnonzero(owner == -1)
+            if len(free) < num_blocks:
+                self.__evict(num_blocks - len(free))
+                free = np.flatnonzero(owner == -1)
+                if len(free) < num_blocks:  # Remaining blocks are being written by other workers
+                    return False
+
+            blocks = free[:num_blocks]
+            owner[blocks] = index
+            entries[index, 0] = -1
+
+        # Write data
+        arena = self.arena.numpy()
+        data = np.ascontiguousarray(img).reshape(-1).view(np.uint8)
+        full = len(data) // self.block_size
+        arena[blocks[:full]] = data[:full * self.block_size].reshape(full, self.block_size)
+        if full < num_blocks:
+            arena[blocks[full], :len(data) - full * self.block_size] = data[full * self.block_size:]
+
+        # Commit
+        with self.lock:
+            channels = img.shape[2] if img.ndim == 3 else 0
+            entries[index] = (img.nbytes, img.shape[0], img.shape[1], channels, dtype, mode, self.__tick())
+
+        return True
+
+    def clear(self):
+        """ Remove all images from the cache. """
+        with self.lock:
+            self.owner.fill_(-1)
+            self.entries.zero_()
+
+    def __tick(self):
+        self.clock += 1
+        return self.clock.item()
+
+    def __evict(self, num_blocks):
+        """ Evict least recently used images until at least `num_blocks` blocks are freed. Should be called with the lock acquired. """
+        entries = self.entries.numpy()
+        cached = np.flatnonzero(entries[:, 0] > 0)
+        cached = cached[np.argsort(entries[cached, 6], kind='stable')]
+
+        sizes = -(-entries[cached, 0] // self.block_size)
+        victims = cached[:np.searchsorted(np.cumsum(sizes), num_blocks) + 1]
+
+        owner = self.owner.numpy()
+        owner[np.isin(owner, victims)] = -1
+        entries[victims] = 0
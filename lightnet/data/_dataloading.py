@@ -5,13 +5,18 @@
 
 import random
 import logging
+import queue
+import threading
 import collections
 from functools import wraps
+import numpy as np
 import torch
+import torch.distributed as dist
 from torch.utils.data.dataset import Dataset as torchDataset
 from torch.utils.data.sampler import BatchSampler as torchBatchSampler
 from torch.utils.data.dataloader import DataLoader as torchDataLoader
 from torch.utils.data.dataloader import default_collate
+from ._boxes import BoxArray
 
 try:
     import pandas as pd
@@ -21,7 +26,7 @@ except ModuleNotFoundError:
     bb = None
 
 
-__all__ = ['Dataset', 'DataLoader', 'brambox_collate', 'list_collate']
+__all__ = ['Dataset', 'DataLoader', 'BatchSampler', 'AspectRatioBatchSampler', 'DistributedBatchSampler', 'Prefetcher', 'brambox_collate', 'tensor_collate', 'list_collate']
 log = logging.getLogger(__name__)
 
 
@@ -162,12 +167,69 @@ class DataLoader(torchDataLoader):
                 else:
                     sampler = torch.utils.data.sampler.SequentialSampler(self.dataset)
             batch_sampler = BatchSampler(sampler, self.batch_size, self.drop_last, input_dimension=self.dataset.input_dim)
+        elif isinstance(batch_sampler, BatchSampler) and batch_sampler.input_dim is None:
+            batch_sampler.input_dim = self.dataset.input_dim
 
         self.sampler = sampler
         self.batch_sampler = batch_sampler
+        self.__epoch_order = None
+        self.__epoch_position = None
+        self.__resume_position = 0
 
         self.__initialized = True
 
+    def __iter__(self):
+        iterator = super().__iter__()
+        self.__epoch_order = getattr(self.batch_sampler, 'order', None)
+        self.__epoch_position = self.__resume_position
+        self.__resume_position = 0
+
+        for data in iterator:
+            self.__epoch_position += 1
+            yield data
+
+        self.__epoch_order = None
+        self.__epoch_position = None
+
+    def state_dict(self):
+        """ Get the state of the dataloader, which allows to resume an epoch where it was interrupted.
+
+        Return:
+            dict: State of the :class:`~lightnet.data.BatchSampler`, with the number of mini-batches of the current epoch that were consumed from this dataloader as position
+
+        Note:
+            Only a lightnet :class:`~lightnet.data.BatchSampler` has a state.
+            If this dataloader uses another batch sampler, this function returns an empty dictionary.
+
+        Note:
+            Because the workers of the dataloader fetch mini-batches in advance,
+            the position of the sampler itself is usually further than the number of mini-batches you processed.
+            This function takes this into account and returns the number of mini-batches that were actually returned by this dataloader.
+        """
+        if not isinstance(self.batch_sampler, BatchSampler):
+            return {}
+
+        state = self.batch_sampler.state_dict()
+        if self.__epoch_position is not None:
+            state['order'] = list(self.__epoch_order)
+            state['position'] = self.__epoch_position
+        return state
+
+    def load_state_dict(self, state):
+        """ Restore the state of the dataloader.
+        The next epoch will use the saved order of indices and skip the mini-batches that were already consumed, without loading them.
+
+        Args:
+            state (dict): State from :func:`~lightnet.data.DataLoader.state_dict`
+        """
+        if not isinstance(self.batch_sampler, BatchSampler):
+            if len(state) > 0:
+                raise TypeError(f'Cannot restore the state of a {type(self.batch_sampler).__name__}, only a lightnet BatchSampler has a state')
+            return
+
+        self.batch_sampler.load_state_dict(state)
+        self.__resume_position = state['position'] if state['order'] is not None else 0
+
     def change_input_dim(self, multiple=32, random_range=(10, 19)):
         """ This function will compute a new size and update it on the next mini_batch.
 
@@ -199,6 +261,8 @@ class DataLoader(torchDataLoader):
         else:
             size = (size * multiple[0], size * multiple[1])
 
+        if isinstance(self.batch_sampler, DistributedBatchSampler):
+            size = self.batch_sampler.broadcast_input_dim(size)
         self.batch_sampler.new_input_dim = size
 
         return size
@@ -208,24 +272,405 @@ class BatchSampler(torchBatchSampler):
     """ This batch sampler will generate mini-batches of (dim, index) tuples from another sampler.
     It works just like the :class:`torch.utils.data.sampler.BatchSampler`, but it will prepend a dimension,
     whilst ensuring it stays the same across one mini-batch.
+
+    Note:
+        The indices of the sampler are gathered at the start of each epoch,
+        so that the state of an epoch can be saved and restored with the ``state_dict()`` and ``load_state_dict()`` methods.
     """
     def __init__(self, *args, input_dimension=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.input_dim = input_dimension
-        self.new_input_dim = None
+        self.order = None
+        self.position = 0
+        self.__new_input_dim = None
+        self.__lock = threading.Lock()
+        self.__complete = False
+        self.__resume = None
+
+    def __getstate__(self):
+        # Locks cannot be pickled or deep-copied, so we create a new one when restoring
+        state = self.__dict__.copy()
+        del state['_BatchSampler__lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__lock = threading.Lock()
+
+    @property
+    def new_input_dim(self):
+        """ Input dimension that will be used from the next mini-batch onwards (**None** if there is no pending change). """
+        return self.__new_input_dim
+
+    @new_input_dim.setter
+    def new_input_dim(self, value):
+        with self.__lock:
+            self.__new_input_dim = value
 
     def __iter__(self):
+        if self.__resume is not None:
+            self.order, skip = self.__resume
+        else:
+            self.order, skip = self._order(), 0
+        self.position = 0
+        self.__complete = False
+
+        return self.__generate(self.order, skip)
+
+    def __generate(self, order, skip):
+        # Only consume the resume state once we start generating batches,
+        # as the multiprocessing dataloader iterator might call iter() multiple times.
+        self.__resume = None
         self.__set_input_dim()
-        for batch in super().__iter__():
-            yield [(self.input_dim, idx) for idx in batch]
+        for batch in self._batches(order):
+            self.position += 1
+            if self.position <= skip:
+                continue
+
+            input_dim = self._batch_input_dim(batch)
+            yield [(input_dim, idx) for idx in batch]
             self.__set_input_dim()
 
+        self.__complete = True
+
+    def state_dict(self):
+        """ Get the state of the sampler.
+
+        Return:
+            dict: Order of the indices of the current epoch, number of generated mini-batches and current/pending input dimension
+        """
+        if self.order is None or self.__complete:
+            order, position = None, 0
+        else:
+            order, position = list(self.order), self.position
+
+        return {
+            'order': order,
+            'position': position,
+            'input_dim': self.input_dim,
+            'new_input_dim': self.new_input_dim,
+        }
+
+    def load_state_dict(self, state):
+        """ Restore the state of the sampler.
+        The next epoch will use the saved order of indices and skip the mini-batches that were already generated.
+
+        Args:
+            state (dict): State from :func:`~lightnet.data.BatchSampler.state_dict`
+        """
+        self.input_dim = state['input_dim']
+        self.new_input_dim = state['new_input_dim']
+        if state['order'] is not None:
+            self.__resume = (list(state['order']), state['position'])
+        else:
+            self.__resume = None
+
+    def _order(self):
+        """ Get the order of indices for one epoch. """
+        return list(self.sampler)
+
+    def _batches(self, order):
+        """ Generate the mini-batches of indices from the order of indices of one epoch. """
+        batch = []
+        for idx in order:
+            batch.append(idx)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+
+        if len(batch) > 0 and not self.drop_last:
+            yield batch
+
+    def _batch_input_dim(self, batch):
+        """ Get the input dimension for a mini-batch of indices. """
+        return self.input_dim
+
     def __set_input_dim(self):
         """ This function randomly changes the the input dimension of the dataset. """
-        if self.new_input_dim is not None:
-            log.info(f'Resizing network {self.new_input_dim[:2]}')
-            self.input_dim = (self.new_input_dim[0], self.new_input_dim[1])
-            self.new_input_dim = None
+        with self.__lock:
+            if self.__new_input_dim is not None:
+                log.info(f'Resizing network {self.__new_input_dim[:2]}')
+                self.input_dim = (self.__new_input_dim[0], self.__new_input_dim[1])
+                self.__new_input_dim = None
+
+
+class AspectRatioBatchSampler(BatchSampler):
+    """ This batch sampler groups images with a similar aspect ratio together in mini-batches,
+    and gives each mini-batch a rectangular input dimension that matches the aspect ratio of its images.
+    This allows to reduce the amount of padding that gets added by eg. the :class:`~lightnet.data.transform.Letterbox` transform.
+
+    Args:
+        sampler (torch.utils.data.Sampler): Sampler that generates the indices
+        batch_size (int): Size of the mini-batches
+        drop_last (Boolean): Whether to drop the last incomplete mini-batch of each aspect ratio bucket
+        aspect_ratios (list): Aspect ratio (width / height) of each image in the dataset
+        num_buckets (int, optional): Number of aspect ratio buckets; Default **3**
+        stride (int, optional): Multiple that the width and height of the input dimension should have (eg. network stride); Default **32**
+        input_dimension (tuple, optional): Default (width, height) input dimension of the network; Default **input_dim of the dataset**
+
+    Note:
+        The input dimension of this sampler (which is changed with :func:`lightnet.data.DataLoader.change_input_dim`) is only used as a reference. |br|
+        The input dimension of a mini-batch is computed by reshaping this reference to the aspect ratio of the bucket,
+        whilst keeping the area (and thus the computational cost) more or less the same.
+        This means that random multi-scale training works exactly the same as with the regular :class:`~lightnet.data.BatchSampler`.
+
+    Note:
+        The images are divided in buckets of (roughly) equal size, by computing quantiles of their aspect ratios.
+        The aspect ratio of each bucket is then set to the median aspect ratio of all images inside that bucket.
+
+    Example:
+        >>> def get_aspect_ratio(key):                                                  # doctest: +SKIP
+        ...     with Image.open(dataset.id(key)) as img:     # Only reads the image header
+        ...         return img.size[0] / img.size[1]
+        >>> sampler = ln.data.AspectRatioBatchSampler(                                  # doctest: +SKIP
+        ...     torch.utils.data.RandomSampler(dataset),
+        ...     batch_size = 8,
+        ...     drop_last = True,
+        ...     aspect_ratios = [get_aspect_ratio(key) for key in dataset.keys],
+        ... )
+        >>> dl = ln.data.DataLoader(dataset, batch_sampler=sampler, collate_fn=ln.data.brambox_collate)  # doctest: +SKIP
+    """
+    def __init__(self, sampler, batch_size, drop_last, aspect_ratios, num_buckets=3, stride=32, input_dimension=None):
+        super().__init__(sampler, batch_size, drop_last, input_dimension=input_dimension)
+        self.stride = stride
+
+        log_ratios = np.log(np.asarray(aspect_ratios, dtype=np.float64))
+        edges = np.unique(np.quantile(log_ratios, np.linspace(0, 1, num_buckets+1)[1:-1]))
+        self.buckets = np.searchsorted(edges, log_ratios, 'right')
+        self.bucket_sizes = np.bincount(self.buckets, minlength=len(edges)+1)
+        self.bucket_ratios = np.ones(len(edges)+1)
+        for b in np.nonzero(self.bucket_sizes)[0]:
+            self.bucket_ratios[b] = np.exp(np.median(log_ratios[self.buckets == b]))
+
+    def __len__(self):
+        if self.drop_last:
+            return int((self.bucket_sizes // self.batch_size).sum())
+        return int(((self.bucket_sizes + self.batch_size - 1) // self.batch_size).sum())
+
+    def _batches(self, order):
+        pending = [[] for _ in self.bucket_sizes]
+        for idx in order:
+            bucket = pending[self.buckets[idx]]
+            bucket.append(idx)
+            if len(bucket) == self.batch_size:
+                yield bucket[:]
+                bucket.clear()
+
+        if not self.drop_last:
+            for bucket in pending:
+                if len(bucket) > 0:
+                    yield bucket
+
+    def _batch_input_dim(self, batch):
+        return self.bucket_input_dim(self.buckets[batch[0]])
+
+    def bucket_input_dim(self, bucket):
+        """ Compute the input dimension for a certain bucket, based on the current reference input dimension.
+
+        Args:
+            bucket (int): Bucket number
+
+        Returns:
+            tuple: (width, height) input dimension
+        """
+        area = self.input_dim[0] * self.input_dim[1]
+        ratio = self.bucket_ratios[bucket]
+        width = max(1, int(round((area * ratio) ** 0.5 / self.stride)))
+        height = max(1, int(round((area / ratio) ** 0.5 / self.stride)))
+        return (width * self.stride, height * self.stride)
+
+
+class DistributedBatchSampler(BatchSampler):
+    """ This batch sampler divides the indices of a dataset between the processes of a distributed training. |br|
+    Each process gets a different part of the (shuffled) indices, which are padded so that every process generates the same number of mini-batches.
+    When changing the input dimension with :func:`~lightnet.data.DataLoader.change_input_dim`,
+    the dimension of the source process gets broadcasted, so that all processes switch resolution on the same mini-batch.
+
+    Args:
+        dataset (torch.utils.data.Dataset): Dataset to sample from
+        batch_size (int): Size of the mini-batches
+        drop_last (Boolean): Whether to drop the last incomplete mini-batch
+        shuffle (Boolean, optional): Whether to shuffle the indices; Default **True**
+        seed (int, optional): Random seed for shuffling, which should be the same in all processes; Default **0**
+        num_replicas (int, optional): Number of processes; Default **world size of the default process group**
+        rank (int, optional): Rank of the current process; Default **rank in the default process group**
+        src (int, optional): Rank of the process that chooses the input dimension; Default **0**
+        input_dimension (tuple, optional): Default (width, height) input dimension of the network; Default **input_dim of the dataset**
+
+    Note:
+        Just like with the :class:`torch.utils.data.distributed.DistributedSampler`,
+        you should call :func:`~lightnet.data.DistributedBatchSampler.set_epoch` at the start of each epoch, to get a different shuffle every epoch.
+
+    Note:
+        Broadcasting the input dimension is a collective operation,
+        so all processes need to call :func:`~lightnet.data.DataLoader.change_input_dim` at the same point in the training
+        (eg. in a `batch_end` hook of your engine). |br|
+        The broadcast uses a CPU tensor, so you need a process group backend that supports these (eg. gloo).
+
+    Example:
+        >>> class CustomSet(ln.data.Dataset):
+        ...     def __len__(self):
+        ...         return 10
+        ...     @ln.data.Dataset.resize_getitem
+        ...     def __getitem__(self, index):
+        ...         return index
+        >>> dataset = CustomSet((200, 200))
+        >>> sampler = ln.data.DistributedBatchSampler(dataset, 2, False, shuffle=False, num_replicas=3, rank=1)
+        >>> [batch for batch in ln.data.DataLoader(dataset, batch_sampler=sampler)]
+        [tensor([1, 4]), tensor([7, 0])]
+    """
+    def __init__(self, dataset, batch_size, drop_last, shuffle=True, seed=0, num_replicas=None, rank=None, src=0, input_dimension=None):
+        super().__init__(torch.utils.data.sampler.SequentialSampler(dataset), batch_size, drop_last, input_dimension=input_dimension)
+        if num_replicas is None:
+            num_replicas = dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+        if rank is None:
+            rank = dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+        if rank < 0 or rank >= num_replicas:
+            raise ValueError(f'Invalid rank [{rank}/{num_replicas-1}]')
+
+        self.shuffle = shuffle
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.src = src
+        self.epoch = 0
+        self.num_samples = -(-len(self.sampler) // num_replicas)
+
+    def __len__(self):
+        if self.drop_last:
+            return self.num_samples // self.batch_size
+        return -(-self.num_samples // self.batch_size)
+
+    def set_epoch(self, epoch):
+        """ Set the epoch number, which is used to seed the shuffling of the indices.
+
+        Args:
+            epoch (int): Epoch number
+        """
+        self.epoch = epoch
+
+    def broadcast_input_dim(self, size):
+        """ Broadcast an input dimension from the source process to all other processes.
+
+        Args:
+            size (tuple): (width, height) input dimension of this process
+
+        Returns:
+            tuple: (width, height) input dimension of the source process
+        """
+        if not dist.is_available() or not dist.is_initialized():
+            return size
+
+        size = torch.tensor(size, dtype=torch.int64)
+        dist.broadcast(size, self.src)
+        return tuple(size.tolist())
+
+    def _order(self):
+        num_indices = len(self.sampler)
+        if self.shuffle:
+            generator = torch.Generator()
+            generator.manual_seed(self.seed + self.epoch)
+            order = torch.randperm(num_indices, generator=generator).tolist()
+        else:
+            order = list(range(num_indices))
+
+        padding = self.num_samples * self.num_replicas - num_indices
+        order += (order * (-(-padding // num_indices)))[:padding]
+        return order[self.rank::self.num_replicas]
+
+
+class Prefetcher:
+    """ Wrapper around a dataloader, that fetches the next mini-batches in a background thread. |br|
+    This allows to overlap the work that is done in the main process to get a mini-batch (eg. collating, preparing target tensors),
+    with the computations on the current mini-batch.
+
+    Args:
+        dataloader (torch.utils.data.DataLoader): Dataloader to fetch the data from
+        depth (int, optional): Maximal number of mini-batches that are prefetched; Default **2**
+        prepare (callable, optional): Function that gets called on each mini-batch in the background thread; Default **None**
+
+    Note:
+        All attributes and methods of the dataloader can be accessed through this object,
+        so you can eg. still call :func:`~lightnet.data.DataLoader.change_input_dim` on it.
+
+    Note:
+        When changing the input dimension, mini-batches that were already prefetched keep their original dimension.
+        This means that the new dimension will take effect at most ``depth`` mini-batches later than without prefetching
+        (on top of the mini-batches that are prefetched by the workers of the dataloader itself).
+        The dimension of all images in a single mini-batch is still guaranteed to be the same.
+
+    Note:
+        The position in the :func:`~lightnet.data.DataLoader.state_dict` of the wrapped dataloader includes the prefetched mini-batches.
+        When resuming from such a state, up to ``depth`` mini-batches of the interrupted epoch are thus skipped.
+
+    Example:
+        >>> class CustomSet(ln.data.Dataset):
+        ...     def __len__(self):
+        ...         return 4
+        ...     @ln.data.Dataset.resize_getitem
+        ...     def __getitem__(self, index):
+        ...         return index
+        >>> dl = ln.data.Prefetcher(
+        ...     ln.data.DataLoader(CustomSet((200,200)), batch_size=2),
+        ...     prepare = lambda data: data * 10
+        ... )
+        >>> for d in dl:
+        ...     d
+        tensor([ 0, 10])
+        tensor([20, 30])
+    """
+    def __init__(self, dataloader, depth=2, prepare=None):
+        self.dataloader = dataloader
+        self.depth = depth
+        self.prepare = prepare
+
+    def __getattr__(self, name):
+        if name == 'dataloader':
+            raise AttributeError(name)
+        return getattr(self.dataloader, name)
+
+    def __len__(self):
+        return len(self.dataloader)
+
+    def __iter__(self):
+        data_queue = queue.Queue(self.depth)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    data_queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def fetch():
+            try:
+                for data in self.dataloader:
+                    if self.prepare is not None:
+                        data = self.prepare(data)
+                    if not put((None, data)):
+                        return
+            except BaseException as err:
+                put((err, None))
+            else:
+                put((None, done))
+
+        thread = threading.Thread(target=fetch, daemon=True)
+        thread.start()
+        try:
+            while True:
+                err, data = data_queue.get()
+                if err is not None:
+                    raise err
+                if data is done:
+                    return
+                yield data
+        finally:
+            stop.set()
+            thread.join()
 
 
 def brambox_collate(batch):
@@ -233,9 +678,12 @@ def brambox_collate(batch):
 
     Note:
         If the dataframes contain an 'image' categorical column (aka. brambox dataframes),
-        they will be concatenated with the :func:`brambox.util.concat` function.
+        they will be concatenated with the :func:`brambox.util.concat` function. |br|
+        :class:`~lightnet.data.BoxArray` objects get converted to brambox dataframes first.
     """
-    if isinstance(batch[0], pd.DataFrame):
+    if isinstance(batch[0], BoxArray):
+        return brambox_collate([boxes.to_brambox() for boxes in batch])
+    elif isinstance(batch[0], pd.DataFrame):
         for i, df in enumerate(batch):
             df['batch_number'] = i
         if 'image' in batch[0].columns and batch[0].image.dtype == 'category':
@@ -249,6 +697,69 @@ def brambox_collate(batch):
         return default_collate(batch)
 
 
+def tensor_collate(batch):
+    """ Function that collates brambox dataframes or :class:`~lightnet.data.BoxArray` objects into one compact annotation tensor. |br|
+    The conversion from dataframes to tensors happens in the dataloader workers,
+    so that the main process does not need to concatenate or unpickle any dataframes.
+
+    Returns:
+        tuple: boxes tensor of dimension [num_anno, 6] and offsets tensor of dimension [batch_size + 1]
+
+    Note:
+        The boxes tensor contains the annotations of all images, sorted by image, in the following format:
+
+        .. math::
+
+            \\begin{bmatrix}
+                batch\\_num & class\\_id & x\\_top\\_left & y\\_top\\_left & width & height \\\\
+                batch\\_num & class\\_id & x\\_top\\_left & y\\_top\\_left & width & height \\\\
+                ...
+            \\end{bmatrix}
+
+        With all coordinates in pixels, like in the dataframes. |br|
+        The annotations of image `b` are ``boxes[offsets[b]:offsets[b+1]]``.
+
+    Note:
+        The dataframes need to have a `class_id` column (which the lightnet datasets add automatically).
+        Annotations with the ``ignore`` flag get a class_id of **-1**. |br|
+        The resulting tuple can be passed as target to the :class:`~lightnet.network.loss.RegionLoss`.
+    """
+    if isinstance(batch[0], pd.DataFrame):
+        offsets = np.zeros(len(batch) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(df.index) for df in batch])
+        boxes = np.empty((offsets[-1], 6), dtype=np.float32)
+
+        for i, df in enumerate(batch):
+            box = boxes[offsets[i]:offsets[i+1]]
+            box[:, 0] = i
+            box[:, 1] = df.class_id.values
+            box[:, 2] = df.x_top_left.values
+            box[:, 3] = df.y_top_left.values
+            box[:, 4] = df.width.values
+            box[:, 5] = df.height.values
+            if 'ignore' in df.columns:
+                box[df.ignore.values.astype(bool), 1] = -1
+
+        return torch.from_numpy(boxes), torch.from_numpy(offsets)
+    elif isinstance(batch[0], BoxArray):
+        offsets = np.zeros(len(batch) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(b) for b in batch])
+        boxes = np.empty((offsets[-1], 6), dtype=np.float32)
+
+        for i, b in enumerate(batch):
+            box = boxes[offsets[i]:offsets[i+1]]
+            box[:, 0] = i
+            box[:, 1] = np.where(b.ignore, -1, b.class_id)
+            box[:, 2:] = b.coords
+
+        return torch.from_numpy(boxes), torch.from_numpy(offsets)
+    elif isinstance(batch[0], collections.abc.Sequence) and not isinstance(batch[0], (str, bytes)):
+        transposed = zip(*batch)
+        return [tensor_collate(samples) for samples in transposed]
+    else:
+        return default_collate(batch)
+
+
 def list_collate(batch):
     """ Function that collates lists or tuples together into one list (of lists/tuples) and concatenates dataframes together.
     Use this as the collate function in a Dataloader, if you want to have a list of items as an output, as opposed to tensors (eg. Brambox.boxes).
@@ -0,0 +1,210 @@
+#
+#   Image decoders for the lightnet datasets
+#   Copyright EAVISE
+#
+
+import io
+import time
+import logging
+from abc import ABC, abstractmethod
+from PIL import Image
+import numpy as np
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+try:
+    import torch
+    import torchvision.io as tvio
+    if not all(hasattr(tvio, attr) for attr in ('read_file', 'decode_jpeg', 'decode_image', 'ImageReadMode')):
+        tvio = None     # Older torchvision versions have no image decoding functions
+except ImportError:
+    tvio = None
+
+__all__ = ['PillowDecoder', 'OpenCVDecoder', 'TorchvisionDecoder', 'get_decoder', 'benchmark_decoders']
+log = logging.getLogger(__name__)
+
+
+class BaseDecoder(ABC):
+    """ Base class for the image decoders of the lightnet datasets. |br|
+    A decoder gets called with the path of an image file and returns the decoded image,
+    either as a Pillow image or as a HxWxC RGB numpy array, which are the two image types that are supported by the lightnet transforms.
+    """
+    def __call__(self, path):
+        with open(path, 'rb') as f:
+            return self.decode(f.read())
+
+    @abstractmethod
+    def decode(self, data):
+        """ Decode an image from the bytes of an image file. """
+        pass
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}()'
+
+
+class PillowDecoder(BaseDecoder):
+    """ Decode images with the Pillow library. |br|
+    This is the default decoder of the lightnet datasets and returns Pillow images.
+
+    Note:
+        Images are opened lazily and only get decoded when they are first used (eg. by the first transform).
+        This allows the datasets to decode JPEG images at a reduced resolution (see `reduced_decode` in :class:`~lightnet.models.BramboxDataset`).
+    """
+    def __call__(self, path):
+        return Image.open(path)
+
+    def decode(self, data):
+        return Image.open(io.BytesIO(data))
+
+
+class OpenCVDecoder(BaseDecoder):
+    """ Decode images with the :func:`cv2.imdecode` function of OpenCV and return them as RGB numpy arrays.
+
+    Args:
+        unchanged (Boolean, optional): Keep the number of channels and the bit depth of the images (eg. for 16-bit depth maps); Default **False**
+
+    Note:
+        By default, images are always decoded to 3-channel uint8 RGB arrays.
+        With `unchanged`, grayscale images are returned as HxW arrays and images with an alpha channel are returned as RGBA arrays.
+
+    Note:
+        Just like the other decoders, we ignore the EXIF orientation tag of JPEG images,
+        so that the images have the same dimensions as with Pillow (which the annotations are usually made with).
+    """
+    def __init__(self, unchanged=False):
+        if cv2 is None:
+            raise ImportError('OpenCV needs to be installed to use this decoder')
+        self.unchanged = unchanged
+
+    def __call__(self, path):
+        return self.decode(np.fromfile(path, dtype=np.uint8))
+
+    def decode(self, data):
+        # Ignore the EXIF orientation, like Pillow and Torchvision, so that the annotations still match
+        flags = cv2.IMREAD_UNCHANGED if self.unchanged else cv2.IMREAD_COLOR
+        flags |= cv2.IMREAD_IGNORE_ORIENTATION
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+        if img is None:
+            raise ValueError('Could not decode image')
+
+        if img.ndim == 3 and img.shape[2] == 3:
+            cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=img)
+        elif img.ndim == 3 and img.shape[2] == 4:
+            cv2.cvtColor(img, cv2.COLOR_BGRA2RGBA, dst=img)
+        return img
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(unchanged={self.unchanged})'
+
+
+class TorchvisionDecoder(BaseDecoder):
+    """ Decode images with the :mod:`torchvision.io` functions and return them as RGB numpy arrays. |br|
+    JPEG images are decoded with :func:`torchvision.io.decode_jpeg` and other formats with :func:`torchvision.io.decode_image`.
+
+    Note:
+        Torchvision decodes images to CxHxW tensors, which we convert to contiguous HxWxC arrays for the lightnet transforms.
+    """
+    def __init__(self):
+        if tvio is None:
+            raise ImportError('Torchvision with image decoding support (torchvision.io.decode_jpeg) needs to be installed to use this decoder')
+
+    def __call__(self, path):
+        return self.__decode(tvio.read_file(path))
+
+    def decode(self, data):
+        return self.__decode(torch.from_numpy(np.frombuffer(bytearray(data), dtype=np.uint8)))
+
+    @staticmethod
+    def __decode(data):
+        if data[:2].tolist() == [0xFF, 0xD8]:
+            img = tvio.decode_jpeg(data, mode=tvio.ImageReadMode.RGB)
+        else:
+            img = tvio.decode_image(data, mode=tvio.ImageReadMode.RGB)
+        return img.permute(1, 2, 0).contiguous().numpy()
+
+
+DECODERS = {
+    'pillow': PillowDecoder,
+    'opencv': OpenCVDecoder,
+    'torchvision': TorchvisionDecoder,
+}
+
+
+def get_decoder(decoder=None):
+    """ Get an image decoder.
+
+    Args:
+        decoder (str or callable, optional): Name of the decoder (one of 'pillow', 'opencv' or 'torchvision') or a decoder object; Default **'pillow'**
+
+    Returns:
+        callable: Decoder, which takes the path of an image file and returns the decoded image
+
+    Example:
+        >>> ln.data.get_decoder('pillow')
+        PillowDecoder()
+    """
+    if decoder is None:
+        return PillowDecoder()
+    if callable(decoder):
+        return decoder
+    if decoder not in DECODERS:
+        raise ValueError(f'Unknown decoder "{decoder}", should be one of {list(DECODERS)} or a callable')
+    return DECODERS[decoder]()
+
+
+def benchmark_decoders(files, decoders=None, number=1):
+    """ Time how long the decoders take to decode a set of image files. |br|
+    Run this on a representative sample of your dataset, to find the fastest decoder for your images and machine.
+
+    Args:
+        files (list): Paths to the image files
+        decoders (list, optional): Decoders or names of decoders to compare; Default **all available decoders**
+        number (int, optional): Number of times each file gets decoded; Default **1**
+
+    Returns:
+        list: (decoder, seconds per image) tuples, sorted from fastest to slowest
+
+    Note:
+        Pillow images get decoded lazily, so we call their ``load()`` method to time the actual decoding. |br|
+        Decoders that fail to decode one of the files (eg. OpenCV cannot decode GIF images), are left out of the results.
+
+    Example:
+        >>> timings = ln.data.benchmark_decoders(files)         # doctest: +SKIP
+        >>> fastest = timings[0][0]                             # doctest: +SKIP
+        >>> dataset = ln.models.BramboxDataset(annos, (416, 416), labels, decoder=fastest)   # doctest: +SKIP
+    """
+    if decoders is None:
+        decoders = []
+        for cls in DECODERS.values():
+            try:
+                decoders.append(cls())
+            except ImportError:
+                continue
+    decoders = [get_decoder(d) for d in decoders]
+
+    # Read the files once, so that the first decoder does not pay for the disk access
+    for path in files:
+        with open(path, 'rb') as f:
+            f.read()
+
+    timings = []
+    for decoder in decoders:
+        try:
+            start = time.perf_counter()
+            for _ in range(number):
+                for path in files:
+                    img = decoder(path)
+                    if isinstance(img, Image.Image):
+                        img.load()
+            duration = (time.perf_counter() - start) / (number * len(files))
+        except Exception as err:
+            log.warning(f'{decoder} failed to decode the images and is not included in the benchmark [{err}]')
+            continue
+
+        log.debug(f'{decoder}: {duration * 1000:.3f} ms/image')
+        timings.append((decoder, duration))
+
+    return sorted(timings, key=lambda t: t[1])
@@ -5,4 +5,5 @@
 
 from ._preprocess import *
 from ._postprocess import *
+from ._batch import *
 from .util import *
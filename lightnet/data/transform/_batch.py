@@ -0,0 +1,238 @@
+#
+#   Batched data augmentation on collated image and box tensors
+#   The transformations work on the output of a dataloader with the tensor_collate function
+#   Copyright EAVISE
+#
+
+import math
+import inspect
+import logging
+from abc import ABC, abstractmethod
+import torch
+import torch.nn.functional as F
+
+__all__ = ['BatchRandomFlip', 'BatchRandomHSV', 'BatchRandomAffine']
+log = logging.getLogger(__name__)
+
+# PyTorch < 1.3 has no align_corners argument and always aligns the corners
+_has_align_corners = 'align_corners' in inspect.signature(F.grid_sample).parameters
+
+
+class BaseBatchTransform(ABC):
+    """ Base class for the batched augmentation transforms. |br|
+    These transforms work on a collated batch of images and the compact box tensors of :func:`~lightnet.data.tensor_collate`.
+    Each transform draws its random parameters per image as tensors and transforms the whole batch with a few vectorized torch operations.
+
+    The transforms can be called with:
+
+    - an image tensor of dimensions [batch, channels, height, width]
+    - an (images, boxes) tuple, with a [num_anno, 6] boxes tensor
+    - an (images, (boxes, offsets)) tuple, as returned by a dataloader with the :func:`~lightnet.data.tensor_collate` function
+
+    They return the same structure that was passed in.
+
+    Note:
+        As these transforms work on whole batches, they should be called in your main process,
+        where they can make use of the intra-op parallelism of PyTorch (or run on the GPU).
+        A good place to do this is the :func:`~lightnet.engine.Engine.prepare_batch` function of your engine.
+    """
+    def __call__(self, data):
+        if isinstance(data, torch.Tensor):
+            return self._tf(data, None)[0]
+
+        images, target = data
+        if target is None:
+            return self._tf(images, None)[0], None
+        elif isinstance(target, torch.Tensor):
+            return self._tf(images, target)
+
+        boxes, offsets = target
+        images, boxes = self._tf(images, boxes)
+        if boxes.shape[0] != offsets[-1]:
+            offsets = torch.zeros_like(offsets)
+            offsets[1:] = torch.cumsum(torch.bincount(boxes[:, 0].long(), minlength=images.shape[0]), 0)
+        return images, (boxes, offsets)
+
+    @abstractmethod
+    def _tf(self, images, boxes):
+        """ Transform the images and boxes (which can be **None**). """
+        return images, boxes
+
+
+class BatchRandomFlip(BaseBatchTransform):
+    """ Randomly flip the images of a batch and their boxes.
+
+    Args:
+        horizontal (Number [0-1]): Chance of flipping each image horizontally
+        vertical (Number [0-1], optional): Chance of flipping each image vertically; Default **0**
+
+    Example:
+        >>> flip = ln.data.transform.BatchRandomFlip(1)
+        >>> images = torch.arange(4.0).reshape(1, 1, 1, 4)
+        >>> boxes = torch.tensor([[0, 0, 0, 0, 1, 1]], dtype=torch.float)
+        >>> images, boxes = flip((images, boxes))
+        >>> images
+        tensor([[[[3., 2., 1., 0.]]]])
+        >>> boxes
+        tensor([[0., 0., 3., 0., 1., 1.]])
+    """
+    def __init__(self, horizontal, vertical=0):
+        self.horizontal = horizontal
+        self.vertical = vertical
+
+    def _tf(self, images, boxes):
+        batch, height, width = images.shape[0], images.shape[2], images.shape[3]
+        if boxes is not None:
+            boxes = boxes.clone()
+            batch_num = boxes[:, 0].long()
+
+        for dim, chance, size, coord in ((3, self.horizontal, width, 2), (2, self.vertical, height, 3)):
+            if chance <= 0:
+                continue
+
+            flip = torch.rand(batch, device=images.device) < chance
+            images = torch.where(flip[:, None, None, None], images.flip(dim), images)
+            if boxes is not None:
+                flip = flip.to(boxes.device)[batch_num]
+                boxes[flip, coord] = size - boxes[flip, coord] - boxes[flip, coord+2]
+
+        return images, boxes
+
+
+class BatchRandomHSV(BaseBatchTransform):
+    """ Perform a random HSV shift on the RGB images of a batch.
+
+    Args:
+        hue (Number): Random number between -hue,hue is used to shift the hue
+        saturation (Number): Random number between 1,saturation is used to shift the saturation; 50% chance to get 1/dSaturation in stead of dSaturation
+        value (Number): Random number between 1,value is used to shift the value; 50% chance to get 1/dValue in stead of dValue
+
+    Note:
+        The images should be floating point tensors with values between 0-1 and have the RGB data in their first 3 channels.
+        Other channels are left untouched. |br|
+        The random parameters are drawn in the same way as :class:`~lightnet.data.transform.RandomHSV`, but for each image separately.
+    """
+    def __init__(self, hue, saturation, value):
+        self.hue = hue
+        self.saturation = saturation
+        self.value = value
+
+    def _tf(self, images, boxes):
+        batch = images.shape[0]
+        rand = torch.rand(5, batch, 1, 1, device=images.device, dtype=images.dtype)
+        dh = (rand[0] * 2 - 1) * self.hue
+        ds = 1 + rand[1] * (self.saturation - 1)
+        ds = torch.where(rand[2] < 0.5, 1 / ds, ds)
+        dv = 1 + rand[3] * (self.value - 1)
+        dv = torch.where(rand[4] < 0.5, 1 / dv, dv)
+
+        # RGB -> HSV
+        rgb = images[:, :3]
+        maxc, argmax = rgb.max(1)
+        delta = maxc - rgb.min(1)[0]
+        safe_delta = delta.clamp(min=1e-8)
+        r, g, b = rgb.unbind(1)
+        h = torch.where(argmax == 0, (g - b) / safe_delta, torch.where(argmax == 1, 2 + (b - r) / safe_delta, 4 + (r - g) / safe_delta))
+        h = torch.where(delta > 0, h / 6, torch.zeros_like(h))
+        s = torch.where(maxc > 0, delta / maxc.clamp(min=1e-8), torch.zeros_like(maxc))
+
+        # Shift
+        h = torch.remainder(h + dh, 1)
+        s = (s * ds).clamp(0, 1)
+        v = (maxc * dv).clamp(0, 1)
+
+        # HSV -> RGB
+        k = torch.remainder(torch.tensor([5, 3, 1], device=images.device, dtype=images.dtype)[None, :, None, None] + h[:, None] * 6, 6)
+        rgb = v[:, None] - (v * s)[:, None] * torch.min(k, 4 - k).clamp(0, 1)
+
+        if images.shape[1] > 3:
+            rgb = torch.cat([rgb, images[:, 3:]], 1)
+
+        return rgb, boxes
+
+
+class BatchRandomAffine(BaseBatchTransform):
+    """ Randomly translate, scale and rotate the images of a batch and their boxes.
+
+    Args:
+        translate (Number [0-1], optional): Maximal translation, as a fraction of the image width and height; Default **0**
+        scale (Number [0-1], optional): Random number between 1-scale,1+scale is used to scale the images; Default **0**
+        rotate (Number, optional): Random number between -rotate,rotate is used as rotation angle in degrees; Default **0**
+        fill_color (Number, optional): Value that is used to fill the pixels that come from outside of the images; Default **0.5**
+        intersection_threshold (Number [0-1], optional): Minimal percentage of the transformed box area that still needs to be inside the image; Default **0.001**
+
+    Note:
+        The images are scaled and rotated around their center and sampled with bilinear interpolation. |br|
+        The boxes are replaced by the bounding rectangle of their transformed corners, clipped to the image.
+        Boxes that are (almost) entirely outside of the image get removed from the batch.
+    """
+    def __init__(self, translate=0, scale=0, rotate=0, fill_color=0.5, intersection_threshold=0.001):
+        self.translate = translate
+        self.scale = scale
+        self.rotate = rotate
+        self.fill_color = fill_color
+        self.intersection_threshold = intersection_threshold
+
+    def _tf(self, images, boxes):
+        batch, height, width = images.shape[0], images.shape[2], images.shape[3]
+        rand = torch.rand(4, batch, device=images.device, dtype=torch.float64) * 2 - 1
+        scale = 1 + rand[0] * self.scale
+        angle = rand[1] * math.radians(self.rotate)
+        cos_a = torch.cos(angle) * scale
+        sin_a = torch.sin(angle) * scale
+
+        # Pixel coordinate matrices (input -> output), rotating counter-clockwise around the image center
+        cx, cy = width / 2, height / 2
+        matrix = torch.zeros(batch, 3, 3, device=images.device, dtype=torch.float64)
+        matrix[:, 0, 0] = cos_a
+        matrix[:, 0, 1] = sin_a
+        matrix[:, 1, 0] = -sin_a
+        matrix[:, 1, 1] = cos_a
+        matrix[:, 0, 2] = cx - cos_a * cx - sin_a * cy + rand[2] * self.translate * width
+        matrix[:, 1, 2] = cy + sin_a * cx - cos_a * cy + rand[3] * self.translate * height
+        matrix[:, 2, 2] = 1
+
+        # Sample images: grid_sample needs output -> input matrices in normalized coordinates
+        # (-1 and 1 are the image borders, or the centers of the border pixels when aligning corners)
+        if _has_align_corners:
+            kwargs = {'align_corners': False}
+            norm = [[2 / width, 0, -1], [0, 2 / height, -1], [0, 0, 1]]
+        else:
+            kwargs = {}
+            w, h = max(width - 1, 1), max(height - 1, 1)
+            norm = [[2 / w, 0, -1 - 1 / w], [0, 2 / h, -1 - 1 / h], [0, 0, 1]]
+        norm = torch.tensor(norm, device=images.device, dtype=torch.float64)
+        theta = norm @ torch.inverse(matrix) @ torch.inverse(norm)
+        grid = F.affine_grid(theta[:, :2].to(images.dtype), images.shape, **kwargs)
+        if self.fill_color:
+            images = F.grid_sample(images - self.fill_color, grid, mode='bilinear', padding_mode='zeros', **kwargs) + self.fill_color
+        else:
+            images = F.grid_sample(images, grid, mode='bilinear', padding_mode='zeros', **kwargs)
+
+        if boxes is None or boxes.shape[0] == 0:
+            return images, boxes
+
+        # Transform box corners
+        matrix = matrix.to(boxes.device)[boxes[:, 0].long()]
+        x1, y1 = boxes[:, 2].double(), boxes[:, 3].double()
+        x2, y2 = x1 + boxes[:, 4], y1 + boxes[:, 5]
+        corners = torch.stack([
+            torch.stack([x1, x2, x2, x1], 1),
+            torch.stack([y1, y1, y2, y2], 1),
+            torch.ones_like(x1)[:, None].expand(-1, 4),
+        ], 1)
+        corners = (matrix @ corners)[:, :2]
+        tl = corners.min(2)[0]
+        br = corners.max(2)[0]
+        area = (br - tl).prod(1)
+
+        limit = torch.tensor([width, height], device=boxes.device, dtype=torch.float64)
+        tl = torch.max(tl, torch.zeros_like(tl))
+        br = torch.min(br, limit)
+        wh = (br - tl).clamp(min=0)
+        keep = wh.prod(1) >= self.intersection_threshold * area
+
+        boxes = boxes.clone()
+        boxes[:, 2:4] = tl.to(boxes.dtype)
+        boxes[:, 4:6] = wh.to(boxes.dtype)
+        return images, boxes[keep]
@@ -0,0 +1,164 @@
+#
+#   Fusion of adjacent transforms in a Compose pipeline
+#   Copyright EAVISE
+#
+
+import logging
+import numpy as np
+from PIL import Image
+import torch
+from ._preprocess import Letterbox, RandomFlip, RandomJitter, RandomRotate, RandomWarp
+from .util import BaseMultiTransform
+
+__all__ = []
+log = logging.getLogger(__name__)
+
+
+class FusedToTensorNormalize:
+    """ Fused version of :class:`torchvision.transforms.ToTensor` followed by :class:`torchvision.transforms.Normalize`. |br|
+    Images in uint8 are scaled and normalized in one pass, other images are passed through the original transforms.
+
+    Args:
+        to_tensor (torchvision.transforms.ToTensor): Original ToTensor transform
+        normalize (torchvision.transforms.Normalize): Original Normalize transform
+    """
+    def __init__(self, to_tensor, normalize):
+        self.to_tensor = to_tensor
+        self.normalize = normalize
+
+        std = np.asarray(normalize.std, dtype=np.float32).reshape(-1, 1, 1)
+        mean = np.asarray(normalize.mean, dtype=np.float32).reshape(-1, 1, 1)
+        self.scale = 1 / (255 * std)
+        self.shift = mean / std
+
+    def __call__(self, img):
+        if isinstance(img, Image.Image) and img.mode in ('L', 'RGB', 'RGBA'):
+            img_np = np.asarray(img)
+        elif isinstance(img, np.ndarray) and img.dtype == np.uint8:
+            img_np = img
+        else:
+            return self.normalize(self.to_tensor(img))
+
+        if img_np.ndim == 2:
+            img_np = img_np[:, :, None]
+
+        out = np.empty((img_np.shape[2], img_np.shape[0], img_np.shape[1]), dtype=np.float32)
+        np.multiply(img_np.transpose(2, 0, 1), self.scale, out=out)
+        out -= self.shift
+        return torch.from_numpy(out)
+
+
+def is_torchvision(tf, name):
+    cls = tf.__class__
+    return cls.__name__ == name and cls.__module__.startswith('torchvision')
+
+
+def fuse_geometric(transforms):
+    """ RandomJitter, RandomRotate, RandomFlip, Letterbox -> RandomWarp """
+    idx = 0
+    jitter = rotate = flip = None
+    if idx < len(transforms) and type(transforms[idx]) is RandomJitter:
+        jitter = transforms[idx]
+        idx += 1
+    if idx < len(transforms) and type(transforms[idx]) is RandomRotate:
+        rotate = transforms[idx]
+        idx += 1
+    if idx < len(transforms) and type(transforms[idx]) is RandomFlip:
+        flip = transforms[idx]
+        idx += 1
+    if idx == 0 or idx >= len(transforms) or type(transforms[idx]) is not Letterbox:
+        return None
+
+    letterbox = transforms[idx]
+    fill = letterbox.fill_color
+    if (jitter is not None and jitter.fill_color != fill) or (rotate is not None and rotate.fill_color != fill):
+        return None
+    if flip is not None and flip.vertical != 0:
+        return None
+
+    fused = RandomWarp(
+        dimension=letterbox.dimension,
+        dataset=letterbox.dataset,
+        jitter=jitter.jitter if jitter is not None else 0,
+        flip=flip.horizontal if flip is not None else 0,
+        rotate=rotate.jitter if rotate is not None else 0,
+        fill_color=fill,
+        crop_anno=jitter.crop_anno if jitter is not None else False,
+        intersection_threshold=jitter.intersection_threshold if jitter is not None else 0.001,
+    )
+    return idx + 1, fused
+
+
+def fuse_to_tensor(transforms):
+    """ ToTensor, Normalize -> FusedToTensorNormalize """
+    if len(transforms) >= 2 and is_torchvision(transforms[0], 'ToTensor') and is_torchvision(transforms[1], 'Normalize'):
+        return 2, FusedToTensorNormalize(transforms[0], transforms[1])
+    return None
+
+
+RULES = [fuse_geometric, fuse_to_tensor]
+
+
+def shared_consistently(group, pipelines):
+    """ Check that the transforms of a group appear either all contiguously and in the same order or not at all in each pipeline. """
+    ids = [id(tf) for tf in group]
+    for pipeline in pipelines:
+        pipeline_ids = [id(tf) for tf in pipeline]
+        present = [i in pipeline_ids for i in ids]
+        if not any(present):
+            continue
+        if not all(present):
+            return False
+
+        start = pipeline_ids.index(ids[0])
+        if pipeline_ids[start:start+len(ids)] != ids:
+            return False
+
+    return True
+
+
+def plan(pipelines, standalone=False):
+    """ Fuse the transforms of the first pipeline and apply the same fusions to the other pipelines.
+    Multi-transforms are only fused if other pipelines are given or if `standalone` is True,
+    as they are usually shared with an annotation pipeline, which would otherwise keep the original transforms.
+
+    Returns:
+        list: List with a list of transforms for each pipeline
+    """
+    main, others = list(pipelines[0]), [list(p) for p in pipelines[1:]]
+    fusions = []        # (group, fused)
+
+    idx = 0
+    while idx < len(main):
+        for rule in RULES:
+            match = rule(main[idx:])
+            if match is None:
+                continue
+
+            length, fused = match
+            group = main[idx:idx+length]
+            if len(others) == 0 and not standalone and any(isinstance(tf, BaseMultiTransform) for tf in group):
+                log.warning(
+                    f'Not fusing {[tf.__class__.__name__ for tf in group]}, as they might be shared with another pipeline. '
+                    'Plan all pipelines together or pass standalone=True if they are not shared'
+                )
+            elif shared_consistently(group, others):
+                fusions.append((group, fused))
+                idx += length
+                break
+            log.debug(f'Not fusing {[tf.__class__.__name__ for tf in group]}, as they are not shared consistently in all pipelines')
+        else:
+            idx += 1
+
+    planned = []
+    for pipeline in [main] + others:
+        pipeline = list(pipeline)
+        for group, fused in fusions:
+            ids = [id(tf) for tf in pipeline]
+            if id(group[0]) not in ids:
+                continue
+            start = ids.index(id(group[0]))
+            pipeline[start:start+len(group)] = [fused]
+        planned.append(pipeline)
+
+    return planned
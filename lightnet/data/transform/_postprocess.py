@@ -15,7 +15,7 @@ try:
 except ModuleNotFoundError:
     pd = None
 
-__all__ = ['GetBoundingBoxes', 'NonMaxSuppression', 'NonMaxSupression', 'TensorToBrambox', 'ReverseLetterbox']
+__all__ = ['GetBoundingBoxes', 'NonMaxSuppression', 'NonMaxSupression', 'TensorToBrambox', 'TensorToArray', 'ArrayToBrambox', 'FusedPostprocess', 'ReverseLetterbox']
 log = logging.getLogger(__name__)
 
 
@@ -32,6 +32,23 @@ class GetBoundingBoxes(BaseTransform):
 
     Note:
         The output tensor uses relative values for its coordinates.
+
+    Note:
+        The network output is left untouched, so you can still use it afterwards (eg. to compute the loss). |br|
+        The confidence of each cell is computed directly from the logits as ``sigmoid(obj) * exp(max(cls) - logsumexp(cls))``,
+        which is the maximal softmax probability without computing the full softmax.
+        Only the cells that pass the threshold get their box coordinates decoded,
+        and the grid coordinates of the cells are cached for each (height, width, device) combination.
+
+    Example:
+        >>> get_boxes = ln.data.transform.GetBoundingBoxes(2, [(1, 1), (2, 2)], 0.5)
+        >>> output = torch.zeros(1, 2 * 7, 2, 3)
+        >>> output[0, 4, 1, 2] = 5          # Objectness of first anchor at x=2, y=1
+        >>> output[0, 5, 1, 2] = 3          # Class 0 logit
+        >>> get_boxes(output)
+        tensor([[0.0000, 0.8333, 0.7500, 0.3333, 0.5000, 0.9462, 0.0000]])
+        >>> output.abs().sum().item()       # Not modified
+        8.0
     """
     def __init__(self, num_classes, anchors, conf_thresh):
         self.num_classes = num_classes
@@ -39,59 +56,64 @@ class GetBoundingBoxes(BaseTransform):
         self.anchors = torch.Tensor(anchors)
         self.num_anchors = self.anchors.shape[0]
         self.anchors_step = self.anchors.shape[1]
+        self._grids = {}
 
     def __call__(self, network_output):
         # Check dimensions
         if network_output.dim() == 3:
-            network_output.unsqueeze_(0)
+            network_output = network_output.unsqueeze(0)
 
         # Variables
         device = network_output.device
         batch = network_output.size(0)
         h = network_output.size(2)
         w = network_output.size(3)
-
-        # Compute xc,yc, w,h, box_score on Tensor
-        lin_x = torch.linspace(0, w-1, w).repeat(h, 1).view(h*w).to(device)
-        lin_y = torch.linspace(0, h-1, h).view(h, 1).repeat(1, w).view(h*w).to(device)
-        anchor_w = self.anchors[:, 0].contiguous().view(1, self.num_anchors, 1).to(device)
-        anchor_h = self.anchors[:, 1].contiguous().view(1, self.num_anchors, 1).to(device)
-
+        lin_x, lin_y, anchor_w, anchor_h = self._get_grid(h, w, device)
         network_output = network_output.view(batch, self.num_anchors, -1, h*w)  # -1 == 5+num_classes (we can drop feature maps if 1 class)
-        network_output[:, :, 0, :].sigmoid_().add_(lin_x).div_(w)               # X center
-        network_output[:, :, 1, :].sigmoid_().add_(lin_y).div_(h)               # Y center
-        network_output[:, :, 2, :].exp_().mul_(anchor_w).div_(w)                # Width
-        network_output[:, :, 3, :].exp_().mul_(anchor_h).div_(h)                # Height
-        network_output[:, :, 4, :].sigmoid_()                                   # Box score
 
-        # Compute class_score
+        # Compute class_score: max(softmax(cls)) = exp(max(cls) - logsumexp(cls))
+        conf = network_output[:, :, 4, :].sigmoid()
         if self.num_classes > 1:
-            with torch.no_grad():
-                cls_scores = torch.nn.functional.softmax(network_output[:, :, 5:, :], 2)
-            cls_max, cls_max_idx = torch.max(cls_scores, 2)
-            cls_max_idx = cls_max_idx.float()
-            cls_max.mul_(network_output[:, :, 4, :])
+            cls_logits = network_output[:, :, 5:, :]
+            cls_max, cls_max_idx = torch.max(cls_logits, 2)
+            cls_max = (cls_max - torch.logsumexp(cls_logits, 2)).exp_().mul_(conf)
         else:
-            cls_max = network_output[:, :, 4, :]
-            cls_max_idx = torch.zeros_like(cls_max)
+            cls_max = conf
+            cls_max_idx = None
 
         score_thresh = cls_max > self.conf_thresh
-        if score_thresh.sum() == 0:
+        if not score_thresh.any():
             return torch.tensor([])
 
-        # Mask select boxes > conf_thresh
-        coords = network_output.transpose(2, 3)[..., 0:4]
-        coords = coords[score_thresh[..., None].expand_as(coords)].view(-1, 4)
-        scores = cls_max[score_thresh]
-        idx = cls_max_idx[score_thresh]
-
-        # Get batch numbers of the detections
-        batch_num = score_thresh.view(batch, -1)
-        nums = torch.arange(1, batch+1, dtype=batch_num.dtype, device=batch_num.device)
-        batch_num = (batch_num * nums[:, None])[batch_num] - 1
+        # Only decode the boxes of the cells that pass the threshold
+        batch_num, anchor, cell = torch.nonzero(score_thresh).unbind(1)
+        raw = network_output[batch_num, anchor, :4, cell]
+        coords = torch.empty_like(raw)
+        coords[:, 0] = raw[:, 0].sigmoid().add_(lin_x[cell]).div_(w)                # X center
+        coords[:, 1] = raw[:, 1].sigmoid().add_(lin_y[cell]).div_(h)                # Y center
+        coords[:, 2] = raw[:, 2].exp().mul_(anchor_w[anchor]).div_(w)               # Width
+        coords[:, 3] = raw[:, 3].exp().mul_(anchor_h[anchor]).div_(h)               # Height
+
+        scores = cls_max[batch_num, anchor, cell]
+        if cls_max_idx is not None:
+            idx = cls_max_idx[batch_num, anchor, cell].float()
+        else:
+            idx = torch.zeros_like(scores)
 
         return torch.cat([batch_num[:, None].float(), coords, scores[:, None], idx[:, None]], dim=1)
 
+    def _get_grid(self, h, w, device):
+        """ Get the x and y coordinates of the cells and the anchor width and height, cached per (h, w, device). """
+        key = (h, w, str(device))
+        if key not in self._grids:
+            self._grids[key] = (
+                torch.arange(w, dtype=torch.float, device=device).repeat(h),
+                torch.arange(h, dtype=torch.float, device=device).repeat_interleave(w),
+                self.anchors[:, 0].to(device),
+                self.anchors[:, 1].to(device),
+            )
+        return self._grids[key]
+
 
 class NonMaxSuppression(BaseTransform):
     """ Performs nms on the bounding boxes, filtering boxes with a high overlap.
@@ -99,6 +121,9 @@ class NonMaxSuppression(BaseTransform):
     Args:
         nms_thresh (Number [0-1]): Overlapping threshold to filter detections with non-maxima suppresion
         class_nms (Boolean, optional): Whether to perform nms per class; Default **True**
+        top_k (int, optional): Only keep the `top_k` highest scoring boxes of each image (or of each class in each image, if `class_nms` is True) before running nms; Default **None**
+        max_det (int, optional): Maximal number of detections per image, keeping the ones with the highest score after nms; Default **None**
+        tile_size (int, optional): Maximal number of box pairs for which we compute the overlap at once; Default **2**22**
 
     Returns:
         (Tensor [Boxes x 7]]): **[batch_num, x_center, y_center, width, height, confidence, class_id]** for every bounding box
@@ -106,65 +131,155 @@ class NonMaxSuppression(BaseTransform):
     Note:
         This post-processing function expects the input to be bounding boxes,
         like the ones created by :class:`lightnet.data.GetBoundingBoxes` and outputs exactly the same format.
+
+    Note:
+        The boxes of all images (and classes) are processed at once, without looping over them in Python. |br|
+        We sort the boxes per image (and class) and by descending score, so that each group of boxes is contiguous,
+        and compute the overlap of each box with the boxes of its group that have a higher score.
+        The greedy suppression is then solved by iterating ``keep = not (any kept box with a higher score overlaps)`` until nothing changes,
+        which takes as many vectorized iterations as the longest chain of boxes that suppress each other (usually a handful).
+
+    Note:
+        With a low confidence threshold (eg. 0.001 for mAP evaluation), there can be tens of thousands of candidate boxes.
+        The overlaps are computed and the suppression is resolved in tiles of at most `tile_size` box pairs,
+        which bounds the working memory without changing the results. |br|
+        The `top_k` argument limits the number of boxes in each group, and thus the number of overlaps that need to be computed and stored.
+        This does change the results (but usually only removes boxes with a negligible score).
+
+    Example:
+        >>> nms = ln.data.transform.NonMaxSuppression(0.5)
+        >>> boxes = torch.tensor([
+        ...     [0, 0.50, 0.50, 0.2, 0.2, 0.9, 0],
+        ...     [0, 0.51, 0.50, 0.2, 0.2, 0.8, 0],     # Suppressed by the first box
+        ...     [0, 0.51, 0.50, 0.2, 0.2, 0.7, 1],     # Other class
+        ...     [1, 0.51, 0.50, 0.2, 0.2, 0.6, 0],     # Other image
+        ... ])
+        >>> nms(boxes)[:, [0, 5, 6]]
+        tensor([[0.0000, 0.9000, 0.0000],
+                [0.0000, 0.7000, 1.0000],
+                [1.0000, 0.6000, 0.0000]])
+        >>> ln.data.transform.NonMaxSuppression(0.5, max_det=1)(boxes)[:, [0, 5, 6]]
+        tensor([[0.0000, 0.9000, 0.0000],
+                [1.0000, 0.6000, 0.0000]])
     """
-    def __init__(self, nms_thresh, class_nms=True):
+    def __init__(self, nms_thresh, class_nms=True, top_k=None, max_det=None, tile_size=2**22):
         self.nms_thresh = nms_thresh
         self.class_nms = class_nms
+        self.top_k = top_k
+        self.max_det = max_det
+        self.tile_size = tile_size
 
     def __call__(self, boxes):
         if boxes.numel() == 0:
             return boxes
 
-        batches = boxes[:, 0]
-        keep = torch.empty(boxes.shape[0], dtype=torch.uint8, device=boxes.device)
-        for batch in torch.unique(batches, sorted=False):
-            mask = batches == batch
-            keep[mask] = self._nms(boxes[mask])
+        keep = self._nms(boxes)
+        if self.max_det is not None:
+            batches = boxes[keep, 0].long()
+            order, rank = self._group_sort(batches, boxes[keep, 5])
+            keep[torch.nonzero(keep)[order[rank >= self.max_det], 0]] = False
 
         return boxes[keep]
 
-    def _nms(self, boxes):
-        if boxes.numel() == 0:
-            return boxes
-
-        a = boxes[:, 1:3]
-        b = boxes[:, 3:5]
-        bboxes = torch.cat([a-b/2, a+b/2], 1)
-        scores = boxes[:, 5]
-        classes = boxes[:, 6]
-
-        # Sort coordinates by descending score
-        scores, order = scores.sort(0, descending=True)
-        x1, y1, x2, y2 = bboxes[order].split(1, 1)
-
-        # Compute dx and dy between each pair of boxes (these mat contain every pair twice...)
-        dx = (x2.min(x2.t()) - x1.max(x1.t())).clamp(min=0)
-        dy = (y2.min(y2.t()) - y1.max(y1.t())).clamp(min=0)
-
-        # Compute iou
-        intersections = dx * dy
-        areas = (x2 - x1) * (y2 - y1)
-        unions = (areas + areas.t()) - intersections
-        ious = intersections / unions
+    @staticmethod
+    def _group_sort(group, scores):
+        """ Sort boxes by group and by descending score within each group.
+
+        Returns:
+            tuple: sort order and the rank of each (sorted) box within its group
+        """
+        # Sort once on a unique key: group number and descending score rank
+        num_boxes = scores.shape[0]
+        positions = torch.arange(num_boxes, device=scores.device)
+        _, by_score = scores.sort(0, descending=True)
+        score_rank = torch.empty_like(positions)
+        score_rank[by_score] = positions
+        _, order = (group * num_boxes + score_rank).sort(0)
+
+        # Rank = position - position of the first box of the group
+        group = group[order]
+        first = torch.ones_like(group)
+        first[1:] = (group[1:] != group[:-1]).long()
+        group_start = positions[first > 0]
+        rank = positions - group_start[first.cumsum(0) - 1]
+        return order, rank
 
-        # Filter based on iou (and class)
-        conflicting = (ious > self.nms_thresh).triu(1)
+    def _nms(self, boxes):
+        """ Compute a keep mask for the boxes of all images. """
+        mask = torch.zeros(boxes.shape[0], dtype=torch.uint8, device=boxes.device)
 
+        # Sort by group (image and class) and by descending score within each group
+        group = boxes[:, 0].long()
         if self.class_nms:
-            classes = classes[order]
-            same_class = (classes.unsqueeze(0) == classes.unsqueeze(1))
-            conflicting = (conflicting & same_class)
-
-        conflicting = conflicting.cpu()
-        keep = torch.zeros(len(conflicting), dtype=torch.uint8)
-        supress = torch.zeros(len(conflicting), dtype=torch.float)
-        for i, row in enumerate(conflicting):
-            if not supress[i]:
-                keep[i] = 1
-                supress[row] = 1
-
-        keep = keep.to(boxes.device)
-        return keep.scatter(0, order, keep)
+            classes = boxes[:, 6].long()
+            group = group * (int(classes.max()) + 1) + classes
+        order, rank = self._group_sort(group, boxes[:, 5])
+        if self.top_k is not None:
+            order = order[rank < self.top_k]
+            rank = rank[rank < self.top_k]
+        group = group[order]
+        num_boxes = order.shape[0]
+
+        a = boxes[order, 1:3]
+        b = boxes[order, 3:5]
+        x1, y1 = (a - b/2).unbind(1)
+        x2, y2 = (a + b/2).unbind(1)
+
+        # Higher scoring boxes of the same group are at most `width` positions before each box,
+        # so we compare each box with a sliding window over the previous boxes (prev[i, k] is box i-width+k)
+        width = int(rank.max())
+        if width == 0:
+            mask[order] = 1
+            return mask > 0
+
+        def prev(values, fill=0):
+            return torch.cat([values.new_full((width,), fill), values[:-1]]).unfold(0, width, 1)
+
+        x1_prev, y1_prev, x2_prev, y2_prev = prev(x1), prev(y1), prev(x2), prev(y2)
+        areas = (x2 - x1) * (y2 - y1)
+        areas_prev = prev(areas)
+        group_prev = prev(group, -1)
+
+        # Resolve the suppression in tiles of rows, in order of descending score.
+        # The boxes of previous tiles are final, so we only need to keep the conflicting pairs of the current tile.
+        keep = torch.ones(num_boxes, dtype=torch.uint8, device=boxes.device)
+        rows = max(1, self.tile_size // width)
+        for start in range(0, num_boxes, rows):
+            tile = slice(start, start + rows)
+
+            # Compute dx and dy between each box and its predecessors
+            dx = x2[tile, None].min(x2_prev[tile]).sub_(x1[tile, None].max(x1_prev[tile])).clamp_(min=0)
+            dy = y2[tile, None].min(y2_prev[tile]).sub_(y1[tile, None].max(y1_prev[tile])).clamp_(min=0)
+
+            # Compute iou
+            intersections = dx.mul_(dy)
+            unions = (areas[tile, None] + areas_prev[tile]).sub_(intersections)
+            ious = intersections.div_(unions)
+
+            # Filter based on iou and group
+            conflicting = (ious > self.nms_thresh) & (group_prev[tile] == group[tile, None])
+            box, idx = conflicting.nonzero().unbind(1)
+            suppressor = box + start - width + idx
+
+            # Suppression by boxes of previous tiles
+            previous = suppressor < start
+            keep[box[previous][keep[suppressor[previous]] > 0] + start] = 0
+
+            # Greedy suppression within the tile: a box is kept if none of the kept boxes with a higher score conflict with it
+            current = suppressor >= start
+            box, suppressor = box[current], suppressor[current] - start
+            initial_keep = keep[tile].clone()
+            tile_keep = initial_keep
+            while True:
+                new_keep = initial_keep.clone()
+                new_keep[box[tile_keep[suppressor] > 0]] = 0
+                if torch.equal(new_keep, tile_keep):
+                    break
+                tile_keep = new_keep
+            keep[tile] = tile_keep
+
+        mask[order] = keep
+        return mask > 0
 
 
 def NonMaxSupression(*args, **kwargs):
@@ -226,6 +341,176 @@ class TensorToBrambox(BaseTransform):
         return boxes[['image', 'class_label', 'id', 'x_top_left', 'y_top_left', 'width', 'height', 'confidence']]
 
 
+class TensorToArray(BaseTransform):
+    """ Converts a tensor to a structured numpy array, without going through pandas.
+
+    Args:
+        network_size (tuple): Tuple containing the width and height of the images going in the network
+
+    Returns:
+        numpy.ndarray: structured array with the fields **image, x_top_left, y_top_left, width, height, confidence, class_id**, sorted by image.
+
+    Note:
+        The coordinates are converted to absolute top-left coordinates on the device of the tensor,
+        so that there is only a single transfer to the CPU and no pandas overhead. |br|
+        Use :func:`~lightnet.data.transform.TensorToArray.offsets` to get the detections of each image
+        and :class:`~lightnet.data.transform.ArrayToBrambox` if you need a brambox dataframe after all.
+
+    Example:
+        >>> to_array = ln.data.transform.TensorToArray((100, 200))
+        >>> boxes = torch.tensor([
+        ...     [0, 0.5, 0.5, 0.2, 0.1, 0.9, 1],
+        ...     [1, 0.3, 0.5, 0.2, 0.1, 0.8, 0],
+        ... ])
+        >>> det = to_array(boxes)
+        >>> det['y_top_left'], det['class_id']
+        (array([90., 90.], dtype=float32), array([1, 0]))
+        >>> offsets = to_array.offsets(det, 3)
+        >>> offsets
+        array([0, 1, 2, 2])
+        >>> det[offsets[1]:offsets[2]]['confidence']
+        array([0.8], dtype=float32)
+    """
+    dtype = np.dtype([
+        ('image', np.int64),
+        ('x_top_left', np.float32),
+        ('y_top_left', np.float32),
+        ('width', np.float32),
+        ('height', np.float32),
+        ('confidence', np.float32),
+        ('class_id', np.int64),
+    ])
+
+    def __init__(self, network_size):
+        self.width, self.height = network_size[:2]
+
+    def __call__(self, boxes):
+        if boxes.numel() == 0:
+            return np.empty(0, dtype=self.dtype)
+
+        # coords: relative center -> absolute top_left
+        scale = boxes.new_tensor([self.width, self.height, self.width, self.height])
+        coords = boxes[:, 1:5].detach() * scale
+        coords[:, :2] -= coords[:, 2:] / 2
+
+        data = torch.cat([boxes[:, :1].detach(), coords, boxes[:, 5:7].detach()], dim=1).cpu().numpy()
+        if data.shape[0] > 1 and (data[1:, 0] < data[:-1, 0]).any():
+            data = data[np.argsort(data[:, 0], kind='stable')]
+
+        array = np.empty(data.shape[0], dtype=self.dtype)
+        for i, name in enumerate(self.dtype.names):
+            array[name] = data[:, i]
+        return array
+
+    @staticmethod
+    def offsets(array, num_images=None):
+        """ Compute where the detections of each image start and stop in the array.
+
+        Args:
+            array (numpy.ndarray): Structured array, sorted by image
+            num_images (int, optional): Number of images in the batch; Default **highest image index + 1**
+
+        Returns:
+            numpy.ndarray: [num_images + 1] array, so that the detections of image *i* are ``array[offsets[i]:offsets[i+1]]``
+        """
+        if num_images is None:
+            num_images = int(array['image'].max()) + 1 if array.shape[0] > 0 else 0
+        return np.searchsorted(array['image'], np.arange(num_images + 1), side='left')
+
+
+class ArrayToBrambox(BaseTransform):
+    """ Converts a structured array from :class:`~lightnet.data.transform.TensorToArray` to a brambox dataframe.
+
+    Args:
+        class_label_map (list, optional): List of class labels to transform the class id's in actual names; Default **None**
+
+    Returns:
+        pandas.DataFrame: brambox detection dataframe, identical to the one of :class:`~lightnet.data.transform.TensorToBrambox`.
+
+    Warning:
+        If no `class_label_map` is given, this transform will simply convert the class id's to a string.
+    """
+    def __init__(self, class_label_map=None):
+        if pd is None:
+            raise ImportError('Pandas needs to be installed to convert the detections to a dataframe')
+
+        self.class_label_map = class_label_map
+        if self.class_label_map is None:
+            log.warning('No class_label_map given. The indexes will be used as class_labels.')
+            self._labels = None
+        else:
+            self._labels = np.array(self.class_label_map, dtype=object)
+
+    def __call__(self, array):
+        if self._labels is not None:
+            class_label = self._labels[array['class_id']]
+        else:
+            class_label = array['class_id'].astype(str).astype(object)
+
+        df = pd.DataFrame({
+            'image': array['image'].astype(int),
+            'class_label': class_label,
+            'id': np.full(array.shape[0], np.nan),
+            'x_top_left': array['x_top_left'].astype(float),
+            'y_top_left': array['y_top_left'].astype(float),
+            'width': array['width'].astype(float),
+            'height': array['height'].astype(float),
+            'confidence': array['confidence'].astype(float),
+        })
+        if array.shape[0] == 0:
+            df.class_label = df.class_label.astype(str)
+        return df
+
+
+class FusedPostprocess(BaseTransform):
+    """ Runs the complete post-processing of darknet networks and returns the detections as a structured numpy array. |br|
+    This is equivalent to :class:`~lightnet.data.transform.GetBoundingBoxes`, :class:`~lightnet.data.transform.NonMaxSuppression`
+    and :class:`~lightnet.data.transform.TensorToArray`, but does not depend on pandas.
+
+    Args:
+        num_classes (int): number of categories
+        anchors (list): 2D list representing anchor boxes (see :class:`lightnet.network.Darknet`)
+        conf_thresh (Number [0-1]): Confidence threshold to filter detections
+        nms_thresh (Number [0-1]): Overlapping threshold to filter detections with non-maxima suppresion
+        network_size (tuple): Tuple containing the width and height of the images going in the network
+        class_nms (Boolean, optional): Whether to perform nms per class; Default **True**
+        max_det (int, optional): Maximal number of detections per image; Default **None**
+        offsets (Boolean, optional): Whether to also return the offsets of the detections of each image; Default **False**
+
+    Returns:
+        numpy.ndarray or tuple: structured array with the detections (see :class:`~lightnet.data.transform.TensorToArray`)
+        and the [batch + 1] offsets of the detections of each image, if `offsets` is True.
+
+    Note:
+        The individual transforms are available as the ``get_boxes``, ``nms`` and ``to_array`` attributes, if you want to tweak them. |br|
+        If you still need a brambox dataframe (eg. for evaluation), you can add an :class:`~lightnet.data.transform.ArrayToBrambox` after this transform.
+
+    Example:
+        >>> post = ln.data.transform.FusedPostprocess(2, [(1, 1), (2, 2)], 0.5, 0.45, (96, 64), offsets=True)
+        >>> output = torch.zeros(2, 2 * 7, 2, 3)
+        >>> output[1, 4, 1, 2] = 5          # Objectness of first anchor at x=2, y=1 of the second image
+        >>> output[1, 6, 1, 2] = 3          # Class 1 logit
+        >>> det, offsets = post(output)
+        >>> det['image'], det['class_id'], offsets
+        (array([1]), array([1]), array([0, 0, 1]))
+    """
+    def __init__(self, num_classes, anchors, conf_thresh, nms_thresh, network_size, class_nms=True, max_det=None, offsets=False):
+        self.get_boxes = GetBoundingBoxes(num_classes, anchors, conf_thresh)
+        self.nms = NonMaxSuppression(nms_thresh, class_nms, max_det=max_det)
+        self.to_array = TensorToArray(network_size)
+        self.offsets = offsets
+
+    def __call__(self, network_output):
+        with torch.no_grad():
+            boxes = self.nms(self.get_boxes(network_output))
+        array = self.to_array(boxes)
+
+        if self.offsets:
+            batch = network_output.size(0) if network_output.dim() == 4 else 1
+            return array, self.to_array.offsets(array, batch)
+        return array
+
+
 class ReverseLetterbox(BaseTransform):
     """ Performs a reverse letterbox operation on the bounding boxes, so they can be visualised on the original image.
 
@@ -243,8 +528,9 @@ class ReverseLetterbox(BaseTransform):
         - callable : The argument will be called with the image column name and must return a (width, height) tuple
         - dict-like : This is similar to the callable, but instead of calling the argument, it will use dictionary accessing (self.image_size[img_name])
 
-        Note that if your dimensions are the same for all images, it is faster to pass a tuple,
-        as the transformation will be applied to the entire dataframe at once as opposed to grouping it per image and applying the tranform to each group individually.
+        For the callable and dict-like types, we only look up the size of each unique image once
+        and transform all boxes at once, with a per-box scale and padding.
+        Boxes with a missing image (NaN) raise a ValueError, as we cannot look up their image size.
 
     Note:
         This transform works on a brambox detection dataframe,
@@ -256,30 +542,29 @@ class ReverseLetterbox(BaseTransform):
 
     def __call__(self, boxes):
         if isinstance(self.image_size, (list, tuple)):
-            net_w, net_h = self.network_size[:2]
-            im_w, im_h = self.image_size[:2]
+            scale, pad_x, pad_y = self._get_scale_pad(self.network_size, self.image_size)
+            return self._transform(boxes.copy(), scale, (pad_x, pad_y))
 
-            # Get scale and pad
-            if im_w == net_w and im_h == net_h:
-                scale = 1
-            elif im_w / net_w >= im_h / net_h:
-                scale = im_w/net_w
-            else:
-                scale = im_h/net_h
-            pad = int((net_w - im_w/scale) / 2), int((net_h - im_h/scale) / 2)
+        if len(boxes.index) == 0:
+            return boxes.copy()
 
-            return self._transform(boxes.copy(), scale, pad)
-
-        return boxes.groupby('image').apply(self._apply_transform)
-
-    def _apply_transform(self, boxes):
-        net_w, net_h = self.network_size[:2]
+        # Lookup the size of each unique image once and broadcast the scale and pad to the boxes
+        codes, images = pd.factorize(boxes.image)
+        if (codes < 0).any():
+            raise ValueError('Cannot reverse the letterbox of boxes without an image')
         if callable(self.image_size):
-            im_w, im_h = self.image_size(boxes.name)
+            params = [self._get_scale_pad(self.network_size, self.image_size(img)) for img in images]
         else:
-            im_w, im_h = self.image_size[boxes.name]
+            params = [self._get_scale_pad(self.network_size, self.image_size[img]) for img in images]
+        params = np.array(params, dtype=np.float64)[codes]
+
+        return self._transform(boxes.copy(), params[:, 0], (params[:, 1], params[:, 2]))
+
+    @staticmethod
+    def _get_scale_pad(network_size, image_size):
+        net_w, net_h = network_size[:2]
+        im_w, im_h = image_size[:2]
 
-        # Get scale and pad
         if im_w == net_w and im_h == net_h:
             scale = 1
         elif im_w / net_w >= im_h / net_h:
@@ -288,8 +573,7 @@ class ReverseLetterbox(BaseTransform):
             scale = im_h/net_h
         pad = int((net_w - im_w/scale) / 2), int((net_h - im_h/scale) / 2)
 
-        # Transform boxes
-        return self._transform(boxes.copy(), scale, pad)
+        return scale, pad[0], pad[1]
 
     @staticmethod
     def _transform(boxes, scale, pad):
@@ -12,6 +12,7 @@ import math
 import numpy as np
 from PIL import Image, ImageOps
 import torch
+import torch.nn.functional as F
 from .util import BaseTransform, BaseMultiTransform
 
 log = logging.getLogger(__name__)
@@ -30,7 +31,123 @@ except ImportError:
     log.warning('OpenCV is not installed and cannot be used')
     cv2 = None
 
-__all__ = ['Crop', 'Letterbox', 'RandomFlip', 'RandomHSV', 'RandomJitter', 'RandomRotate', 'BramboxToTensor']
+__all__ = ['Crop', 'Letterbox', 'RandomDepth', 'RandomFlip', 'RandomHSV', 'RandomJitter', 'RandomRotate', 'RandomWarp', 'BramboxToTensor']
+
+
+def _get_fill(fill_color, channels):
+    """ Get a tuple with the fill value for each channel. """
+    if isinstance(fill_color, collections.Sequence):
+        if len(fill_color) != channels:
+            raise ValueError(f'The fill_color should have a value for each channel [{len(fill_color)}/{channels}]')
+        return tuple(fill_color)
+    return (fill_color,) * channels
+
+
+def _get_fill_pil(fill_color, img):
+    """ Get the fill value for a Pillow image, which is a tuple for multiband images and a single value otherwise. """
+    fill = _get_fill(fill_color, len(img.getbands()))
+    return fill if len(fill) > 1 else fill[0]
+
+
+def _get_coords(anno):
+    """ Get the box coordinates of a brambox dataframe as a [N, 4] float64 array. """
+    return anno[['x_top_left', 'y_top_left', 'width', 'height']].values.astype(np.float64)
+
+
+def _set_coords(anno, coords):
+    """ Set the box coordinates of a brambox dataframe from a [N, 4] array. """
+    anno.x_top_left = coords[:, 0]
+    anno.y_top_left = coords[:, 1]
+    anno.width = coords[:, 2]
+    anno.height = coords[:, 3]
+
+
+def _crop_coords(coords, truncated, crop, intersection_threshold, crop_anno):
+    """ Filter [N, 4] box coordinates that are inside a (x1, y1, x2, y2) crop window and optionally crop them.
+
+    Returns:
+        tuple: filtered coordinates, filtered truncated values (only computed if `crop_anno` is True) and filter mask
+    """
+    x1 = np.maximum(coords[:, 0], crop[0])
+    y1 = np.maximum(coords[:, 1], crop[1])
+    w = np.minimum(coords[:, 0] + coords[:, 2], crop[2]) - x1
+    h = np.minimum(coords[:, 1] + coords[:, 3], crop[3]) - y1
+
+    if isinstance(intersection_threshold, collections.Sequence):
+        mask = ((w / coords[:, 2]) >= intersection_threshold[0]) & ((h / coords[:, 3]) >= intersection_threshold[1])
+    else:
+        mask = ((w * h) / (coords[:, 2] * coords[:, 3])) >= intersection_threshold
+    mask = mask & (w > 0) & (h > 0)
+
+    if crop_anno:
+        area = coords[mask, 2] * coords[mask, 3]
+        truncated = (w[mask] * h[mask]) * (1 - truncated[mask]) / area
+        coords = np.stack([x1[mask], y1[mask], w[mask], h[mask]], axis=1).astype(coords.dtype)
+    else:
+        truncated = None
+        coords = coords[mask]
+
+    return coords, truncated, mask
+
+
+def _resize_pil(img, size):
+    """ Resize all bands of a Pillow image at once. """
+    if img.mode in ('LA', 'RGBA'):
+        # Pillow premultiplies the alpha band when resizing, so we resize the bands separately
+        bands = [b.resize(size) for b in img.split()]
+        return Image.merge(img.mode, bands)
+    return img.resize(size)
+
+
+def _resize_cv(img, size, dst=None):
+    """ Resize all channels of a HxW or HxWxC numpy array with bicubic interpolation. |br|
+    OpenCV is used if it is installed and supports the number of channels,
+    otherwise we resize the channels as planes of a channels-last tensor with PyTorch.
+    If a `dst` array (or view) of the right size is given, the result is written into it.
+    """
+    if cv2 is not None and (img.ndim == 2 or img.shape[2] < 512):       # CV_CN_MAX
+        return cv2.resize(img, size, dst=dst, interpolation=cv2.INTER_CUBIC)
+
+    im_h, im_w = img.shape[:2]
+    tensor = torch.from_numpy(img.astype(np.float32).reshape(im_h, im_w, -1)).permute(2, 0, 1)[None]
+    tensor = F.interpolate(tensor, (size[1], size[0]), mode='bicubic', align_corners=False)[0].permute(1, 2, 0)
+    if np.issubdtype(img.dtype, np.integer):
+        info = np.iinfo(img.dtype)
+        tensor = tensor.round_().clamp_(info.min, info.max)
+
+    out = tensor.numpy().reshape((size[1], size[0]) + img.shape[2:])
+    if dst is None:
+        return out.astype(img.dtype)
+    dst[...] = out
+    return dst
+
+
+def _canvas_cv(img, size, pad, fill):
+    """ Allocate an image of `size` (width, height) with the datatype and channels of `img`
+    and fill its borders of `pad` (left, top, right, bottom) pixels with a fill value per channel.
+
+    Returns:
+        tuple: canvas and view of the region inside of the borders, which is left uninitialized
+    """
+    width, height = size
+    left, top, right, bottom = pad
+    canvas = np.empty((height, width) + img.shape[2:], dtype=img.dtype)
+    canvas[:top] = fill
+    canvas[height-bottom:] = fill
+    canvas[top:height-bottom, :left] = fill
+    canvas[top:height-bottom, width-right:] = fill
+    return canvas, canvas[top:height-bottom, left:width-right]
+
+
+def _warp_affine_cv(img, matrix, size, fill):
+    """ Run cv2.warpAffine with a fill value per channel (OpenCV only supports border values for 4 channels). """
+    if len(fill) <= 4:
+        return cv2.warpAffine(img, matrix, size, flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=fill)
+
+    out = np.empty((size[1], size[0], len(fill)), dtype=img.dtype)
+    for c in range(0, len(fill), 4):
+        out[..., c:c+4] = cv2.warpAffine(img[..., c:c+4], matrix, size, flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=fill[c:c+4]).reshape(size[1], size[0], -1)
+    return out
 
 
 #
@@ -45,6 +162,7 @@ class Crop(BaseMultiTransform):
         dataset (lightnet.data.Dataset, optional): Dataset that uses this transform; Default **None**
         center (Boolean, optional): Whether to take the crop from the center or randomly.
         intersection_threshold(number, optional): Minimal percentage of the annotation's box area that still needs to be inside the crop; Default **0.001**
+        crop_anno(Boolean, optional): Whether we crop the annotations inside the image crop; Default **False**
 
     Note:
         If the `intersection_threshold` is a tuple of 2 numbers, then they are to be considered as **(width, height)** threshold values.
@@ -54,10 +172,12 @@ class Crop(BaseMultiTransform):
         Create 1 Crop object and use it for both image and annotation transforms.
         This object will save data from the image transform and use that on the annotation transform.
     """
-    def __init__(self, dimension=None, dataset=None, center=True, intersection_threshold=0.001):
+    def __init__(self, dimension=None, dataset=None, center=True, intersection_threshold=0.001, crop_anno=False):
         self.dimension = dimension
         self.dataset = dataset
         self.center = center
+        self.intersection_threshold = intersection_threshold
+        self.crop_anno = crop_anno
         if self.dimension is None and self.dataset is None:
             raise ValueError('This transform either requires a dimension or a dataset to infer the dimension')
 
@@ -81,6 +201,14 @@ class Crop(BaseMultiTransform):
         else:
             self.crop = (dx, dy, dx + net_w, dy + net_h)
 
+    def scale_hint(self, size):
+        """ Scale factor and output size of this transform for an image of a certain (width, height). """
+        if self.dataset is not None:
+            net_w, net_h = self.dataset.input_dim
+        else:
+            net_w, net_h = self.dimension
+        return max(net_w / size[0], net_h / size[1]), (net_w, net_h)
+
     def _tf_pil(self, img):
         if self.dataset is not None:
             net_w, net_h = self.dataset.input_dim
@@ -91,9 +219,7 @@ class Crop(BaseMultiTransform):
 
         # Rescale
         if self.scale != 1:
-            bands = img.split()
-            bands = [b.resize((int(self.scale * im_w + 0.5), int(self.scale * im_h + 0.5))) for b in bands]
-            img = Image.merge(img.mode, bands)
+            img = _resize_pil(img, (int(self.scale * im_w + 0.5), int(self.scale * im_h + 0.5)))
             im_w, im_h = img.size
 
         # Crop
@@ -112,7 +238,7 @@ class Crop(BaseMultiTransform):
 
         # Rescale
         if self.scale != 1:
-            img = cv2.resize(img, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_CUBIC)
+            img = _resize_cv(img, (int(self.scale * im_w + 0.5), int(self.scale * im_h + 0.5)))
 
         # Crop
         if self.crop is not None:
@@ -122,44 +248,44 @@ class Crop(BaseMultiTransform):
 
     def _tf_anno(self, anno):
         anno = anno.copy()
+        coords = _get_coords(anno)
+        coords, truncated, mask = self._tf_coords(coords, anno.truncated.values if self.crop_anno else None)
 
-        # Rescale
-        if self.scale != 1:
-            anno.x_top_left *= self.scale
-            anno.y_top_left *= self.scale
-            anno.width *= self.scale
-            anno.height *= self.scale
-
-        # Filter and Crop
-        if self.crop is not None:
-            cropped = np.empty((4, len(anno.index)), dtype=np.float64)
-            cropped[0] = anno.x_top_left.clip(lower=self.crop[0]).values
-            cropped[1] = anno.y_top_left.clip(lower=self.crop[1]).values
-            cropped[2] = (anno.x_top_left + anno.width).clip(upper=self.crop[2]).values - cropped[0]
-            cropped[3] = (anno.y_top_left + anno.height).clip(upper=self.crop[3]).values - cropped[1]
-
-            if isinstance(self.intersection_threshold, collections.Sequence):
-                mask = ((cropped[2] / anno.width.values) >= self.intersection_threshold[0]) & ((cropped[3] / anno.height.values) >= self.intersection_threshold[1])
-            else:
-                mask = ((cropped[2] * cropped[3]) / (anno.width.values * anno.height.values)) >= self.intersection_threshold
-            mask = mask & (cropped[2] > 0) & (cropped[3] > 0)
-
+        if mask is not None:
             anno = anno[mask].copy()
             if len(anno.index) == 0:
                 return anno
+            if self.crop_anno:
+                anno.truncated = truncated
+
+        _set_coords(anno, coords)
+        return anno
+
+    def _tf_boxes(self, boxes):
+        boxes = boxes.copy()
+        coords, truncated, mask = self._tf_coords(boxes.coords, boxes.truncated)
 
+        if mask is not None:
+            boxes = boxes[mask]
             if self.crop_anno:
-                cropped = cropped[:, mask]
-                anno.truncated = (cropped[2] * cropped[3]) / ((anno.width * anno.height) / (1 - anno.truncated)).clip(lower=0)
-                anno.x_top_left = cropped[0]
-                anno.y_top_left = cropped[1]
-                anno.width = cropped[2]
-                anno.height = cropped[3]
+                boxes.truncated = truncated.astype(np.float32)
 
-            anno.x_top_left -= self.crop[0]
-            anno.y_top_left -= self.crop[1]
+        boxes.coords = coords
+        return boxes
 
-            return anno
+    def _tf_coords(self, coords, truncated):
+        # Rescale
+        if self.scale != 1:
+            coords *= self.scale
+
+        # Filter and Crop
+        if self.crop is None:
+            return coords, truncated, None
+
+        coords, truncated, mask = _crop_coords(coords, truncated, self.crop, self.intersection_threshold, self.crop_anno)
+        coords[:, 0] -= self.crop[0]
+        coords[:, 1] -= self.crop[1]
+        return coords, truncated, mask
 
 
 class Letterbox(BaseMultiTransform):
@@ -168,6 +294,7 @@ class Letterbox(BaseMultiTransform):
     Args:
         dimension (tuple, optional): Default size for the letterboxing, expressed as a (width, height) tuple; Default **None**
         dataset (lightnet.data.Dataset, optional): Dataset that uses this transform; Default **None**
+        fill_color (Number or tuple, optional): Value of the border pixels, either for all channels or per channel; Default **127**
 
     Note:
         Create 1 Letterbox object and use it for both image and annotation transforms.
@@ -183,6 +310,14 @@ class Letterbox(BaseMultiTransform):
         self.pad = None
         self.scale = None
 
+    def scale_hint(self, size):
+        """ Scale factor and output size of this transform for an image of a certain (width, height). """
+        if self.dataset is not None:
+            net_w, net_h = self.dataset.input_dim
+        else:
+            net_w, net_h = self.dimension
+        return min(net_w / size[0], net_h / size[1]), (net_w, net_h)
+
     def _tf_pil(self, img):
         if self.dataset is not None:
             net_w, net_h = self.dataset.input_dim
@@ -201,9 +336,7 @@ class Letterbox(BaseMultiTransform):
         else:
             self.scale = net_h / im_h
         if self.scale != 1:
-            bands = img.split()
-            bands = [b.resize((int(self.scale*im_w), int(self.scale*im_h))) for b in bands]
-            img = Image.merge(img.mode, bands)
+            img = _resize_pil(img, (int(self.scale*im_w), int(self.scale*im_h)))
             im_w, im_h = img.size
 
         if im_w == net_w and im_h == net_h:
@@ -211,12 +344,10 @@ class Letterbox(BaseMultiTransform):
             return img
 
         # Padding
-        img_np = np.array(img)
-        channels = img_np.shape[2] if len(img_np.shape) > 2 else 1
         pad_w = (net_w - im_w) / 2
         pad_h = (net_h - im_h) / 2
         self.pad = (int(pad_w), int(pad_h), int(pad_w+.5), int(pad_h+.5))
-        img = ImageOps.expand(img, border=self.pad, fill=(self.fill_color,)*channels)
+        img = ImageOps.expand(img, border=self.pad, fill=_get_fill_pil(self.fill_color, img))
         return img
 
     def _tf_cv(self, img):
@@ -237,20 +368,25 @@ class Letterbox(BaseMultiTransform):
         else:
             self.scale = net_h / im_h
         if self.scale != 1:
-            img = cv2.resize(img, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_CUBIC)
-            im_h, im_w = img.shape[:2]
+            size = (int(self.scale*im_w + 0.5), int(self.scale*im_h + 0.5))
+        else:
+            size = (im_w, im_h)
 
-        if im_w == net_w and im_h == net_h:
+        if size == (net_w, net_h):
             self.pad = None
-            return img
+            return _resize_cv(img, size)
 
-        # Padding
+        # Padding: resize directly into the padded image
         channels = img.shape[2] if len(img.shape) > 2 else 1
-        pad_w = (net_w - im_w) / 2
-        pad_h = (net_h - im_h) / 2
+        pad_w = (net_w - size[0]) / 2
+        pad_h = (net_h - size[1]) / 2
         self.pad = (int(pad_w), int(pad_h), int(pad_w+.5), int(pad_h+.5))
-        img = cv2.copyMakeBorder(img, self.pad[1], self.pad[3], self.pad[0], self.pad[2], cv2.BORDER_CONSTANT, value=self.fill_color)
-        return img
+        canvas, inner = _canvas_cv(img, (net_w, net_h), self.pad, _get_fill(self.fill_color, channels))
+        if self.scale != 1:
+            _resize_cv(img, size, dst=inner)
+        else:
+            inner[...] = img
+        return canvas
 
     def _tf_anno(self, anno):
         anno = anno.copy()
@@ -266,10 +402,106 @@ class Letterbox(BaseMultiTransform):
 
         return anno
 
+    def _tf_boxes(self, boxes):
+        boxes = boxes.copy()
+
+        if self.scale is not None:
+            boxes.coords *= self.scale
+        if self.pad is not None:
+            boxes.coords[:, :2] += self.pad[:2]
+
+        return boxes
+
 
 #
 #   Data augmentation
 #
+class RandomDepth(BaseTransform):
+    """ Perform random depth augmentations, simulating the scale and noise of depth sensors.
+
+    Args:
+        scale (Number [0-1], optional): Random number between 1-scale,1+scale is used to multiply the depth values; Default **0**
+        noise (Number, optional): Standard deviation of the gaussian noise, relative to the depth value of each pixel; Default **0**
+        holes (Number [0-1], optional): Chance of each pixel to become invalid, simulating missing depth measurements; Default **0**
+        channels (tuple, optional): Indices of the depth channels for multi-channel images; Default **(3,)**
+        invalid (Number, optional): Depth value of invalid pixels; Default **0**
+
+    Note:
+        Pixels that are already invalid remain invalid and the resulting depth values are clipped to the range of the datatype of the image. |br|
+        Single channel images (Pillow or OpenCV) are considered to be depth maps entirely.
+        For multi-channel images (eg. RGBD images), only the `channels` are modified and the other channels are left untouched.
+        Pillow images are split into their bands for this, so the depth channels need to be stored in a multi-band mode (eg. RGBA).
+
+    Note:
+        The per-pixel noise and holes are generated by a numpy random generator, which gets seeded from the python :mod:`random` module.
+        This makes this transform reproducible with :func:`random.seed`, like the other transforms.
+
+    Example:
+        >>> img = torch.full((2, 3, 4), 1000, dtype=torch.int16).numpy()
+        >>> depth = ln.data.transform.RandomDepth(scale=0.1, noise=0.01, holes=0.05)
+        >>> out = depth(img)
+        >>> out[..., :3].tolist() == img[..., :3].tolist()
+        True
+    """
+    def __init__(self, scale=0, noise=0, holes=0, channels=(3,), invalid=0):
+        self.scale = scale
+        self.noise = noise
+        self.holes = holes
+        self.channels = list(channels)
+        self.invalid = invalid
+
+    def scale_hint(self, size):
+        """ This transform does not change the size of the image. """
+        return 1, size
+
+    def __call__(self, data):
+        factor = random.uniform(1 - self.scale, 1 + self.scale)
+        rng = np.random.default_rng(random.getrandbits(32))
+
+        if data is None:
+            return None
+        elif isinstance(data, Image.Image):
+            if len(data.getbands()) > 1:
+                bands = list(data.split())
+                depth = np.stack([np.asarray(bands[c]) for c in self.channels], axis=-1)
+                depth = self._tf_depth(depth, factor, rng)
+                for i, c in enumerate(self.channels):
+                    bands[c] = Image.fromarray(np.ascontiguousarray(depth[..., i]))
+                return Image.merge(data.mode, bands)
+            return Image.fromarray(self._tf_depth(np.asarray(data), factor, rng))
+        elif isinstance(data, np.ndarray):
+            if data.ndim == 3 and data.shape[2] > 1:
+                out = data.copy()
+                out[..., self.channels] = self._tf_depth(data[..., self.channels], factor, rng)
+                return out
+            return self._tf_depth(data, factor, rng)
+        else:
+            log.error(f'RandomDepth only works with <PIL images> or <OpenCV images> [{type(data)}]')
+            return data     # Pass on data to not destroy pipeline with annos
+
+    def _tf_depth(self, depth, factor, rng):
+        """ Scale, add noise and holes to the depth values in one pass. """
+        if self.noise > 0:
+            out = rng.standard_normal(depth.shape, dtype=np.float32)
+            out *= self.noise
+            out += factor
+            out *= depth
+        else:
+            out = depth.astype(np.float32) * factor
+
+        valid = depth != self.invalid
+        if self.holes > 0:
+            valid &= rng.random(depth.shape, dtype=np.float32) >= self.holes
+
+        if np.issubdtype(depth.dtype, np.integer):
+            info = np.iinfo(depth.dtype)
+            np.clip(out, info.min, info.max, out=out)
+            np.rint(out, out=out)
+
+        np.copyto(out, self.invalid, where=~valid)
+        return out.astype(depth.dtype, copy=False)
+
+
 class RandomFlip(BaseMultiTransform):
     """ Randomly flip image.
 
@@ -289,6 +521,10 @@ class RandomFlip(BaseMultiTransform):
         self.im_w = None
         self.im_h = None
 
+    def scale_hint(self, size):
+        """ This transform does not change the size of the image. """
+        return 1, size
+
     def _get_flip(self):
         self.flip_h = random.random() < self.horizontal
         self.flip_v = random.random() < self.vertical
@@ -329,6 +565,16 @@ class RandomFlip(BaseMultiTransform):
 
         return anno
 
+    def _tf_boxes(self, boxes):
+        boxes = boxes.copy()
+
+        if self.flip_h and self.im_w is not None:
+            boxes.coords[:, 0] = self.im_w - boxes.coords[:, 0] - boxes.coords[:, 2]
+        if self.flip_v and self.im_h is not None:
+            boxes.coords[:, 1] = self.im_h - boxes.coords[:, 1] - boxes.coords[:, 3]
+
+        return boxes
+
 
 class RandomHSV(BaseTransform):
     """ Perform random HSV shift on the RGB data.
@@ -337,6 +583,17 @@ class RandomHSV(BaseTransform):
         hue (Number): Random number between -hue,hue is used to shift the hue
         saturation (Number): Random number between 1,saturation is used to shift the saturation; 50% chance to get 1/dSaturation in stead of dSaturation
         value (Number): Random number between 1,value is used to shift the value; 50% chance to get 1/dValue in stead of dValue
+        channels (tuple, optional): Indices of the R, G and B channels for OpenCV images; Default **(0, 1, 2)**
+
+    Note:
+        The shift is performed on 8-bit HSV data, with 256-entry lookup tables for each channel.
+        The hue wraps around and the saturation and value are clipped between 0-255. |br|
+        If OpenCV is installed, Pillow images are also converted with OpenCV, so that both code paths return identical results.
+        Otherwise the HSV conversions of Pillow are used, which might round some values differently.
+
+    Note:
+        OpenCV images can contain extra channels (eg. depth in RGBD images), which are left untouched by this transform.
+        The color channels of these images should contain values between 0-255, but can be stored in another datatype than uint8.
 
     Warning:
         If you use OpenCV as your image processing library, make sure the image is RGB before using this transform.
@@ -344,10 +601,15 @@ class RandomHSV(BaseTransform):
 
     .. _cvtColor: https://docs.opencv.org/master/d7/d1b/group__imgproc__misc.html#ga397ae87e1288a81d2363b61574eb8cab
     """
-    def __init__(self, hue, saturation, value):
+    def __init__(self, hue, saturation, value, channels=(0, 1, 2)):
         self.hue = hue
         self.saturation = saturation
         self.value = value
+        self.channels = list(channels)
+
+    def scale_hint(self, size):
+        """ This transform does not change the size of the image. """
+        return 1, size
 
     def __call__(self, data):
         dh = random.uniform(-self.hue, self.hue)
@@ -363,49 +625,45 @@ class RandomHSV(BaseTransform):
         elif isinstance(data, Image.Image):
             return self._tf_pil(data, dh, ds, dv)
         elif isinstance(data, np.ndarray):
+            if data.ndim == 3 and (data.shape[2] != 3 or self.channels != [0, 1, 2]):
+                out = data.copy()
+                out[..., self.channels] = self._tf_cv(data.take(self.channels, axis=2), dh, ds, dv, inplace=True)
+                return out
             return self._tf_cv(data, dh, ds, dv)
         else:
             log.error(f'HSVShift only works with <PIL images> or <OpenCV images> [{type(data)}]')
             return data     # Pass on data to not destroy pipeline with annos
 
     @staticmethod
-    def _tf_pil(img, dh, ds, dv):
-        img = img.convert('HSV')
-        channels = list(img.split())
-
-        def wrap_hue(x):
-            x += int(dh * 255)
-            if x > 255:
-                x -= 255
-            elif x < 0:
-                x += 255
-            return x
-
-        channels[0] = channels[0].point(wrap_hue)
-        channels[1] = channels[1].point(lambda i: min(255, max(0, int(i*ds))))
-        channels[2] = channels[2].point(lambda i: min(255, max(0, int(i*dv))))
-
-        img = Image.merge(img.mode, tuple(channels))
-        img = img.convert('RGB')
-        return img
+    def _get_lut(dh, ds, dv):
+        """ Create a 3x256 lookup table for the H, S and V channels. """
+        values = np.arange(256, dtype=np.float64)
+        lut = np.empty((3, 256), dtype=np.uint8)
+        lut[0] = (values + int(dh * 255)) % 256
+        lut[1] = np.clip(values * ds, 0, 255)
+        lut[2] = np.clip(values * dv, 0, 255)
+        return lut
 
-    @staticmethod
-    def _tf_cv(img, dh, ds, dv):
-        img = img.astype(np.float32) / 255.0
-        img = cv2.cvtColor(img, cv2.COLOR_RGB2HSV)
+    @classmethod
+    def _tf_pil(cls, img, dh, ds, dv):
+        if cv2 is not None:
+            return Image.fromarray(cls._tf_cv(np.asarray(img if img.mode == 'RGB' else img.convert('RGB')), dh, ds, dv))
 
-        def wrap_hue(x):
-            x[x >= 360.0] -= 360.0
-            x[x < 0.0] += 360.0
-            return x
+        lut = cls._get_lut(dh, ds, dv)
+        img = img.convert('HSV').point(lut.reshape(-1).tolist())
+        return img.convert('RGB')
 
-        img[:, :, 0] = wrap_hue(img[:, :, 0] + (360.0 * dh))
-        img[:, :, 1] = np.clip(ds * img[:, :, 1], 0.0, 1.0)
-        img[:, :, 2] = np.clip(dv * img[:, :, 2], 0.0, 1.0)
+    @classmethod
+    def _tf_cv(cls, img, dh, ds, dv, inplace=False):
+        """ Shift the colors of a uint8 image (or a copy of it, if `inplace` is False). """
+        lut = cls._get_lut(dh, ds, dv)
+        if img.dtype != np.uint8:
+            img = np.clip(img, 0, 255, out=img if inplace else None).astype(np.uint8)
+            inplace = True
 
-        img = cv2.cvtColor(img, cv2.COLOR_HSV2RGB)
-        img = (img * 255).astype(np.uint8)
-        return img
+        img = cv2.cvtColor(img, cv2.COLOR_RGB2HSV_FULL, dst=img if inplace else None)
+        cv2.LUT(img, lut.T[None].copy(), dst=img)
+        return cv2.cvtColor(img, cv2.COLOR_HSV2RGB_FULL, dst=img)
 
 
 class RandomJitter(BaseMultiTransform):
@@ -423,6 +681,9 @@ class RandomJitter(BaseMultiTransform):
     Note:
         Create 1 RandomCrop object and use it for both image and annotation transforms.
         This object will save data from the image transform and use that on the annotation transform.
+
+    Note:
+        If the crop lies entirely inside of the image, OpenCV images are returned as a view on the original data.
     """
     def __init__(self, jitter, crop_anno=False, intersection_threshold=0.001, fill_color=127):
         self.jitter = jitter
@@ -431,6 +692,14 @@ class RandomJitter(BaseMultiTransform):
         self.intersection_threshold = intersection_threshold
         self.crop = None
 
+    def scale_hint(self, size):
+        """ This transform does not rescale the image, but can crop it to a smaller size. """
+        crop_w = size[0] - 2 * int(size[0] * self.jitter)
+        crop_h = size[1] - 2 * int(size[1] * self.jitter)
+        if crop_w <= 0 or crop_h <= 0:
+            return None
+        return 1, (crop_w, crop_h)
+
     def _get_crop(self, im_w, im_h):
         dw, dh = int(im_w*self.jitter), int(im_h*self.jitter)
         crop_left = random.randint(-dw, dw)
@@ -446,50 +715,34 @@ class RandomJitter(BaseMultiTransform):
         crop = self._get_crop(im_w, im_h)
         crop_w = crop[2] - crop[0]
         crop_h = crop[3] - crop[1]
-        img_np = np.array(img)
-        channels = img_np.shape[2] if len(img_np.shape) > 2 else 1
-
-        img = img.crop((max(0, crop[0]), max(0, crop[1]), min(im_w, crop[2]-1), min(im_h, crop[3]-1)))
-        img_crop = Image.new(img.mode, (crop_w, crop_h), color=(self.fill_color,)*channels)
-        img_crop.paste(img, (max(0, -crop[0]), max(0, -crop[1])))
+        if crop[0] >= 0 and crop[1] >= 0 and crop[2] <= im_w and crop[3] <= im_h:
+            return img.crop(crop)
 
+        img_crop = Image.new(img.mode, (crop_w, crop_h), color=_get_fill_pil(self.fill_color, img))
+        img_crop.paste(img, (-crop[0], -crop[1]))
         return img_crop
 
     def _tf_cv(self, img):
         im_h, im_w = img.shape[:2]
         crop = self._get_crop(im_w, im_h)
+        if crop[0] >= 0 and crop[1] >= 0 and crop[2] <= im_w and crop[3] <= im_h:
+            return img[crop[1]:crop[3], crop[0]:crop[2]]
 
         crop_w = crop[2] - crop[0]
         crop_h = crop[3] - crop[1]
-        img_crop = np.ones((crop_h, crop_w) + img.shape[2:], dtype=img.dtype) * self.fill_color
-
         src_x1 = max(0, crop[0])
         src_x2 = min(crop[2], im_w)
         src_y1 = max(0, crop[1])
         src_y2 = min(crop[3], im_h)
-        dst_x1 = max(0, -crop[0])
-        dst_x2 = crop_w - max(0, crop[2]-im_w)
-        dst_y1 = max(0, -crop[1])
-        dst_y2 = crop_h - max(0, crop[3]-im_h)
-        img_crop[dst_y1:dst_y2, dst_x1:dst_x2] = img[src_y1:src_y2, src_x1:src_x2]
+        pad = (max(0, -crop[0]), max(0, -crop[1]), max(0, crop[2]-im_w), max(0, crop[3]-im_h))
 
+        img_crop, inner = _canvas_cv(img, (crop_w, crop_h), pad, _get_fill(self.fill_color, img.shape[2] if img.ndim > 2 else 1))
+        inner[...] = img[src_y1:src_y2, src_x1:src_x2]
         return img_crop
 
     def _tf_anno(self, anno):
         anno = anno.copy()
-
-        # Filter annotations inside crop
-        cropped = np.empty((4, len(anno.index)), dtype=np.float64)
-        cropped[0] = anno.x_top_left.clip(lower=self.crop[0]).values
-        cropped[1] = anno.y_top_left.clip(lower=self.crop[1]).values
-        cropped[2] = (anno.x_top_left + anno.width).clip(upper=self.crop[2]).values - cropped[0]
-        cropped[3] = (anno.y_top_left + anno.height).clip(upper=self.crop[3]).values - cropped[1]
-
-        if isinstance(self.intersection_threshold, collections.Sequence):
-            mask = ((cropped[2] / anno.width.values) >= self.intersection_threshold[0]) & ((cropped[3] / anno.height.values) >= self.intersection_threshold[1])
-        else:
-            mask = ((cropped[2] * cropped[3]) / (anno.width.values * anno.height.values)) >= self.intersection_threshold
-        mask = mask & (cropped[2] > 0) & (cropped[3] > 0)
+        coords, truncated, mask = _crop_coords(_get_coords(anno), anno.truncated.values if self.crop_anno else None, self.crop, self.intersection_threshold, self.crop_anno)
 
         anno = anno[mask].copy()
         if len(anno.index) == 0:
@@ -497,18 +750,27 @@ class RandomJitter(BaseMultiTransform):
 
         # Crop annotations
         if self.crop_anno:
-            cropped = cropped[:, mask]
-            anno.truncated = (cropped[2] * cropped[3]) * (1 - anno.truncated) / (anno.width * anno.height)
-            anno.x_top_left = cropped[0]
-            anno.y_top_left = cropped[1]
-            anno.width = cropped[2]
-            anno.height = cropped[3]
+            anno.truncated = truncated
 
-        anno.x_top_left -= self.crop[0]
-        anno.y_top_left -= self.crop[1]
+        coords[:, 0] -= self.crop[0]
+        coords[:, 1] -= self.crop[1]
+        _set_coords(anno, coords)
 
         return anno
 
+    def _tf_boxes(self, boxes):
+        coords, truncated, mask = _crop_coords(boxes.coords, boxes.truncated, self.crop, self.intersection_threshold, self.crop_anno)
+
+        boxes = boxes[mask]
+        if self.crop_anno:
+            boxes.truncated = truncated.astype(np.float32)
+
+        coords[:, 0] -= self.crop[0]
+        coords[:, 1] -= self.crop[1]
+        boxes.coords = coords
+
+        return boxes
+
 
 class RandomRotate(BaseMultiTransform):
     """ Randomly rotate the image/annotations.
@@ -516,17 +778,23 @@ class RandomRotate(BaseMultiTransform):
 
     Args:
         jitter (Number [0-180]): Random number between -jitter,jitter degrees is used to rotate the image
+        fill_color (Number or tuple, optional): Value of the pixels outside of the original image, either for all channels or per channel; Default **0**
 
     Note:
         Create 1 RandomRotate object and use it for both image and annotation transforms.
         This object will save data from the image transform and use that on the annotation transform.
     """
-    def __init__(self, jitter):
+    def __init__(self, jitter, fill_color=0):
         self.jitter = jitter
+        self.fill_color = fill_color
         self.angle = None
         self.im_w = None
         self.im_h = None
 
+    def scale_hint(self, size):
+        """ This transform does not change the size of the image. """
+        return 1, size
+
     def _get_rotate(self, im_w, im_h):
         self.im_w = im_w
         self.im_h = im_h
@@ -535,47 +803,228 @@ class RandomRotate(BaseMultiTransform):
     def _tf_pil(self, img):
         im_w, im_h = img.size
         self._get_rotate(im_w, im_h)
-        return img.rotate(self.angle)
+        return img.rotate(self.angle, fillcolor=_get_fill_pil(self.fill_color, img))
 
     def _tf_cv(self, img):
         im_h, im_w = img.shape[:2]
         self._get_rotate(im_w, im_h)
         M = cv2.getRotationMatrix2D((im_w/2, im_h/2), self.angle, 1)
-        return cv2.warpAffine(img, M, (im_w, im_h))
+        return _warp_affine_cv(img, M, (im_w, im_h), _get_fill(self.fill_color, img.shape[2] if img.ndim > 2 else 1))
 
     def _tf_anno(self, anno):
         anno = anno.copy()
+        _set_coords(anno, self._tf_coords(_get_coords(anno)))
+        return anno
+
+    def _tf_boxes(self, boxes):
+        boxes = boxes.copy()
+        boxes.coords = self._tf_coords(boxes.coords)
+        return boxes
 
+    def _tf_coords(self, coords):
         cx, cy = self.im_w/2, self.im_h/2
         rad = math.radians(-self.angle)
         cos_a = math.cos(rad)
         sin_a = math.sin(rad)
 
-        # Rotate anno
-        x1_c = anno.x_top_left - cx
-        y1_c = anno.y_top_left - cy
-        x2_c = x1_c + anno.width
-        y2_c = y1_c + anno.height
-
-        x1_r = (x1_c * cos_a - y1_c * sin_a) + cx
-        y1_r = (x1_c * sin_a + y1_c * cos_a) + cy
-        x2_r = (x2_c * cos_a - y1_c * sin_a) + cx
-        y2_r = (x2_c * sin_a + y1_c * cos_a) + cy
-        x3_r = (x2_c * cos_a - y2_c * sin_a) + cx
-        y3_r = (x2_c * sin_a + y2_c * cos_a) + cy
-        x4_r = (x1_c * cos_a - y2_c * sin_a) + cx
-        y4_r = (x1_c * sin_a + y2_c * cos_a) + cy
-        rot_x = np.stack([x1_r, x2_r, x3_r, x4_r])
-        rot_y = np.stack([y1_r, y2_r, y3_r, y4_r])
+        # Rotate corners
+        x1 = coords[:, 0] - cx
+        y1 = coords[:, 1] - cy
+        x2 = x1 + coords[:, 2]
+        y2 = y1 + coords[:, 3]
+        corners_x = np.stack([x1, x2, x2, x1])
+        corners_y = np.stack([y1, y1, y2, y2])
+        rot_x = (corners_x * cos_a - corners_y * sin_a) + cx
+        rot_y = (corners_x * sin_a + corners_y * cos_a) + cy
 
         # Max rect box
-        anno.x_top_left = rot_x.min(axis=0)
-        anno.y_top_left = rot_y.min(axis=0)
-        anno.width = rot_x.max(axis=0) - anno.x_top_left
-        anno.height = rot_y.max(axis=0) - anno.y_top_left
+        out = np.empty_like(coords)
+        out[:, 0] = rot_x.min(axis=0)
+        out[:, 1] = rot_y.min(axis=0)
+        out[:, 2] = rot_x.max(axis=0) - out[:, 0]
+        out[:, 3] = rot_y.max(axis=0) - out[:, 1]
+        return out
+
+
+class RandomWarp(BaseMultiTransform):
+    """ Random jitter, flip and rotation, followed by letterboxing, all performed in one affine warp. |br|
+    This transform samples all parameters up front and combines them in a single transformation matrix,
+    which allows to compute the final network-sized image without any intermediate copies.
+
+    Args:
+        dimension (tuple, optional): Default size for the letterboxing, expressed as a (width, height) tuple; Default **None**
+        dataset (lightnet.data.Dataset, optional): Dataset that uses this transform; Default **None**
+        jitter (Number [0-1], optional): Indicates how much of the image we can crop (see :class:`~lightnet.data.transform.RandomJitter`); Default **0**
+        flip (Number [0-1], optional): Chance of flipping the image horizontally; Default **0**
+        rotate (Number [0-180], optional): Random number between -rotate,rotate degrees is used to rotate the image; Default **0**
+        fill_color (Number or tuple, optional): Value of the border pixels, either for all channels or per channel; Default **127**
+        crop_anno(Boolean, optional): Whether we crop the annotations inside the image crop; Default **False**
+        intersection_threshold(tuple(number) or number, optional): Minimal percentage of the annotation's box area that still needs to be inside the crop; Default **0.001**
+
+    Note:
+        This transform is only distributionally equivalent to running :class:`~lightnet.data.transform.RandomJitter`,
+        :class:`~lightnet.data.transform.RandomRotate`, :class:`~lightnet.data.transform.RandomFlip` and :class:`~lightnet.data.transform.Letterbox` after each other.
+        It samples the same kind of augmentations, but a given seed does not produce the same output:
+
+        - The random draws differ: eg. RandomFlip draws two values from :mod:`random` (horizontal and vertical), whereas this transform only draws one.
+        - A single `fill_color` is used for all border pixels, whereas RandomRotate fills with **0** by default and RandomJitter and Letterbox fill with **127**.
+        - The image is interpolated once instead of after each step, which results in small pixel differences.
+
+        Rotated annotations are replaced by the smallest rectangle that fits them, just like in the :class:`~lightnet.data.transform.RandomRotate` transform.
+
+    Note:
+        Create 1 RandomWarp object and use it for both image and annotation transforms.
+        This object will save data from the image transform and use that on the annotation transform.
+
+    Example:
+        >>> img = torch.zeros(100, 200, 3, dtype=torch.uint8).numpy()
+        >>> warp = ln.data.transform.RandomWarp((416, 416), jitter=.2, flip=.5, rotate=5)
+        >>> warp(img).shape
+        (416, 416, 3)
+    """
+    def __init__(self, dimension=None, dataset=None, jitter=0, flip=0, rotate=0, fill_color=127, crop_anno=False, intersection_threshold=0.001):
+        self.dimension = dimension
+        self.dataset = dataset
+        self.jitter = jitter
+        self.flip = flip
+        self.rotate = rotate
+        self.fill_color = fill_color
+        self.crop_anno = crop_anno
+        self.intersection_threshold = intersection_threshold
+        if self.dimension is None and self.dataset is None:
+            raise ValueError('This transform either requires a dimension or a dataset to infer the dimension')
+
+        self.matrix = None
+        self.window = None
+        self.crop = None
+
+    def scale_hint(self, size):
+        """ Largest scale factor (for the smallest jitter crop) and output size of this transform for an image of a certain (width, height). """
+        if self.dataset is not None:
+            net_w, net_h = self.dataset.input_dim
+        else:
+            net_w, net_h = self.dimension
+
+        crop_w = size[0] - 2 * int(size[0] * self.jitter)
+        crop_h = size[1] - 2 * int(size[1] * self.jitter)
+        if crop_w <= 0 or crop_h <= 0:
+            return None
+        return min(net_w / crop_w, net_h / crop_h), (net_w, net_h)
+
+    def _get_warp(self, im_w, im_h):
+        if self.dataset is not None:
+            net_w, net_h = self.dataset.input_dim
+        else:
+            net_w, net_h = self.dimension
+
+        # Jitter
+        dw, dh = int(im_w*self.jitter), int(im_h*self.jitter)
+        crop_left = random.randint(-dw, dw)
+        crop_right = random.randint(-dw, dw)
+        crop_top = random.randint(-dh, dh)
+        crop_bottom = random.randint(-dh, dh)
+        crop_w = im_w - crop_right - crop_left
+        crop_h = im_h - crop_bottom - crop_top
+        matrix = np.array([[1, 0, -crop_left], [0, 1, -crop_top], [0, 0, 1]], dtype=np.float64)
+        self.window = (max(0, crop_left), max(0, crop_top), min(im_w, im_w - crop_right), min(im_h, im_h - crop_bottom))
+
+        # Rotate
+        angle = random.randint(-self.rotate, self.rotate) if self.rotate else 0
+        if angle != 0:
+            cx, cy = crop_w / 2, crop_h / 2
+            cos_a = math.cos(math.radians(angle))
+            sin_a = math.sin(math.radians(angle))
+            rotation = np.array([
+                [cos_a, sin_a, (1 - cos_a) * cx - sin_a * cy],
+                [-sin_a, cos_a, sin_a * cx + (1 - cos_a) * cy],
+                [0, 0, 1],
+            ])
+            matrix = rotation @ matrix
+
+        # Flip
+        if random.random() < self.flip:
+            matrix = np.array([[-1, 0, crop_w], [0, 1, 0], [0, 0, 1]]) @ matrix
+
+        # Letterbox
+        scale = min(net_w / crop_w, net_h / crop_h)
+        pad_w = int((net_w - int(scale * crop_w)) / 2)
+        pad_h = int((net_h - int(scale * crop_h)) / 2)
+        matrix = np.array([[scale, 0, pad_w], [0, scale, pad_h], [0, 0, 1]]) @ matrix
+
+        self.matrix = matrix
+        self.crop = (pad_w, pad_h, pad_w + scale * crop_w, pad_h + scale * crop_h)
+        return net_w, net_h
+
+    def _window_matrix(self):
+        """ Transformation matrix, starting from the top-left corner of the jitter crop window in the image. """
+        return self.matrix @ np.array([[1, 0, self.window[0]], [0, 1, self.window[1]], [0, 0, 1]])
+
+    def _tf_pil(self, img):
+        net_w, net_h = self._get_warp(*img.size)
+        inverse = np.linalg.inv(self._window_matrix())
+        fill = _get_fill_pil(self.fill_color, img)
+
+        if self.window != (0, 0) + img.size:
+            img = img.crop(self.window)
+        return img.transform((net_w, net_h), Image.AFFINE, tuple(inverse[:2].reshape(-1)), resample=Image.BILINEAR, fillcolor=fill)
+
+    def _tf_cv(self, img):
+        im_h, im_w = img.shape[:2]
+        net_w, net_h = self._get_warp(im_w, im_h)
+        img = img[self.window[1]:self.window[3], self.window[0]:self.window[2]]
+
+        # OpenCV uses pixel centers as coordinates
+        shift = np.array([[1, 0, 0.5], [0, 1, 0.5], [0, 0, 1]])
+        matrix = (np.linalg.inv(shift) @ self._window_matrix() @ shift)[:2]
+        fill = _get_fill(self.fill_color, img.shape[2] if img.ndim > 2 else 1)
+        return _warp_affine_cv(img, matrix, (net_w, net_h), fill)
+
+    def _tf_anno(self, anno):
+        anno = anno.copy()
+        if len(anno.index) == 0:
+            return anno
+
+        coords, truncated, mask = self._tf_coords(_get_coords(anno), anno.truncated.values if self.crop_anno else None)
+        anno = anno[mask].copy()
+        if len(anno.index) == 0:
+            return anno
+
+        if self.crop_anno:
+            anno.truncated = truncated
+        _set_coords(anno, coords)
 
         return anno
 
+    def _tf_boxes(self, boxes):
+        if len(boxes) == 0:
+            return boxes.copy()
+
+        coords, truncated, mask = self._tf_coords(boxes.coords, boxes.truncated)
+        boxes = boxes[mask]
+        if self.crop_anno:
+            boxes.truncated = truncated.astype(np.float32)
+        boxes.coords = coords.astype(np.float32)
+
+        return boxes
+
+    def _tf_coords(self, coords, truncated):
+        # Transform corners
+        x1 = coords[:, 0]
+        y1 = coords[:, 1]
+        x2 = x1 + coords[:, 2]
+        y2 = y1 + coords[:, 3]
+        corners = np.stack([
+            np.stack([x1, x2, x2, x1]),
+            np.stack([y1, y1, y2, y2]),
+        ])
+        corners = np.einsum('ij,jkn->ikn', self.matrix[:2, :2], corners) + self.matrix[:2, 2, None, None]
+        tl = corners.min(axis=1)
+        br = corners.max(axis=1)
+        boxes = np.stack([tl[0], tl[1], br[0] - tl[0], br[1] - tl[1]], axis=1)
+
+        # Filter annotations inside crop
+        return _crop_coords(boxes, truncated, self.crop, self.intersection_threshold, self.crop_anno)
+
 
 #
 #   Util
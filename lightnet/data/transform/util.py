@@ -4,10 +4,15 @@
 #   Copyright EAVISE
 #
 
+import time
 import logging
+import multiprocessing
+import tracemalloc
 from abc import ABC, abstractmethod
 from PIL import Image
 import numpy as np
+import torch
+from .._boxes import BoxArray
 
 try:
     import pandas as pd
@@ -21,6 +26,10 @@ log = logging.getLogger(__name__)
 class Compose(list):
     """ This is lightnet's own version of :class:`torchvision.transforms.Compose`.
 
+    Args:
+        transforms (list, optional): List of transforms; Default **empty**
+        profile (Boolean or 'memory', optional): Whether to record the time and memory usage of each transform; Default **False**
+
     Note:
         The reason we have our own version is because this one offers more freedom to the user.
         For all intends and purposes this class is just a list.
@@ -46,22 +55,230 @@ class Compose(list):
         >>> tf(10)  # (10//2)+1
         6
 
+    Note:
+        When `profile` is enabled, we record the number of calls and wall time of each transform.
+        If you set it to **'memory'**, we also trace the peak memory that gets allocated by each transform with :mod:`tracemalloc`.
+        Note that this only traces memory allocated by python and numpy (eg. not by Pillow or PyTorch) and that it slows down your pipeline considerably.
+        On python versions before 3.9, the peak is reset by restarting the trace, which discards any traces you started yourself. |br|
+        The statistics are stored in shared memory and are thus aggregated over all dataloader workers,
+        as long as you enable profiling in your main process, before the workers get started.
+        Use :func:`~lightnet.data.transform.Compose.report` to get an overview of the statistics.
+
     .. _the issue: https://github.com/pytorch/vision/issues/456
     """
+    def __init__(self, transforms=(), profile=False):
+        super().__init__(transforms)
+        self.profile = profile
+
+    @property
+    def profile(self):
+        return self._profile
+
+    @profile.setter
+    def profile(self, value):
+        self._profile = value
+        if value:
+            self.reset_profile()
+        else:
+            self._stats = None
+            self._stats_lock = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if multiprocessing.context.get_spawning_popen() is None:
+            # Locks can only be pickled when spawning a process, so copies get a new lock
+            state['_stats_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._stats is not None and self._stats_lock is None:
+            self._stats_lock = multiprocessing.Lock()
+
     def __call__(self, data):
+        if self.profile:
+            return self.__profile_call(data)
+
         for tf in self:
             data = tf(data)
         return data
 
+    def __profile_call(self, data):
+        if len(self) != self._stats.shape[0]:
+            log.warning('Transforms were added or removed after enabling profiling, resetting the statistics')
+            self.reset_profile()
+
+        trace_memory = self.profile == 'memory'
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        stats = np.zeros((len(self), 3))
+        for i, tf in enumerate(self):
+            if trace_memory:
+                if hasattr(tracemalloc, 'reset_peak'):
+                    tracemalloc.reset_peak()
+                else:
+                    tracemalloc.stop()
+                    tracemalloc.start()
+                mem_start = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+
+            data = tf(data)
+
+            stats[i, 1] = time.perf_counter() - start
+            if trace_memory:
+                stats[i, 2] = tracemalloc.get_traced_memory()[1] - mem_start
+        stats[:, 0] = 1
+
+        with self._stats_lock:
+            self._stats += torch.from_numpy(stats)
+        return data
+
+    def reset_profile(self):
+        """ Reset the profiling statistics. """
+        self._stats = torch.zeros(len(self), 3, dtype=torch.float64).share_memory_()
+        self._stats_lock = multiprocessing.Lock()
+
+    def report(self):
+        """ Create a report with the profiling statistics of each transform.
+
+        Returns:
+            str: Report with the number of calls, total and mean time and mean peak memory of each transform
+
+        Example:
+            >>> tf = ln.data.transform.Compose([lambda n: n+1, lambda n: n*2], profile=True)
+            >>> tf(10)
+            22
+            >>> print(tf.report())     # doctest: +SKIP
+            Compose profile [1 calls, 0.002 ms]
+              transform        calls      total (s)     mean (ms)     time (%)    peak mem (KiB)
+              <lambda>             1          0.000         0.001         49.6               0.0
+              <lambda>             1          0.000         0.001         50.4               0.0
+        """
+        if not self.profile:
+            return f'{self.__class__.__name__} profile [disabled]'
+
+        stats = self._stats.numpy()
+        calls = stats[:, 0]
+        total = stats[:, 1].sum()
+        mean_time = np.divide(stats[:, 1], calls, out=np.zeros_like(calls), where=calls > 0)
+        mean_mem = np.divide(stats[:, 2], calls, out=np.zeros_like(calls), where=calls > 0)
+        percentage = stats[:, 1] / total * 100 if total > 0 else np.zeros_like(calls)
+
+        names = [self.__transform_name(tf) for tf in self]
+        width = max([9] + [len(name) for name in names])
+        lines = [
+            f'{self.__class__.__name__} profile [{int(calls.max(initial=0))} calls, {total * 1000:.3f} ms]',
+            f'  {"transform":<{width}}  {"calls":>9}  {"total (s)":>13}  {"mean (ms)":>12}  {"time (%)":>11}  {"peak mem (KiB)":>16}',
+        ]
+        for i, name in enumerate(names):
+            lines.append(f'  {name:<{width}}  {int(calls[i]):>9}  {stats[i, 1]:>13.3f}  {mean_time[i] * 1000:>12.3f}  {percentage[i]:>11.1f}  {mean_mem[i] / 1024:>16.1f}')
+
+        return '\n'.join(lines)
+
+    def plan(self, *others, standalone=False):
+        """ Create an optimized version of this pipeline, by merging adjacent transforms into fused implementations. |br|
+        The following transforms get fused:
+
+        - Any combination of :class:`~lightnet.data.transform.RandomJitter`, :class:`~lightnet.data.transform.RandomRotate`
+          and :class:`~lightnet.data.transform.RandomFlip` (in that order), followed by a :class:`~lightnet.data.transform.Letterbox`,
+          are replaced by a single :class:`~lightnet.data.transform.RandomWarp`.
+        - A :class:`torchvision.transforms.ToTensor` followed by a :class:`torchvision.transforms.Normalize`,
+          are replaced by a single transform, which scales and normalizes uint8 images in one pass.
+
+        Args:
+            *others (Compose): Other pipelines that share transforms with this one (eg. the annotation pipeline)
+            standalone (Boolean, optional): Whether the multi-transforms of this pipeline are not used in any other pipeline; Default **False**
+
+        Returns:
+            Compose or tuple: Planned pipeline, or a tuple with this planned pipeline and the other planned pipelines
+
+        Note:
+            Transforms that are shared between multiple pipelines (eg. a RandomFlip in both the image and annotation pipeline),
+            are only fused if they get fused in the same way in all pipelines, so that the fused transform can be shared as well.
+            This is why you should plan your image and annotation pipelines together. |br|
+            If you do not pass any other pipelines, multi-transforms (eg. RandomJitter, RandomFlip, Letterbox) are not fused,
+            unless you set `standalone` to **True** to confirm that they are not used in any other pipeline.
+            Otherwise, the annotation pipeline would keep the original transforms, which no longer get updated and would not match the images.
+
+        Note:
+            The fused transforms are not bit-exact to their original counterparts.
+            They sample their random parameters from the same distributions, but in a different order,
+            and use different interpolation methods.
+
+        Example:
+            >>> lb = ln.data.transform.Letterbox((416, 416))
+            >>> rf = ln.data.transform.RandomFlip(0.5)
+            >>> rj = ln.data.transform.RandomJitter(0.2, True)
+            >>> hsv = ln.data.transform.RandomHSV(0.1, 1.5, 1.5)
+            >>> img_tf = ln.data.transform.Compose([hsv, rj, rf, lb])
+            >>> anno_tf = ln.data.transform.Compose([rj, rf, lb])
+            >>> img_tf, anno_tf = img_tf.plan(anno_tf)
+            >>> img_tf
+            Compose [
+              RandomHSV
+              RandomWarp
+            ]
+            >>> img_tf[1] is anno_tf[0]
+            True
+        """
+        from ._fusion import plan
+        planned = plan([self] + list(others), standalone)
+        planned = [Compose(p, profile=pipeline.profile) for p, pipeline in zip(planned, [self] + list(others))]
+
+        if len(others) == 0:
+            return planned[0]
+        return tuple(planned)
+
+    def scale_hint(self, size):
+        """ Compute how much this pipeline rescales an image, by running through the transforms until one of them rescales it. |br|
+        Datasets use this to decode images at a reduced resolution, if the pipeline shrinks them anyway.
+
+        Args:
+            size (tuple): (width, height) of the original image
+
+        Returns:
+            tuple or None: Largest scale factor that gets applied to the image and the smallest (width, height) of the resulting image, or **None** if this is unknown
+
+        Note:
+            Every transform up to the first one that rescales the image needs a ``scale_hint(size)`` method, which returns such a tuple.
+            If one of them does not have this method (eg. a lambda function), we cannot know what it does to the image and return **None**.
+
+        Example:
+            >>> tf = ln.data.transform.Compose([
+            ...     ln.data.transform.RandomFlip(0.5),
+            ...     ln.data.transform.Letterbox((416, 416)),
+            ...     lambda img: img,
+            ... ])
+            >>> tf.scale_hint((1920, 1080))
+            (0.21666666666666667, (416, 416))
+        """
+        scale = 1
+        for tf in self:
+            if not hasattr(tf, 'scale_hint'):
+                return None
+
+            hint = tf.scale_hint(size)
+            if hint is None:
+                return None
+
+            tf_scale, size = hint
+            scale *= tf_scale
+            if tf_scale != 1:
+                break
+
+        return scale, size
+
+    @staticmethod
+    def __transform_name(tf):
+        if hasattr(tf, '__name__'):
+            return tf.__name__
+        return tf.__class__.__name__
+
     def __repr__(self):
         format_string = self.__class__.__name__ + ' ['
         for tf in self:
-            if hasattr(tf, '__name__'):
-                name = tf.__name__
-            else:
-                name = tf.__class__.__name__
-
-            format_string += f'\n  {name}'
+            format_string += f'\n  {self.__transform_name(tf)}'
         format_string += '\n]'
         return format_string
 
@@ -91,10 +308,16 @@ class BaseMultiTransform(ABC):
     """ Base multiple transform class that is mainly used in pre-processing functions.
     This class exists for transforms that affect both images and annotations.
     It provides a classmethod ``apply``, that will perform the transormation on one (data, target) pair.
+
+    Note:
+        The annotations can either be brambox dataframes or :class:`~lightnet.data.BoxArray` objects.
+        Transforms that do not implement ``_tf_boxes`` convert the box arrays to dataframes and back.
     """
     def __call__(self, data):
         if data is None:
             return None
+        elif isinstance(data, BoxArray):
+            return self._tf_boxes(data)
         elif pd is not None and isinstance(data, pd.DataFrame):
             return self._tf_anno(data)
         elif isinstance(data, Image.Image):
@@ -102,7 +325,7 @@ class BaseMultiTransform(ABC):
         elif isinstance(data, np.ndarray):
             return self._tf_cv(data)
         else:
-            log.error(f'{self.__class__.__name__} only works with <brambox annotation dataframes>, <PIL images> or <OpenCV images> [{type(data)}]')
+            log.error(f'{self.__class__.__name__} only works with <brambox annotation dataframes>, <BoxArrays>, <PIL images> or <OpenCV images> [{type(data)}]')
             return data
 
     @classmethod
@@ -134,3 +357,7 @@ class BaseMultiTransform(ABC):
     @abstractmethod
     def _tf_anno(self, anno):
         return anno
+
+    def _tf_boxes(self, boxes):
+        anno = self._tf_anno(boxes.to_brambox())
+        return BoxArray.from_brambox(anno, boxes.class_label_map)
@@ -31,6 +31,7 @@ class Engine(ABC):
         self.params: HyperParameter object
         self.dataloader: Dataloader object
         self.sigint: Boolean value indicating whether a SIGINT (CTRL+C) was send; Default **False**
+        self.prefetch: Number of mini-batches to fetch in a background thread (see :class:`~lightnet.data.Prefetcher`); Default **0**
         self.*: All values that were passed with the init function and all values from the :class:`~lightnet.engine.HyperParameters` can be accessed in this class
 
     Note:
@@ -39,6 +40,12 @@ class Engine(ABC):
         This allows to define `self.dataloader` as a computed property (@property) of your class, opening up a number of different possibilities,
         like eg. computing different dataloaders depending on which epoch you are.
 
+    Note:
+        By setting `self.prefetch` to a positive number, the engine fetches the next mini-batches from the dataloader in a background thread,
+        while the current mini-batch is being processed. |br|
+        You can override the :func:`~lightnet.engine.Engine.prepare_batch` method to perform extra work in that thread as well (eg. building target tensors).
+        Note that a new input dimension from :func:`~lightnet.data.DataLoader.change_input_dim` takes effect up to `self.prefetch` mini-batches later.
+
     Note:
         This engine allows to define hook functions to run at certain points in the training *(epoch_start, epoch_end, batch_start, batch_end)*.
         The functions can be defined as class methods of your engine without any extra arguments or as separate functions that take the engine as a single argument.
@@ -115,12 +122,16 @@ class Engine(ABC):
 
             idx %= self.batch_subdivisions
             loader = self.dataloader
+            if self.prefetch > 0:
+                loader = ln.data.Prefetcher(loader, self.prefetch, self.prepare_batch)
             for idx, data in enumerate(loader, idx+1):
                 # Batch Start
                 if (idx - 1) % self.batch_subdivisions == 0:
                     self._run_hooks(self.batch + 1, self._batch_start)
 
                 # Forward and backward on (mini-)batches
+                if self.prefetch <= 0:
+                    data = self.prepare_batch(data)
                 self.process_batch(data)
                 if idx % self.batch_subdivisions != 0:
                     continue
@@ -174,6 +185,9 @@ class Engine(ABC):
         elif self.batch_size % self.mini_batch_size != 0 or self.mini_batch_size > self.batch_size:
             raise ValueError('batch_size should be a multiple of mini_batch_size')
 
+        if not hasattr(self, 'prefetch'):
+            self.prefetch = 0
+
     def log(self, msg):
         """ Log messages about training and testing.
         This function will automatically prepend the messages with **TRAIN** or **TEST**.
@@ -290,6 +304,22 @@ class Engine(ABC):
         """
         pass
 
+    def prepare_batch(self, data):
+        """ This function gets called on the data from your dataloader, before passing it to :func:`~lightnet.engine.Engine.process_batch`. |br|
+        When `self.prefetch` is enabled, this function runs in a background thread, overlapping with the processing of the previous mini-batch.
+
+        Args:
+            data: The data that comes from your dataloader
+
+        Return:
+            The data that will be passed to :func:`~lightnet.engine.Engine.process_batch`
+
+        Note:
+            As this function might run in a different thread, it should not modify the state of the engine or network.
+            It is meant for eg. moving the data to the GPU, running batched augmentations (see :class:`~lightnet.data.transform.BatchRandomFlip`) or building target tensors for the loss function.
+        """
+        return data
+
     @abstractmethod
     def process_batch(self, data):
         """ This function should contain the code to process the forward and backward pass of one (mini-)batch.
@@ -6,6 +6,8 @@ Take a look at the code to learn how to use this library, or just use these mode
 
 # Lightnet
 from ._dataset_brambox import *
+from ._dataset_shard import *
+from ._dataset_rgbd import *
 
 # Darknet
 from ._dataset_darknet import *
@@ -5,14 +5,18 @@
 
 import os
 import copy
+import math
 import logging
 from PIL import Image
 import numpy as np
 import lightnet.data as lnd
+from lightnet.data._annotation_store import index_annotations
 
 try:
+    import pandas as pd
     import brambox as bb
 except ImportError:
+    pd = None
     bb = None
 
 __all__ = ['BramboxDataset']
@@ -23,37 +27,98 @@ class BramboxDataset(lnd.Dataset):
     """ Dataset for any brambox annotations.
 
     Args:
-        annotations (dataframe): Dataframe containing brambox annotations
+        annotations (dataframe or lightnet.data.AnnotationStore): Dataframe or store containing brambox annotations
         input_dimension (tuple): (width,height) tuple with default dimensions of the network
         class_label_map (list): List of class_labels
         identify (function, optional): Lambda/function to get image based of annotation filename or image id; Default **replace/add .png extension to filename/id**
         img_transform (torchvision.transforms.Compose): Transforms to perform on the images
         anno_transform (torchvision.transforms.Compose): Transforms to perform on the annotations
+        cache (lightnet.data.SharedImageCache or int, optional): Cache for the decoded images or byte budget to create one; Default **None**
+        box_array (Boolean, optional): Return the annotations as a :class:`~lightnet.data.BoxArray` instead of a brambox dataframe; Default **False**
+        reduced_decode (Boolean, optional): Decode JPEG images at a reduced resolution if the image transforms shrink them anyway; Default **False**
+        decoder (str or callable, optional): Image decoder, which is either one of 'pillow', 'opencv' or 'torchvision' or a function that takes an image path; Default **'pillow'**
 
     Note:
-        This dataset opens images with the Pillow library
+        This dataset opens images with the Pillow library by default.
+        Use the `decoder` argument to pick another backend (see :func:`~lightnet.data.benchmark_decoders` to find the fastest one for your images).
+        The OpenCV and Torchvision decoders return RGB numpy arrays, so the transforms run their OpenCV code paths.
+
+    Note:
+        The annotations get sorted per image when creating this dataset,
+        so that the annotations of an image can be selected as a contiguous slice of the dataframe in ``__getitem__``. |br|
+        If the annotations are not sorted yet (in the order of the categories of the `image` column),
+        the dataset stores a reordered copy of your dataframe, which temporarily doubles its memory usage.
+        Sort your dataframe beforehand to avoid this copy.
+        Annotations without an image (NaN in the `image` column) are ignored.
+
+    Note:
+        If you use a lot of dataloader workers, you might want to convert your annotations to a :class:`~lightnet.data.AnnotationStore`.
+        The dataframe gets copied into each worker process, whereas the memory-mapped arrays of the store are shared between them.
+
+    Note:
+        When using `box_array`, the annotations are never converted to a dataframe,
+        which removes most of the overhead of the annotation transforms. |br|
+        Use :func:`~lightnet.data.tensor_collate` to collate the box arrays in your dataloader,
+        or call :func:`~lightnet.data.BoxArray.to_brambox` if you need the dataframes after all.
+
+    Note:
+        With `reduced_decode`, we ask the image transforms how much they shrink an image with :func:`~lightnet.data.transform.Compose.scale_hint`.
+        If the image gets downscaled by 2x or more, we let libjpeg decode it at 1/2, 1/4 or 1/8 of its size with :meth:`PIL.Image.Image.draft`,
+        which is a lot faster than decoding the full image and makes the resizing cheaper as well.
+        The decoded image is never smaller than what the transforms need. |br|
+        The annotations are rescaled to match the decoded image before running the annotation transforms,
+        so that the transformed images and annotations still line up.
+        Images are always decoded at full resolution when using a `cache`, as these are shared between different input dimensions.
+        Reduced decoding only works with decoders that return lazily loaded Pillow images, like the default :class:`~lightnet.data.PillowDecoder`.
     """
-    def __init__(self, annotations, input_dimension, class_label_map=None, identify=None, img_transform=None, anno_transform=None):
+    def __init__(self, annotations, input_dimension, class_label_map=None, identify=None, img_transform=None, anno_transform=None, cache=None, box_array=False,
+                 reduced_decode=False, decoder=None):
         if bb is None:
             raise ImportError('Brambox needs to be installed to use this dataset')
         super().__init__(input_dimension)
 
         self.annos = annotations
-        self.keys = self.annos.image.cat.categories
+        if isinstance(self.annos, lnd.AnnotationStore):
+            self.keys = self.annos.keys
+        else:
+            self.keys = self.annos.image.cat.categories
         self.img_tf = img_transform
         self.anno_tf = anno_transform
+        self.box_array = box_array
+        self.reduced_decode = reduced_decode
+        self.decoder = lnd.get_decoder(decoder)
+        if isinstance(cache, int):
+            cache = lnd.SharedImageCache(cache, len(self.keys))
+        self.cache = cache
 
         if callable(identify):
             self.id = identify
         else:
             self.id = lambda name: os.path.splitext(name)[0] + '.png'
 
+        # Annotation store
+        if isinstance(self.annos, lnd.AnnotationStore):
+            if class_label_map is not None and list(class_label_map) != self.annos.class_label_map:
+                raise ValueError('The class_label_map should be the same as the one from the annotation store')
+            self.class_label_map = self.annos.class_label_map
+            self.anno_start = self.annos.anno_start
+            self.anno_stop = self.annos.anno_stop
+            return
+
         # Add class_ids
         if class_label_map is None:
             log.warning(f'No class_label_map given, generating it by sorting unique class labels from data alphabetically, which is not always deterministic behaviour')
             class_label_map = list(np.sort(self.annos.class_label.unique()))
+        self.class_label_map = list(class_label_map)
         self.annos['class_id'] = self.annos.class_label.map(dict((l, i) for i, l in enumerate(class_label_map)))
 
+        # Index annotations per image
+        order, offsets = index_annotations(self.annos)
+        if order is not None:
+            self.annos = self.annos.iloc[order]
+        self.anno_start = offsets[:-1]
+        self.anno_stop = offsets[1:]
+
     def __len__(self):
         return len(self.keys)
 
@@ -71,8 +136,16 @@ class BramboxDataset(lnd.Dataset):
             raise IndexError(f'list index out of range [{index}/{len(self)-1}]')
 
         # Load
-        img = Image.open(self.id(self.keys[index]))
-        anno = bb.util.select_images(self.annos, [self.keys[index]])
+        scale = None
+        if self.cache is not None:
+            img = self.cache(index, self._get_image)
+        elif self.reduced_decode:
+            img, scale = self._get_image_reduced(index)
+        else:
+            img = self._get_image(index)
+        anno = self._get_anno(index)
+        if scale is not None:
+            self._scale_anno(anno, *scale)
 
         # Transform
         if self.img_tf is not None:
@@ -81,3 +154,73 @@ class BramboxDataset(lnd.Dataset):
             anno = self.anno_tf(anno)
 
         return img, anno
+
+    def _get_image(self, index):
+        """ Load the image (before any transformation). """
+        return self.decoder(self.id(str(self.keys[index])))
+
+    def _get_image_reduced(self, index):
+        """ Load the image at a reduced resolution if the image transforms downscale it by at least a factor 2.
+
+        Returns:
+            tuple: image and (x, y) factors with which it got downscaled, or **None** if it was decoded at full resolution
+        """
+        img = self._get_image(index)
+        scale_hint = getattr(self.img_tf, 'scale_hint', None)
+        if scale_hint is None or not isinstance(img, Image.Image):
+            return img, None
+
+        im_w, im_h = img.size
+        hint = scale_hint((im_w, im_h))
+        if hint is None or hint[0] > 0.5:
+            return img, None
+
+        # Draft is a no-op for other formats than JPEG and picks the largest DCT scaling that still gives us the requested size
+        img.draft(img.mode, (math.ceil(im_w * hint[0]), math.ceil(im_h * hint[0])))
+        if img.size == (im_w, im_h):
+            return img, None
+        return img, (img.size[0] / im_w, img.size[1] / im_h)
+
+    @staticmethod
+    def _scale_anno(anno, scale_x, scale_y):
+        """ Rescale the annotations of an image in place. """
+        if isinstance(anno, lnd.BoxArray):
+            anno.coords *= np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float32)
+        else:
+            anno['x_top_left'] *= scale_x
+            anno['y_top_left'] *= scale_y
+            anno['width'] *= scale_x
+            anno['height'] *= scale_y
+
+    def _get_anno(self, index):
+        """ Get the annotations of one image, as :func:`brambox.util.select_images` would return them. """
+        if self.box_array:
+            return self._get_boxes(index)
+        if isinstance(self.annos, lnd.AnnotationStore):
+            return self.annos.to_brambox(index)
+
+        anno = self.annos.iloc[self.anno_start[index]:self.anno_stop[index]].reset_index(drop=True)
+        anno['image'] = pd.Categorical.from_codes(np.zeros(len(anno.index), dtype=np.int8), categories=[self.keys[index]])
+        return anno
+
+    def _get_boxes(self, index):
+        """ Get the annotations of one image as a :class:`~lightnet.data.BoxArray`. """
+        start, stop = self.anno_start[index], self.anno_stop[index]
+        if isinstance(self.annos, lnd.AnnotationStore):
+            columns = self.annos.columns
+        else:
+            names = ('x_top_left', 'y_top_left', 'width', 'height', 'class_id', 'ignore', 'truncated')
+            columns = {name: self.annos[name].values for name in names if name in self.annos.columns}
+
+        coords = np.empty((stop - start, 4), dtype=np.float32)
+        for i, name in enumerate(('x_top_left', 'y_top_left', 'width', 'height')):
+            coords[:, i] = columns[name][start:stop]
+
+        return lnd.BoxArray(
+            coords,
+            columns['class_id'][start:stop],
+            columns['ignore'][start:stop] if 'ignore' in columns else None,
+            columns['truncated'][start:stop] if 'truncated' in columns else None,
+            str(self.keys[index]),
+            self.class_label_map,
+        )
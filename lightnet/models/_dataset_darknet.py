@@ -33,11 +33,12 @@ class DarknetDataset(BramboxDataset):
         hue (Number, optional): Determines hue shift; Default **0.1**
         saturation (Number, optional): Determines saturation shift; Default **1.5**
         value (Number, optional): Determines value (exposure) shift; Default **1.5**
+        decoder (str or callable, optional): Image decoder (see :class:`~lightnet.models.BramboxDataset`); Default **'pillow'**
 
     Returns:
         tuple: image_tensor, list of brambox boxes
     """
-    def __init__(self, data_file, class_label_map, augment=True, input_dimension=(416, 416), jitter=.2, flip=.5, hue=.1, saturation=1.5, value=1.5):
+    def __init__(self, data_file, class_label_map, augment=True, input_dimension=(416, 416), jitter=.2, flip=.5, hue=.1, saturation=1.5, value=1.5, decoder=None):
         if bb is None:
             raise ImportError('Brambox needs to be installed to use this dataset')
 
@@ -75,4 +76,4 @@ class DarknetDataset(BramboxDataset):
             img_tf = lnd.transform.Compose([lb, it])
             anno_tf = lnd.transform.Compose([lb])
 
-        super().__init__(annos, input_dimension, class_label_map, identify, img_tf, anno_tf)
+        super().__init__(annos, input_dimension, class_label_map, identify, img_tf, anno_tf, decoder=decoder)
@@ -0,0 +1,113 @@
+#
+#   Lightnet dataset that loads aligned color and depth images
+#   Copyright EAVISE
+#
+
+import os
+import logging
+from PIL import Image
+import numpy as np
+import torch
+from ._dataset_brambox import BramboxDataset
+import lightnet.data as lnd
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+__all__ = ['RGBDDataset']
+log = logging.getLogger(__name__)
+
+
+class RGBDDataset(BramboxDataset):
+    """ Dataset for brambox annotations on registered color and depth images. |br|
+    The color image and its 16-bit depth map are loaded as one HxWx4 uint16 numpy array (R, G, B, D),
+    so that the image transforms (eg. Letterbox, RandomFlip, RandomJitter) are performed jointly on both modalities.
+
+    Args:
+        annotations (dataframe): Dataframe containing brambox annotations
+        input_dimension (tuple): (width,height) tuple with default dimensions of the network
+        class_label_map (list): List of class_labels
+        identify (function, optional): Lambda/function to get the color image based of annotation filename or image id; Default **replace/add .png extension to filename/id**
+        depth_identify (function, optional): Lambda/function to get the depth image based of annotation filename or image id; Default **replace/add _depth.png extension to filename/id**
+        img_transform (torchvision.transforms.Compose): Transforms to perform on the RGBD arrays
+        anno_transform (torchvision.transforms.Compose): Transforms to perform on the annotations
+        depth_scale (Number, optional): Factor to multiply the depth values with when converting to a tensor; Default **1/65535**
+        cache (lightnet.data.SharedImageCache or int, optional): Cache for the decoded images or byte budget to create one; Default **None**
+        box_array (Boolean, optional): Return the annotations as a :class:`~lightnet.data.BoxArray` instead of a brambox dataframe; Default **False**
+
+    Returns:
+        tuple: [4xHxW] float tensor (RGB divided by 255, depth multiplied by depth_scale), brambox annotations
+
+    Note:
+        This dataset opens images with OpenCV if it is installed and falls back to Pillow otherwise. |br|
+        The image transforms receive the RGBD data as a numpy array, and thus run their OpenCV code path.
+        If the result of the image transforms is still a numpy array, it is converted to a contiguous float tensor,
+        ready to be used by :class:`~lightnet.models.YoloFusion`.
+
+    Note:
+        The color channels are stored as uint16 in the array, so they still range from 0-255. |br|
+        Photometric transforms should only modify the right channels, eg. ``RandomHSV(..., channels=(0, 1, 2))`` and ``RandomDepth(..., channels=(3,))``.
+        The geometric transforms accept a fill value per channel, so that the borders of the depth map can be filled with invalid depth,
+        eg. ``Letterbox(dataset=dataset, fill_color=(127, 127, 127, 0))``.
+    """
+    def __init__(self, annotations, input_dimension, class_label_map=None, identify=None, depth_identify=None, img_transform=None, anno_transform=None,
+                 depth_scale=1/65535, cache=None, box_array=False):
+        super().__init__(annotations, input_dimension, class_label_map, identify, img_transform, anno_transform, cache, box_array)
+
+        if callable(depth_identify):
+            self.depth_id = depth_identify
+        else:
+            self.depth_id = lambda name: os.path.splitext(name)[0] + '_depth.png'
+
+        self.depth_scale = depth_scale
+        self.channel_scale = np.array([1/255] * 3 + [depth_scale], dtype=np.float32)[:, None, None]
+
+    @lnd.Dataset.resize_getitem
+    def __getitem__(self, index):
+        """ Get transformed RGBD tensor and annotations based of the index of ``self.keys``
+
+        Args:
+            index (int): index of the ``self.keys`` list containing all the image identifiers of the dataset.
+
+        Returns:
+            tuple: (transformed RGBD tensor, list of transformed brambox boxes)
+        """
+        img, anno = super().__getitem__(index)
+        if isinstance(img, np.ndarray):
+            img = self._to_tensor(img)
+
+        return img, anno
+
+    def _get_image(self, index):
+        """ Load the color and depth image in one RGBD array (before any transformation). """
+        key = str(self.keys[index])
+        color_path = self.id(key)
+        depth_path = self.depth_id(key)
+
+        if cv2 is not None:
+            color = cv2.imread(color_path, cv2.IMREAD_COLOR)
+            depth = cv2.imread(depth_path, cv2.IMREAD_ANYDEPTH)
+            if color is None or depth is None:
+                raise FileNotFoundError(f'Could not read image [{color_path if color is None else depth_path}]')
+            color = color[..., ::-1]    # BGR -> RGB
+        else:
+            with Image.open(color_path) as img:
+                color = np.asarray(img.convert('RGB'))
+            with Image.open(depth_path) as img:
+                depth = np.asarray(img)
+
+        if color.shape[:2] != depth.shape[:2]:
+            raise ValueError(f'Color and depth images should have the same size [{color.shape[1::-1]}, {depth.shape[1::-1]}]')
+
+        img = np.empty(color.shape[:2] + (4,), dtype=np.uint16)
+        img[..., :3] = color
+        img[..., 3] = depth
+        return img
+
+    def _to_tensor(self, img):
+        """ Convert HxWxC array to a contiguous CxHxW float tensor, scaling the color and depth channels. """
+        tensor = torch.empty(img.shape[2], img.shape[0], img.shape[1], dtype=torch.float32)
+        np.multiply(img.transpose(2, 0, 1), self.channel_scale, out=tensor.numpy())
+        return tensor
@@ -0,0 +1,344 @@
+#
+#   Lightnet dataset that reads images and annotations from packed, memory-mapped shard files
+#   Copyright EAVISE
+#
+
+import os
+import io
+import json
+import logging
+from PIL import Image
+import numpy as np
+import lightnet.data as lnd
+from lightnet.data._annotation_store import index_annotations, get_class_ids
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+__all__ = ['ShardDataset', 'ShardWriter']
+log = logging.getLogger(__name__)
+
+INDEX_DTYPE = np.dtype([
+    ('shard', np.int32),
+    ('offset', np.int64),
+    ('nbytes', np.int64),
+    ('height', np.int32),
+    ('width', np.int32),
+    ('channels', np.int32),
+    ('anno_start', np.int64),
+    ('anno_stop', np.int64),
+])
+BOX_DTYPE = np.dtype([
+    ('x_top_left', np.float32),
+    ('y_top_left', np.float32),
+    ('width', np.float32),
+    ('height', np.float32),
+    ('class_id', np.int32),
+    ('occluded', np.float32),
+    ('truncated', np.float32),
+    ('lost', np.bool_),
+    ('difficult', np.bool_),
+    ('ignore', np.bool_),
+])
+ALIGNMENT = 64
+
+
+class ShardWriter:
+    """ Pack images and their brambox annotations into a few big binary shard files, that can be read back with a :class:`~lightnet.models.ShardDataset`.
+
+    Args:
+        path (str or path-like): Folder to write the shards to (gets created if it does not exist)
+        class_label_map (list): List of class_labels
+        encoded (Boolean, optional): Whether to store the encoded image files or the decoded pixel arrays; Default **True**
+        shard_size (int, optional): Maximal size of one shard file in bytes; Default **1GiB**
+
+    Note:
+        Encoded shards contain the raw bytes of your image files (eg. jpeg) and are thus small, but images still need to be decoded in ``__getitem__``.
+        Decoded shards store the pixel arrays, which removes the decoding cost at the expense of (a lot) more disk space. |br|
+        All images of a decoded shard need to have the same dtype, but they can have any number of channels (eg. 4 channel RGB-D images).
+
+    Example:
+        >>> with ln.models.ShardWriter('data/train_shards', class_label_map) as writer:     # doctest: +SKIP
+        ...     for key in keys:
+        ...         writer.add(key, f'data/images/{key}.jpg', annos[annos.image == key])
+
+        If all your data is described by one brambox dataframe, you can also use the :meth:`~lightnet.models.ShardWriter.from_brambox` method.
+
+        >>> ln.models.ShardWriter.from_brambox('data/train_shards', annos, class_label_map, lambda key: f'data/images/{key}.jpg')  # doctest: +SKIP
+    """
+    def __init__(self, path, class_label_map, encoded=True, shard_size=2**30):
+        if pd is None:
+            raise ImportError('Pandas needs to be installed to use this writer')
+
+        self.path = path
+        self.class_label_map = list(class_label_map)
+        self.encoded = encoded
+        self.shard_size = shard_size
+        os.makedirs(self.path, exist_ok=True)
+
+        self.keys = []
+        self.dtype = None
+        self.shards = []
+        self.__class_ids = dict((l, i) for i, l in enumerate(self.class_label_map))
+        self.__index = []
+        self.__boxes = []
+        self.__num_boxes = 0
+        self.__file = None
+        self.__offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @classmethod
+    def from_brambox(cls, path, annotations, class_label_map, identify=None, encoded=True, shard_size=2**30):
+        """ Pack all images of a brambox annotation dataframe.
+
+        Args:
+            path (str or path-like): Folder to write the shards to
+            annotations (dataframe): Dataframe containing brambox annotations
+            class_label_map (list): List of class_labels
+            identify (function, optional): Lambda/function to get image based of annotation filename or image id; Default **replace/add .png extension to filename/id**
+            encoded (Boolean, optional): Whether to store the encoded image files or the decoded pixel arrays; Default **True**
+            shard_size (int, optional): Maximal size of one shard file in bytes; Default **1GiB**
+
+        Note:
+            The images are stored in the order of the categories of the `image` column,
+            which is the same order as the :class:`~lightnet.models.BramboxDataset` uses.
+        """
+        if not callable(identify):
+            def identify(name):
+                return os.path.splitext(name)[0] + '.png'
+
+        keys = annotations.image.cat.categories
+        order, offsets = index_annotations(annotations)
+        if order is None:
+            order = np.arange(len(annotations.index))
+
+        with cls(path, class_label_map, encoded, shard_size) as writer:
+            for key, start, stop in zip(keys, offsets[:-1], offsets[1:]):
+                writer.add(key, identify(key), annotations.iloc[order[start:stop]])
+
+    def add(self, key, image, anno=None):
+        """ Add one image with its annotations to the shards.
+
+        Args:
+            key (str): Image identifier, which will be used in the `image` column of the annotations
+            image (path, bytes, PIL.Image or numpy.ndarray): Image to add (see Note)
+            anno (dataframe, optional): Brambox annotations of this image; Default **no annotations**
+
+        Note:
+            Encoded shards require the image to be a path or the bytes of an encoded image file. |br|
+            Decoded shards accept paths (opened with Pillow), Pillow images or numpy arrays in HWC order.
+        """
+        if self.encoded:
+            if isinstance(image, (bytes, bytearray, memoryview)):
+                data = image
+            elif isinstance(image, (str, os.PathLike)):
+                with open(image, 'rb') as f:
+                    data = f.read()
+            else:
+                raise TypeError(f'Encoded shards require a path or bytes as image [{type(image)}]')
+            shape = (0, 0, 0)
+        else:
+            if isinstance(image, (str, os.PathLike)):
+                with Image.open(image) as img:
+                    data = np.asarray(img)
+            elif isinstance(image, Image.Image):
+                data = np.asarray(image)
+            elif isinstance(image, np.ndarray):
+                data = np.ascontiguousarray(image)
+            else:
+                raise TypeError(f'Decoded shards require a path, Pillow image or numpy array as image [{type(image)}]')
+
+            if self.dtype is None:
+                self.dtype = data.dtype
+            elif data.dtype != self.dtype:
+                raise ValueError(f'All images in a decoded shard need to have the same dtype [{data.dtype}/{self.dtype}]')
+            shape = data.shape[:2] + (data.shape[2] if data.ndim > 2 else 1,)
+            data = memoryview(data).cast('B')
+
+        nbytes = len(data)
+        if self.__file is None or (self.__offset > 0 and self.__offset + nbytes > self.shard_size):
+            self.__new_shard()
+
+        self.__file.write(data)
+        num_boxes = self.__add_anno(anno)
+        self.__index.append((len(self.shards) - 1, self.__offset, nbytes) + shape + (self.__num_boxes, self.__num_boxes + num_boxes))
+        self.__num_boxes += num_boxes
+        self.keys.append(key)
+
+        padding = -(self.__offset + nbytes) % ALIGNMENT
+        self.__file.write(b'\0' * padding)
+        self.__offset += nbytes + padding
+
+    def close(self):
+        """ Finish writing the shards and store the index files. |br|
+        This function gets called automatically when using this writer as a context manager.
+        """
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+        np.save(os.path.join(self.path, 'index.npy'), np.array(self.__index, dtype=INDEX_DTYPE))
+        if len(self.__boxes) > 0:
+            boxes = np.concatenate(self.__boxes)
+        else:
+            boxes = np.empty(0, dtype=BOX_DTYPE)
+        np.save(os.path.join(self.path, 'boxes.npy'), boxes)
+
+        meta = {
+            'encoded': self.encoded,
+            'dtype': None if self.dtype is None else np.dtype(self.dtype).str,
+            'shards': self.shards,
+            'keys': [str(k) for k in self.keys],
+            'class_label_map': self.class_label_map,
+        }
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+    def __new_shard(self):
+        if self.__file is not None:
+            self.__file.close()
+
+        name = f'data_{len(self.shards):05d}.bin'
+        self.shards.append(name)
+        self.__file = open(os.path.join(self.path, name), 'wb')
+        self.__offset = 0
+
+    def __add_anno(self, anno):
+        if anno is None or len(anno.index) == 0:
+            return 0
+
+        boxes = np.zeros(len(anno.index), dtype=BOX_DTYPE)
+        boxes['class_id'] = get_class_ids(anno.class_label.values, self.__class_ids)
+        for col in ('x_top_left', 'y_top_left', 'width', 'height', 'occluded', 'truncated', 'lost', 'difficult', 'ignore'):
+            if col in anno.columns:
+                boxes[col] = anno[col].values
+
+        self.__boxes.append(boxes)
+        return len(boxes)
+
+
+class ShardDataset(lnd.Dataset):
+    """ Dataset that reads images and annotations from shards created with a :class:`~lightnet.models.ShardWriter`.
+    All data gets memory-mapped, so that getting an item is a simple slice of the shards, without any filesystem lookups.
+
+    Args:
+        path (str or path-like): Folder containing the shards
+        input_dimension (tuple): (width,height) tuple with default dimensions of the network
+        img_transform (torchvision.transforms.Compose): Transforms to perform on the images
+        anno_transform (torchvision.transforms.Compose): Transforms to perform on the annotations
+        pil (Boolean, optional): Whether to return decoded images as Pillow images or as numpy arrays; Default **True**
+
+    Note:
+        The annotations are returned as brambox dataframes with an extra `class_id` column,
+        exactly like the ones from :class:`~lightnet.models.BramboxDataset`.
+        This means you can use this dataset as a drop-in replacement, with the exact same transformation pipelines.
+    """
+    def __init__(self, path, input_dimension, img_transform=None, anno_transform=None, pil=True):
+        if pd is None:
+            raise ImportError('Pandas needs to be installed to use this dataset')
+        super().__init__(input_dimension)
+
+        self.path = path
+        self.img_tf = img_transform
+        self.anno_tf = anno_transform
+        self.pil = pil
+
+        with open(os.path.join(self.path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        self.encoded = meta['encoded']
+        self.dtype = None if meta['dtype'] is None else np.dtype(meta['dtype'])
+        self.shard_files = meta['shards']
+        self.keys = meta['keys']
+        self.class_label_map = meta['class_label_map']
+
+        self._class_labels = np.array(self.class_label_map, dtype=object)
+        self.__open()
+
+    def __getstate__(self):
+        """ Memory-mapped arrays get copied entirely when pickled, so we reopen them when unpickling instead. """
+        state = self.__dict__.copy()
+        for key in ('_ShardDataset__index', '_ShardDataset__boxes', '_ShardDataset__shards'):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__open()
+
+    def __open(self):
+        self.__index = np.load(os.path.join(self.path, 'index.npy'), mmap_mode='r')
+        self.__boxes = np.load(os.path.join(self.path, 'boxes.npy'), mmap_mode='r')
+        self.__shards = [np.memmap(os.path.join(self.path, f), dtype=np.uint8, mode='r') for f in self.shard_files]
+
+    def __len__(self):
+        return len(self.keys)
+
+    @lnd.Dataset.resize_getitem
+    def __getitem__(self, index):
+        """ Get transformed image and annotations based of the index of ``self.keys``
+
+        Args:
+            index (int): index of the ``self.keys`` list containing all the image identifiers of the dataset.
+
+        Returns:
+            tuple: (transformed image, transformed brambox dataframe)
+        """
+        if index >= len(self):
+            raise IndexError(f'list index out of range [{index}/{len(self)-1}]')
+
+        # Load
+        entry = self.__index[index]
+        img = self._get_image(entry)
+        anno = self._get_anno(index, self.__boxes[entry['anno_start']:entry['anno_stop']])
+
+        # Transform
+        if self.img_tf is not None:
+            img = self.img_tf(img)
+        if self.anno_tf is not None:
+            anno = self.anno_tf(anno)
+
+        return img, anno
+
+    def _get_image(self, entry):
+        offset = entry['offset']
+        data = self.__shards[entry['shard']][offset:offset+entry['nbytes']]
+
+        if self.encoded:
+            img = Image.open(io.BytesIO(data))
+            if not self.pil:
+                img = np.asarray(img)
+            return img
+
+        if entry['channels'] == 1:
+            img = data.view(self.dtype).reshape(entry['height'], entry['width'])
+        else:
+            img = data.view(self.dtype).reshape(entry['height'], entry['width'], entry['channels'])
+
+        if self.pil:
+            return Image.fromarray(img)
+        return np.array(img)
+
+    def _get_anno(self, index, boxes):
+        num_boxes = len(boxes)
+        return pd.DataFrame({
+            'image': pd.Categorical.from_codes(np.zeros(num_boxes, dtype=np.int8), categories=[self.keys[index]]),
+            'class_label': self._class_labels[boxes['class_id']],
+            'id': np.full(num_boxes, np.nan),
+            'x_top_left': boxes['x_top_left'].astype(np.float64),
+            'y_top_left': boxes['y_top_left'].astype(np.float64),
+            'width': boxes['width'].astype(np.float64),
+            'height': boxes['height'].astype(np.float64),
+            'occluded': boxes['occluded'].astype(np.float64),
+            'truncated': boxes['truncated'].astype(np.float64),
+            'lost': boxes['lost'].astype(bool),
+            'difficult': boxes['difficult'].astype(bool),
+            'ignore': boxes['ignore'].astype(bool),
+            'class_id': boxes['class_id'].astype(np.int64),
+        })
@@ -64,7 +64,7 @@ class RegionLoss(nn.modules.loss._Loss):
 
         Args:
             output (torch.autograd.Variable): Output from the network
-            target (brambox annotation dataframe or torch.Tensor): Brambox annotations or tensor containing the annotation targets (see :class:`lightnet.data.BramboxToTensor`)
+            target (brambox annotation dataframe, torch.Tensor or tuple): Brambox annotations, tensor containing the annotation targets (see :class:`lightnet.data.BramboxToTensor`) or compact targets (see :func:`lightnet.data.tensor_collate`)
             seen (int, optional): How many images the network has already been trained on; Default **Add batch_size to previous seen value**
 
         Note:
@@ -89,6 +89,11 @@ class RegionLoss(nn.modules.loss._Loss):
             this loss function will also consider the ``ignore`` flag of annotations and ignore detections that match with it.
             This allows you to have annotations that will not influence the loss in any way,
             as opposed to having them removed and counting them as false detections.
+
+        Note:
+            The compact `(boxes, offsets)` tuple from :func:`~lightnet.data.tensor_collate` (or only the `[num_anno, 6]` boxes tensor) can also be used as target.
+            This format has the same advantages as brambox dataframes (ignored annotations have a class_id of **-1**),
+            but does not require any pandas processing in the main process.
         """
         # Parameters
         nB = output.data.size(0)
@@ -153,7 +158,9 @@ class RegionLoss(nn.modules.loss._Loss):
 
     def build_targets(self, pred_boxes, ground_truth, nB, nH, nW):
         """ Compare prediction boxes and targets, convert targets to network output tensors """
-        if torch.is_tensor(ground_truth):
+        if isinstance(ground_truth, (tuple, list)) or (torch.is_tensor(ground_truth) and ground_truth.dim() == 2):
+            return self.__build_targets_compact(pred_boxes, ground_truth, nB, nH, nW)
+        elif torch.is_tensor(ground_truth):
             return self.__build_targets_tensor(pred_boxes, ground_truth, nB, nH, nW)
         elif pd is not None and isinstance(ground_truth, pd.DataFrame):
             return self.__build_targets_brambox(pred_boxes, ground_truth, nB, nH, nW)
@@ -235,6 +242,101 @@ class RegionLoss(nn.modules.loss._Loss):
             tcls.view(nB, nA, nPixels)
         )
 
+    def __build_targets_compact(self, pred_boxes, ground_truth, nB, nH, nW):
+        """ Compare prediction boxes and ground truths, convert ground truths to network output tensors """
+        # Parameters
+        nA = self.num_anchors
+        nAnchors = nA*nH*nW
+        nPixels = nH*nW
+
+        if isinstance(ground_truth, (tuple, list)):
+            ground_truth, offsets = ground_truth
+            ground_truth = ground_truth.cpu()
+            offsets = offsets.cpu()
+        else:
+            ground_truth = ground_truth.cpu()
+            ground_truth = ground_truth[ground_truth[:, 0].argsort()]
+            offsets = torch.zeros(nB + 1, dtype=torch.long)
+            offsets[1:] = torch.bincount(ground_truth[:, 0].long(), minlength=nB).cumsum(0)
+
+        # Tensors
+        coord_mask = torch.zeros(nB, nA, nH, nW, requires_grad=False)
+        conf_mask = torch.ones(nB, nA, nH, nW, requires_grad=False) * self.noobject_scale
+        cls_mask = torch.zeros(nB, nA, nH, nW, requires_grad=False).byte()
+        tcoord = torch.zeros(nB, nA, 4, nH, nW, requires_grad=False)
+        tconf = torch.zeros(nB, nA, nH, nW, requires_grad=False)
+        tcls = torch.zeros(nB, nA, nH, nW, requires_grad=False)
+
+        if self.training and self.seen < self.coord_prefill:
+            coord_mask.fill_(math.sqrt(.01 / self.coord_scale))
+            if self.anchor_step == 4:
+                tcoord[:, :, 0] = self.anchors[:, 2].contiguous().view(1, nA, 1, 1).repeat(nB, 1, 1, nPixels)
+                tcoord[:, :, 1] = self.anchors[:, 3].contiguous().view(1, nA, 1, 1).repeat(nB, 1, 1, nPixels)
+            else:
+                tcoord[:, :, 0].fill_(0.5)
+                tcoord[:, :, 1].fill_(0.5)
+
+        if self.anchor_step == 4:
+            anchors = self.anchors.clone()
+            anchors[:, :2] = 0
+        else:
+            anchors = torch.cat([torch.zeros_like(self.anchors), self.anchors], 1)
+
+        for b in range(nB):
+            gt_filtered = ground_truth[offsets[b]:offsets[b+1]]
+            if gt_filtered.numel() == 0:    # No gt for this image
+                continue
+            cur_pred_boxes = pred_boxes[b*nAnchors:(b+1)*nAnchors]
+
+            # Create ground_truth tensor
+            gt = torch.empty((gt_filtered.shape[0], 4), requires_grad=False)
+            gt[:, 2:4] = gt_filtered[:, 4:6] / self.stride
+            gt[:, 0:2] = gt_filtered[:, 2:4] / self.stride + (gt[:, 2:4] / 2)
+
+            # Set confidence mask of matching detections to 0
+            iou_gt_pred = bbox_ious(gt, cur_pred_boxes)
+            mask = (iou_gt_pred > self.thresh).sum(0) >= 1
+            conf_mask[b][mask.view_as(conf_mask[b])] = 0
+
+            # Find best anchor for each gt
+            iou_gt_anchors = bbox_wh_ious(gt, anchors)
+            _, best_anchors = iou_gt_anchors.max(1)
+
+            # Set masks and target values for each gt
+            nGT = gt.shape[0]
+            gi = gt[:, 0].clamp(0, nW-1).long()
+            gj = gt[:, 1].clamp(0, nH-1).long()
+
+            conf_mask[b, best_anchors, gj, gi] = self.object_scale
+            tconf[b, best_anchors, gj, gi] = iou_gt_pred.view(nGT, nA, nH, nW)[torch.arange(nGT), best_anchors, gj, gi]
+            coord_mask[b, best_anchors, gj, gi] = 2 - (gt[:, 2] * gt[:, 3]) / nPixels
+            tcoord[b, best_anchors, 0, gj, gi] = gt[:, 0] - gi.float()
+            tcoord[b, best_anchors, 1, gj, gi] = gt[:, 1] - gj.float()
+            tcoord[b, best_anchors, 2, gj, gi] = (gt[:, 2] / self.anchors[best_anchors, 0]).log()
+            tcoord[b, best_anchors, 3, gj, gi] = (gt[:, 3] / self.anchors[best_anchors, 1]).log()
+            cls_mask[b, best_anchors, gj, gi] = 1
+            tcls[b, best_anchors, gj, gi] = gt_filtered[:, 1]
+
+            # Set masks of ignored to zero
+            ignore_mask = gt_filtered[:, 1] < 0
+            if ignore_mask.any():
+                gi = gi[ignore_mask]
+                gj = gj[ignore_mask]
+                best_anchors = best_anchors[ignore_mask]
+
+                conf_mask[b, best_anchors, gj, gi] = 0
+                coord_mask[b, best_anchors, gj, gi] = 0
+                cls_mask[b, best_anchors, gj, gi] = 0
+
+        return (
+            coord_mask.view(nB, nA, 1, nPixels),
+            conf_mask.view(nB, nA, nPixels),
+            cls_mask.view(nB, nA, nPixels),
+            tcoord.view(nB, nA, 4, nPixels),
+            tconf.view(nB, nA, nPixels),
+            tcls.view(nB, nA, nPixels)
+        )
+
     def __build_targets_brambox(self, pred_boxes, ground_truth, nB, nH, nW):
         """ Compare prediction boxes and ground truths, convert ground truths to network output tensors """
         # Parameters
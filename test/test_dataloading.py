@@ -0,0 +1,209 @@
+#
+#   Test dataloading mechanisms
+#   Copyright EAVISE
+#
+
+import copy
+import pickle
+import pytest
+import torch
+import lightnet as ln
+
+
+class DimSet(ln.data.Dataset):
+    def __init__(self, length=20, input_dimension=(416, 416)):
+        super().__init__(input_dimension)
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    @ln.data.Dataset.resize_getitem
+    def __getitem__(self, index):
+        return torch.tensor(self.input_dim), index
+
+
+def test_aspect_ratio_batch_sampler():
+    ratios = [16/9] * 10 + [1] * 6 + [3/4] * 4
+    dataset = DimSet(len(ratios))
+    sampler = ln.data.AspectRatioBatchSampler(torch.utils.data.RandomSampler(dataset), 4, False, ratios)
+    dl = ln.data.DataLoader(dataset, batch_sampler=sampler)
+    assert sampler.input_dim == (416, 416)
+
+    seen = []
+    for dims, idx in dl:
+        assert len({ratios[i] for i in idx.tolist()}) == 1
+        assert (dims == dims[0]).all()
+        w, h = dims[0].tolist()
+        assert w % 32 == 0 and h % 32 == 0
+        assert abs(w / h - ratios[idx[0]]) < 0.2
+        seen.extend(idx.tolist())
+    assert sorted(seen) == list(range(len(ratios)))
+    assert len(dl) == 3 + 2 + 1
+
+    dl.change_input_dim(320, None)
+    dims, _ = next(iter(dl))
+    assert abs(dims[0, 0].item() * dims[0, 1].item() - 320 * 320) < 0.15 * 320 * 320
+
+
+def test_prefetcher():
+    dataset = DimSet(12)
+    dl = ln.data.Prefetcher(ln.data.DataLoader(dataset, batch_size=2), depth=2, prepare=lambda data: (data[0], data[1] * 10))
+    assert len(dl) == 6
+
+    seen = []
+    for i, (dims, idx) in enumerate(dl):
+        assert (dims == dims[0]).all()
+        seen.extend(idx.tolist())
+        if i == 0:
+            dl.change_input_dim(320, None)
+    assert seen == list(range(0, 120, 10))
+    assert dims[0].tolist() == [320, 320]
+
+    # Errors in the background thread get raised in the main thread
+    def fail(data):
+        raise ValueError('prepare failed')
+
+    dl.prepare = fail
+    with pytest.raises(ValueError):
+        list(dl)
+
+    # Also errors that are not an Exception
+    def stop(data):
+        raise SystemExit(1)
+
+    dl.prepare = stop
+    with pytest.raises(SystemExit):
+        list(dl)
+
+
+def test_dataloader_copy():
+    dl = ln.data.DataLoader(DimSet(6), batch_size=2)
+    dl.change_input_dim(320, None)
+    for copied in (copy.deepcopy(dl), pickle.loads(pickle.dumps(dl))):
+        assert copied.batch_sampler.new_input_dim == (320, 320)
+        copied.change_input_dim(224, None)
+        dims, idx = next(iter(copied))
+        assert dims[0].tolist() == [224, 224]
+        assert idx.tolist() == [0, 1]
+
+
+def test_engine_prefetch():
+    class Engine(ln.engine.Engine):
+        def prepare_batch(self, data):
+            return data[1] + 100
+
+        def process_batch(self, data):
+            self.seen.extend(data.tolist())
+
+        def train_batch(self):
+            pass
+
+        def quit(self):
+            return self.epoch >= 2
+
+    params = ln.engine.HyperParameters(network=torch.nn.Module(), batch_size=2, mini_batch_size=2, epoch=0, batch=0)
+    for prefetch in (0, 3):
+        engine = Engine(params, ln.data.DataLoader(DimSet(6), batch_size=2), prefetch=prefetch, seen=[])
+        params.epoch = 0
+        engine()
+        assert engine.seen == list(range(100, 106)) * 2
+
+
+@pytest.mark.parametrize('num_workers', [0, 2])
+def test_dataloader_resume(tmp_path, num_workers):
+    dataset = DimSet(22)
+    dl = ln.data.DataLoader(dataset, batch_size=4, shuffle=True, num_workers=num_workers)
+    params = ln.engine.HyperParameters(dataloader=dl)
+
+    consumed = []
+    for i, (_, idx) in enumerate(dl):
+        consumed.extend(idx.tolist())
+        if i == 1:
+            dl.change_input_dim(320, None)
+        elif i == 2:
+            break
+    params.save(tmp_path / 'state.pt')
+    full_order = dl.state_dict()['order']
+    assert dl.state_dict()['position'] == 3
+    assert consumed == full_order[:12]
+
+    # Resume in a new dataloader
+    class CountSet(DimSet):
+        loaded = []
+
+        def __getitem__(self, index):
+            self.loaded.append(index[1])
+            return super().__getitem__(index)
+
+    dataset = CountSet(22)
+    dl = ln.data.DataLoader(dataset, batch_size=4, shuffle=True, num_workers=num_workers)
+    params = ln.engine.HyperParameters(dataloader=dl)
+    params.load(tmp_path / 'state.pt')
+    assert dl.batch_sampler.input_dim == (320, 320)
+
+    resumed = []
+    for dims, idx in dl:
+        resumed.extend(idx.tolist())
+        assert dims[0].tolist() == [320, 320]
+    assert resumed == full_order[12:]
+    if num_workers == 0:
+        assert sorted(dataset.loaded) == sorted(resumed)
+
+    # Next epoch starts fresh
+    assert dl.state_dict()['order'] is None
+    assert len([idx for _, idx in dl]) == 6
+
+
+def test_dataloader_torch_batch_sampler(tmp_path):
+    dataset = DimSet(10)
+    sampler = torch.utils.data.BatchSampler(torch.utils.data.SequentialSampler(dataset), 4, False)
+    dl = ln.data.DataLoader(dataset, batch_sampler=sampler)
+    assert [idx.tolist() for _, idx in dl] == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+
+    # Only the lightnet BatchSampler has a state
+    assert dl.state_dict() == {}
+    params = ln.engine.HyperParameters(dataloader=dl)
+    params.save(tmp_path / 'state.pt')
+    params.load(tmp_path / 'state.pt')
+    with pytest.raises(TypeError):
+        dl.load_state_dict({'order': None, 'position': 0})
+
+
+def test_distributed_batch_sampler():
+    dataset = DimSet(10)
+    seen = []
+    for rank in range(3):
+        sampler = ln.data.DistributedBatchSampler(dataset, 2, False, seed=1, num_replicas=3, rank=rank)
+        sampler.set_epoch(4)
+        batches = [idx.tolist() for _, idx in ln.data.DataLoader(dataset, batch_sampler=sampler)]
+        assert len(batches) == len(sampler) == 2
+        seen.extend(i for batch in batches for i in batch)
+    assert len(seen) == 12
+    assert set(seen) == set(range(10))
+
+
+def distributed_input_dim(rank, path, queue):
+    torch.distributed.init_process_group('gloo', init_method=f'file://{path}', rank=rank, world_size=2)
+    dataset = DimSet(8)
+    dl = ln.data.DataLoader(dataset, batch_sampler=ln.data.DistributedBatchSampler(dataset, 2, False))
+
+    dims = []
+    for i, (dim, _) in enumerate(dl):
+        dims.append(tuple(dim[0].tolist()))
+        if i == 0:
+            dl.change_input_dim(32, (rank * 10 + 1, rank * 10 + 9))
+    queue.put(dims)
+    torch.distributed.destroy_process_group()
+
+
+@pytest.mark.skipif(not torch.distributed.is_available(), reason='torch.distributed not available')
+def test_distributed_batch_sampler_input_dim(tmp_path):
+    ctx = torch.multiprocessing.get_context('spawn')
+    queue = ctx.SimpleQueue()
+    torch.multiprocessing.spawn(distributed_input_dim, args=(tmp_path / 'init', queue), nprocs=2)
+
+    dims = [queue.get(), queue.get()]
+    assert dims[0] == dims[1]
+    assert dims[0][0] == (416, 416)
+    assert dims[0][1][0] < 320
@@ -0,0 +1,320 @@
+#
+#   Test datasets and their data loading mechanisms
+#   Copyright EAVISE
+#
+
+import pytest
+import numpy as np
+import torch
+from PIL import Image
+import lightnet as ln
+
+pd = pytest.importorskip('pandas')
+bb = pytest.importorskip('brambox')
+
+
+@pytest.fixture(scope='module')
+def data(tmp_path_factory):
+    folder = tmp_path_factory.mktemp('images')
+    rng = np.random.RandomState(0)
+    keys = [f'img_{i}' for i in range(6)]
+    for i, key in enumerate(keys):
+        Image.fromarray(rng.randint(0, 255, (40 + 10*i, 60, 3), dtype=np.uint8)).save(folder / f'{key}.png')
+
+    rows = []
+    for i, key in enumerate(keys[:-1]):                 # Last image has no annotations
+        for j in range(i % 3 + 1):
+            rows.append((key, ['person', 'car'][(i+j) % 2], 5.0 + j, 6.0, 10.0 + i, 12.0, j == 1))
+    rows = rows[::-1]                                   # Annotations should not need to be sorted
+    anno = pd.DataFrame(rows, columns=['image', 'class_label', 'x_top_left', 'y_top_left', 'width', 'height', 'ignore'])
+    anno['image'] = pd.Categorical(anno.image, categories=keys)
+    anno['id'] = np.nan
+    anno['occluded'] = 0.0
+    anno['truncated'] = 0.0
+    anno['lost'] = False
+    anno['difficult'] = False
+
+    return folder, anno
+
+
+def identify(folder):
+    return lambda name: str(folder / f'{name}.png')
+
+
+def test_shard_dataset(data, tmp_path):
+    folder, anno = data
+    labels = ['car', 'person']
+    ref = ln.models.BramboxDataset(anno.copy(), (64, 64), labels, identify(folder))
+
+    for encoded in (True, False):
+        path = tmp_path / f'shards_{encoded}'
+        ln.models.ShardWriter.from_brambox(path, anno, labels, identify(folder), encoded, shard_size=10000)
+        uut = ln.models.ShardDataset(path, (64, 64))
+        assert len(uut) == len(ref)
+        assert len(uut.shard_files) > 1
+
+        for i in range(len(ref)):
+            ref_img, ref_anno = ref[i]
+            img, anno_i = uut[i]
+            assert np.array_equal(np.asarray(img), np.asarray(ref_img))
+            assert list(anno_i.image.cat.categories) == list(ref_anno.image.cat.categories)
+
+            cols = ['image', 'class_label', 'x_top_left', 'y_top_left', 'width', 'height', 'ignore', 'class_id']
+            ref_anno = ref_anno[cols].sort_values(['x_top_left', 'class_label']).reset_index(drop=True)
+            anno_i = anno_i[cols].sort_values(['x_top_left', 'class_label']).reset_index(drop=True)
+            pd.testing.assert_frame_equal(anno_i, ref_anno, check_dtype=False, check_categorical=False)
+
+
+def test_shard_dataset_transforms(data, tmp_path):
+    folder, anno = data
+    ln.models.ShardWriter.from_brambox(tmp_path, anno, ['car', 'person'], identify(folder), False)
+    uut = ln.models.ShardDataset(tmp_path, (64, 64), pil=False)
+
+    lb = ln.data.transform.Letterbox(dataset=uut)
+    uut.img_tf = ln.data.transform.Compose([lb, lambda img: torch.from_numpy(img)])
+    uut.anno_tf = ln.data.transform.Compose([lb])
+
+    img, _ = uut[(96, 32), 0]
+    assert img.shape == (32, 96, 3)
+
+    loader = ln.data.DataLoader(uut, batch_size=2, collate_fn=ln.data.brambox_collate, num_workers=2)
+    loader.change_input_dim((32, 64), None)
+    for img, target in loader:
+        assert img.shape[1:] == (64, 32, 3)
+        assert target.batch_number.max() <= 1
+
+
+def test_brambox_dataset_anno_index(data):
+    folder, anno = data
+    uut = ln.models.BramboxDataset(anno.copy(), (64, 64), ['car', 'person'], identify(folder))
+
+    for i, key in enumerate(uut.keys):
+        ref = bb.util.select_images(uut.annos, [key])
+        pd.testing.assert_frame_equal(uut[i][1], ref)
+
+    # Sorted annotations are not copied
+    sorted_anno = uut.annos.copy()
+    assert ln.models.BramboxDataset(sorted_anno, (64, 64), ['car', 'person'], identify(folder)).annos is sorted_anno
+
+
+def test_shared_image_cache(data):
+    folder, anno = data
+    img_size = 60 * 90 * 3
+    cache = ln.data.SharedImageCache(3 * img_size, len(anno.image.cat.categories), block_size=1024)
+    uut = ln.models.BramboxDataset(anno.copy(), (64, 64), ['car', 'person'], identify(folder), cache=cache)
+    ref = ln.models.BramboxDataset(anno.copy(), (64, 64), ['car', 'person'], identify(folder))
+
+    for _ in range(2):
+        for i in range(len(uut)):
+            assert np.array_equal(np.asarray(uut[i][0]), np.asarray(ref[i][0]))
+            assert uut.cache.get(i) is not None
+            assert uut.cache.nbytes <= 3 * img_size
+
+    # Least recently used images get evicted first
+    assert uut.cache.get(0) is None
+    assert uut.cache.get(len(uut) - 1) is not None
+    uut.cache.clear()
+    assert len(uut.cache) == 0
+
+
+def test_shared_image_cache_workers(data):
+    folder, anno = data
+    uut = ln.models.BramboxDataset(anno.copy(), (64, 64), ['car', 'person'], identify(folder), cache=2**20)
+    uut.img_tf = lambda img: torch.from_numpy(np.array(img))[:40]
+
+    loader = ln.data.DataLoader(uut, batch_size=2, collate_fn=ln.data.brambox_collate, num_workers=2)
+    list(loader)
+    assert len(uut.cache) == len(uut)
+
+
+def test_rgbd_dataset(data):
+    folder, anno = data
+    rng = np.random.RandomState(1)
+    for key in anno.image.cat.categories:
+        w, h = Image.open(folder / f'{key}.png').size
+        Image.fromarray(rng.randint(0, 2**16, (h, w), dtype=np.uint16)).save(folder / f'{key}_depth.png')
+
+    uut = ln.models.RGBDDataset(anno.copy(), (64, 64), ['car', 'person'], identify(folder), lambda name: str(folder / f'{name}_depth.png'))
+    img, _ = uut[1]
+    color = np.asarray(Image.open(folder / 'img_1.png'))
+    depth = np.asarray(Image.open(folder / 'img_1_depth.png'))
+    assert img.shape == (4, 50, 60)
+    assert img.is_contiguous() and img.dtype == torch.float32
+    assert torch.allclose(img[:3], torch.from_numpy(color.transpose(2, 0, 1) / 255).float())
+    assert torch.allclose(img[3], torch.from_numpy(depth / 65535).float())
+
+    # Transforms are performed jointly on color and depth
+    rf = ln.data.transform.RandomFlip(1)
+    lb = ln.data.transform.Letterbox(dataset=uut)
+    uut.img_tf = ln.data.transform.Compose([ln.data.transform.RandomJitter(0.2), rf, lb])
+    uut.anno_tf = ln.data.transform.Compose([rf, lb])
+    img, anno_i = uut[1]
+    assert img.shape == (4, 64, 64)
+    assert anno_i.x_top_left.max() < 64
+
+    uut.img_tf = rf
+    img, _ = uut[1]
+    assert torch.allclose(img[3], torch.from_numpy(depth[:, ::-1] / 65535).float())
+
+    net = ln.models.YoloFusion(2)
+    net.eval()
+    with torch.no_grad():
+        assert net(img[None, :, :32, :32]).shape == (1, 5 * 7, 1, 1)
+
+
+def test_annotation_store(data, tmp_path):
+    folder, anno = data
+    labels = ['car', 'person']
+    store = ln.data.AnnotationStore.from_brambox(tmp_path, anno, labels)
+    assert len(store) == len(anno.image.cat.categories)
+    assert isinstance(store.columns['x_top_left'], np.memmap)
+
+    ref = ln.models.BramboxDataset(anno.copy(), (64, 64), labels, identify(folder))
+    uut = ln.models.BramboxDataset(ln.data.AnnotationStore(tmp_path), (64, 64), labels, identify(folder))
+    assert len(uut) == len(ref)
+    for i in range(len(ref)):
+        ref_img, ref_anno = ref[i]
+        img, anno_i = uut[i]
+        assert np.array_equal(np.asarray(img), np.asarray(ref_img))
+        pd.testing.assert_frame_equal(anno_i, ref_anno, check_like=True, check_dtype=False)
+
+    # Works in dataloader workers
+    uut.img_tf = lambda img: torch.from_numpy(np.array(img))[:40]
+    loader = ln.data.DataLoader(uut, batch_size=2, collate_fn=ln.data.brambox_collate, num_workers=2)
+    assert sum(len(target.index) for _, target in loader) == len(anno.index)
+
+    with pytest.raises(ValueError):
+        ln.models.BramboxDataset(store, (64, 64), labels[::-1], identify(folder))
+
+    # Annotations without an image are ignored everywhere
+    missing = anno.copy()
+    missing.loc[missing.index[:2], 'image'] = np.nan
+    num_anno = len(missing.index) - 2
+    store = ln.data.AnnotationStore.from_brambox(tmp_path / 'missing', missing, labels)
+    assert store.offsets[-1] == num_anno
+    dataset = ln.models.BramboxDataset(missing.copy(), (64, 64), labels, identify(folder))
+    assert sum(len(dataset[i][1].index) for i in range(len(dataset))) == num_anno
+    ln.models.ShardWriter.from_brambox(tmp_path / 'shards', missing, labels, identify(folder))
+    shards = ln.models.ShardDataset(tmp_path / 'shards', (64, 64))
+    assert sum(len(shards[i][1].index) for i in range(len(shards))) == num_anno
+
+
+def test_box_array_dataset(data, tmp_path):
+    folder, anno = data
+    labels = ['car', 'person']
+    ref = ln.models.BramboxDataset(anno.copy(), (64, 64), labels, identify(folder))
+    store = ln.data.AnnotationStore.from_brambox(tmp_path, anno, labels)
+
+    for annos in (anno.copy(), store):
+        uut = ln.models.BramboxDataset(annos, (64, 64), labels, identify(folder), box_array=True)
+        for i in range(len(ref)):
+            _, ref_anno = ref[i]
+            _, boxes = uut[i]
+            assert isinstance(boxes, ln.data.BoxArray)
+            assert boxes.image == str(ref.keys[i])
+            assert len(boxes) == len(ref_anno.index)
+
+            out = boxes.to_brambox()
+            pd.testing.assert_frame_equal(out[ref_anno.columns], ref_anno, check_dtype=False, check_categorical=False)
+
+
+def test_reduced_decode(data, tmp_path):
+    _, anno = data
+    keys = list(anno.image.cat.categories)
+    rng = np.random.RandomState(2)
+    for key in keys:
+        x = np.linspace(0, 255, 640)[None, :, None]
+        y = np.linspace(0, 255, 400)[:, None, None]
+        img = np.concatenate([x + 0 * y, y + 0 * x, (x + y) / 2], axis=2) + rng.uniform(-5, 5, (400, 640, 3))
+        Image.fromarray(img.clip(0, 255).astype(np.uint8)).save(tmp_path / f'{key}.jpg', quality=95)
+    anno = anno.copy()
+    anno[['x_top_left', 'y_top_left', 'width', 'height']] *= 10
+
+    sizes = []
+
+    def record(img):
+        sizes.append(img.size)
+        return img
+    record.scale_hint = lambda size: (1, size)
+
+    lb = ln.data.transform.Letterbox((96, 96))
+    img_tf = ln.data.transform.Compose([ln.data.transform.RandomHSV(0, 1, 1), record, lb])
+    anno_tf = ln.data.transform.Compose([lb])
+
+    def identify(name):
+        return str(tmp_path / f'{name}.jpg')
+
+    ref = ln.models.BramboxDataset(anno.copy(), (96, 96), ['car', 'person'], identify, img_tf, anno_tf)
+    uut = ln.models.BramboxDataset(anno.copy(), (96, 96), ['car', 'person'], identify, img_tf, anno_tf, reduced_decode=True)
+    uut_box = ln.models.BramboxDataset(anno.copy(), (96, 96), ['car', 'person'], identify, img_tf, anno_tf, box_array=True, reduced_decode=True)
+
+    for i in range(len(ref)):
+        ref_img, ref_anno = ref[i]
+        img, anno_i = uut[i]
+        _, boxes = uut_box[i]
+        assert img.size == ref_img.size == (96, 96)
+        assert np.abs(np.asarray(img, dtype=float) - np.asarray(ref_img)).mean() < 3
+
+        cols = ['x_top_left', 'y_top_left', 'width', 'height']
+        np.testing.assert_allclose(anno_i[cols].values, ref_anno[cols].values, atol=0.1)
+        np.testing.assert_allclose(boxes.coords, ref_anno[cols].values, atol=0.1)
+
+    # Letterbox scales by 0.15, so libjpeg decodes at 1/4 of the size, which is never smaller than needed
+    assert sizes[0] == (640, 400)
+    assert sizes[1] == (160, 100)
+    assert sizes[2] == (160, 100)
+
+    # Larger network dimensions need more pixels
+    lb.dimension = (400, 400)
+    uut[0]
+    assert sizes[-1] == (640, 400)
+
+    # Unknown transforms before the Letterbox disable it
+    img_tf.insert(0, lambda img: img)
+    assert img_tf.scale_hint((640, 400)) is None
+    uut[0]
+    assert sizes[-1] == (640, 400)
+
+
+@pytest.mark.parametrize('decoder', ['opencv', 'torchvision'])
+def test_decoders(data, tmp_path, decoder):
+    folder, anno = data
+    try:
+        uut = ln.data.get_decoder(decoder)
+    except ImportError:
+        pytest.skip(f'{decoder} is not installed')
+
+    # Lossless images are identical to Pillow
+    ref = ln.models.BramboxDataset(anno.copy(), (64, 64), ['car', 'person'], identify(folder))
+    dataset = ln.models.BramboxDataset(anno.copy(), (64, 64), ['car', 'person'], identify(folder), decoder=decoder)
+    for i in range(len(ref)):
+        img, _ = dataset[i]
+        assert isinstance(img, np.ndarray) and img.dtype == np.uint8
+        assert np.array_equal(img, np.asarray(ref[i][0]))
+
+    # JPEG decoders can round slightly differently
+    jpeg = tmp_path / 'img.jpg'
+    Image.open(identify(folder)('img_0')).save(jpeg, quality=90)
+    img = uut(str(jpeg))
+    with open(jpeg, 'rb') as f:
+        assert np.array_equal(img, uut.decode(f.read()))
+    assert np.abs(img.astype(float) - np.asarray(Image.open(jpeg))).mean() < 1
+
+    timings = ln.data.benchmark_decoders([str(jpeg), identify(folder)('img_1')], ['pillow', uut])
+    assert len(timings) == 2
+    assert timings[0][1] <= timings[1][1]
+
+
+def test_decoders_exif_orientation(tmp_path):
+    jpeg = tmp_path / 'rotated.jpg'
+    exif = Image.Exif()
+    exif[0x0112] = 6                                    # Orientation: rotate 90 degrees
+    Image.fromarray(np.zeros((40, 60, 3), dtype=np.uint8)).save(jpeg, exif=exif)
+
+    decoders = [('pillow', {}), ('opencv', {}), ('opencv', {'unchanged': True}), ('torchvision', {})]
+    for name, kwargs in decoders:
+        try:
+            uut = ln.data.get_decoder(name) if not kwargs else ln.data.OpenCVDecoder(**kwargs)
+        except ImportError:
+            continue
+        assert np.asarray(uut(str(jpeg))).shape[:2] == (40, 60), f'{uut}'
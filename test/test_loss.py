@@ -0,0 +1,51 @@
+#
+#   Test loss functions
+#   Copyright EAVISE
+#
+
+import pytest
+import numpy as np
+import torch
+import lightnet as ln
+
+pd = pytest.importorskip('pandas')
+bb = pytest.importorskip('brambox')
+
+
+@pytest.fixture(scope='module')
+def annos():
+    rng = np.random.RandomState(0)
+    annos = []
+    for i, num in enumerate([3, 0, 5, 1]):
+        anno = pd.DataFrame({
+            'class_label': rng.choice(['car', 'person'], num),
+            'x_top_left': rng.uniform(0, 250, num),
+            'y_top_left': rng.uniform(0, 150, num),
+            'width': rng.uniform(10, 60, num),
+            'height': rng.uniform(10, 60, num),
+            'ignore': rng.rand(num) < 0.3,
+        })
+        anno['image'] = pd.Categorical([f'img_{i}'] * num, categories=[f'img_{i}'])
+        anno['class_id'] = (anno.class_label == 'person').astype(int)
+        annos.append(anno)
+    return annos
+
+
+def test_regionloss_compact_target(annos):
+    anchors = [(1.3221, 1.73145), (3.19275, 4.00944), (5.05587, 8.09892)]
+    output = torch.randn(4, 3 * 7, 6, 10)
+
+    brambox_target = ln.data.brambox_collate([df.copy() for df in annos])
+    boxes, offsets = ln.data.tensor_collate([df.copy() for df in annos])
+    assert boxes.shape == (9, 6)
+    assert offsets.tolist() == [0, 3, 3, 8, 9]
+    assert (boxes[:, 1] == -1).sum() == brambox_target.ignore.sum()
+
+    ref = ln.network.loss.RegionLoss(2, anchors, seen=0)
+    ref(output, brambox_target)
+    for target in ((boxes, offsets), boxes[torch.randperm(len(boxes))]):
+        uut = ln.network.loss.RegionLoss(2, anchors, seen=0)
+        uut(output, target)
+        assert torch.allclose(uut.loss_coord, ref.loss_coord)
+        assert torch.allclose(uut.loss_conf, ref.loss_conf)
+        assert torch.allclose(uut.loss_cls, ref.loss_cls)
@@ -0,0 +1,732 @@
+#
+#   Test data transforms
+#   Copyright EAVISE
+#
+
+import gc
+import copy
+import pickle
+import random
+import tracemalloc
+import pytest
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+import lightnet as ln
+from lightnet.data.transform import _batch
+
+pd = pytest.importorskip('pandas')
+cv2 = pytest.importorskip('cv2')
+tf = ln.data.transform
+
+
+@pytest.fixture(scope='module')
+def image():
+    x = np.linspace(0, 1, 120)[None, :, None]
+    y = np.linspace(0, 1, 80)[:, None, None]
+    img = np.concatenate([x * 255 + 0 * y, y * 255 + 0 * x, (x + y) * 127], axis=2)
+    return img.astype(np.uint8)
+
+
+@pytest.fixture(scope='module')
+def anno():
+    return pd.DataFrame({
+        'class_label': ['a', 'b', 'a'],
+        'x_top_left': [10.0, 50.0, 2.0],
+        'y_top_left': [5.0, 30.0, 60.0],
+        'width': [30.0, 40.0, 10.0],
+        'height': [20.0, 40.0, 18.0],
+        'truncated': [0.0, 0.0, 0.0],
+    })
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_random_warp(image, anno, seed):
+    rj = tf.RandomJitter(0.2, True, 0.1)
+    rf = tf.RandomFlip(0.5)
+    lb = tf.Letterbox((96, 64))
+    rw = tf.RandomWarp((96, 64), jitter=0.2, flip=0.5, crop_anno=True, intersection_threshold=0.1)
+
+    for img in (image, Image.fromarray(image)):
+        random.seed(seed)
+        ref_img = np.asarray(tf.Compose([rj, rf, lb])(img), dtype=float)
+        ref_anno = tf.Compose([rj, rf, lb])(anno)
+
+        random.seed(seed)
+        warp_img = np.asarray(rw(img), dtype=float)
+        warp_anno = rw(anno)
+
+        assert warp_img.shape == ref_img.shape
+        diff = np.abs(warp_img - ref_img)
+        assert np.median(diff) <= 1 and diff.mean() < 4       # Different interpolation and rounding at the borders
+        pd.testing.assert_frame_equal(warp_anno, ref_anno, atol=0.5)
+
+
+def test_random_warp_channels():
+    img = np.random.randint(0, 2**16, (40, 30, 6), dtype=np.uint16)
+    rw = tf.RandomWarp((32, 32), rotate=10, fill_color=(1, 2, 3, 4, 5, 6))
+    out = rw(img)
+    assert out.shape == (32, 32, 6)
+    assert out.dtype == np.uint16
+    assert out[0, 0].tolist() == [1, 2, 3, 4, 5, 6]
+
+
+def test_random_hsv(image):
+    hsv = tf.RandomHSV(0.2, 1.5, 1.5)
+    for seed in range(5):
+        random.seed(seed)
+        out_pil = hsv(Image.fromarray(image))
+        random.seed(seed)
+        out_cv = hsv(image)
+
+        assert out_cv.dtype == np.uint8 and out_cv.shape == image.shape
+        assert np.array_equal(np.asarray(out_pil), out_cv)
+
+    # No shift
+    random.seed(0)
+    out = tf.RandomHSV(0, 1, 1)(image)
+    assert np.abs(out.astype(int) - image).mean() < 1     # 8-bit HSV quantization
+
+
+def test_batch_random_flip(image, anno):
+    anno = anno.assign(class_id=[0, 1, 0])
+    images = torch.from_numpy(np.stack([image, image])).permute(0, 3, 1, 2).float()
+    boxes, offsets = ln.data.tensor_collate([anno, anno])
+
+    torch.manual_seed(0)
+    uut = tf.BatchRandomFlip(0.5)
+    out, (out_boxes, out_offsets) = uut((images, (boxes, offsets)))
+    assert torch.equal(out_offsets, offsets)
+
+    flipped_x = image.shape[1] - anno.x_top_left.values - anno.width.values
+    for b in range(2):
+        flipped = not torch.equal(out[b], images[b])
+        assert not flipped or torch.equal(out[b], images[b].flip(-1))
+        ref_x = flipped_x if flipped else anno.x_top_left.values
+        assert np.allclose(out_boxes[offsets[b]:offsets[b+1], 2].numpy(), ref_x)
+
+
+def test_batch_random_hsv(image):
+    images = torch.from_numpy(image).permute(2, 0, 1)[None].float() / 255
+    images = torch.cat([images, torch.rand(1, 1, *images.shape[2:])], 1)
+
+    # No shift
+    out = tf.BatchRandomHSV(0, 1, 1)(images)
+    assert torch.allclose(out, images, atol=1e-5)
+
+    # Compare with RandomHSV
+    torch.manual_seed(0)
+    out = tf.BatchRandomHSV(0.2, 1.5, 1.5)(images)
+    torch.manual_seed(0)
+    rand = torch.rand(5).tolist()
+    dh = (rand[0] * 2 - 1) * 0.2
+    ds = 1 + rand[1] * 0.5
+    dv = 1 + rand[3] * 0.5
+    ds = 1 / ds if rand[2] < 0.5 else ds
+    dv = 1 / dv if rand[4] < 0.5 else dv
+    ref = tf.RandomHSV._tf_cv(image, dh, ds, dv)
+    out_rgb = (out[0, :3].permute(1, 2, 0) * 255).numpy()
+    assert np.abs(out_rgb - ref).mean() < 2
+    assert torch.equal(out[:, 3], images[:, 3])
+
+
+def test_batch_random_affine(monkeypatch):
+    images = torch.zeros(4, 3, 60, 80)
+    images[:, :, 20:40, 30:50] = 1
+    boxes = torch.tensor([[b, 0, 30, 20, 20, 20] for b in range(4)] + [[3, 1, 0, 0, 2, 2]], dtype=torch.float)
+    offsets = torch.tensor([0, 1, 2, 3, 5])
+
+    torch.manual_seed(0)
+    uut = tf.BatchRandomAffine(0.2, 0.2, 30, fill_color=0, intersection_threshold=0.5)
+    out, (out_boxes, out_offsets) = uut((images, (boxes, offsets)))
+    assert out.shape == images.shape
+    assert out_offsets[-1] == out_boxes.shape[0]
+    assert (out_boxes[1:, 0] >= out_boxes[:-1, 0]).all()
+
+    for box in out_boxes:
+        if box[1] == 1:
+            continue
+        b = int(box[0])
+        ys, xs = torch.nonzero(out[b, 0] > 0.5).unbind(1)
+        assert abs(xs.min() - box[2]) <= 1.5 and abs(ys.min() - box[3]) <= 1.5
+        assert abs(xs.max() + 1 - box[2] - box[4]) <= 1.5 and abs(ys.max() + 1 - box[3] - box[5]) <= 1.5
+
+    # PyTorch < 1.3 always aligns the corners, which we compensate for in the sampling matrix
+    if _batch._has_align_corners:
+        monkeypatch.setattr(_batch, '_has_align_corners', False)
+        affine_grid, grid_sample = F.affine_grid, F.grid_sample
+        monkeypatch.setattr(F, 'affine_grid', lambda *args: affine_grid(*args, align_corners=True))
+        monkeypatch.setattr(F, 'grid_sample', lambda *args, **kwargs: grid_sample(*args, **kwargs, align_corners=True))
+        torch.manual_seed(0)
+        out_aligned, (out_boxes_aligned, _) = uut((images, (boxes, offsets)))
+        assert torch.allclose(out_aligned, out, atol=1e-4)
+        assert torch.equal(out_boxes_aligned, out_boxes)
+
+
+def test_fill_color(image):
+    lb = tf.Letterbox((120, 120))
+    out_cv = lb(image)
+    out_pil = np.asarray(lb(Image.fromarray(image)))
+    assert out_cv[0, 0].tolist() == [127, 127, 127]
+    assert np.array_equal(out_cv[:lb.pad[1]], out_pil[:lb.pad[1]])
+
+    rgbd = np.random.randint(0, 2**16, (80, 120, 6), dtype=np.uint16)
+    fill = (127, 127, 127, 0, 1, 2)
+    for uut in (tf.Letterbox((120, 120), fill_color=fill), tf.RandomJitter(0.5, fill_color=fill), tf.RandomRotate(45, fill_color=fill)):
+        random.seed(1)
+        out = uut(rgbd)
+        assert out[0, 0].tolist() == list(fill)
+
+    with pytest.raises(ValueError):
+        tf.Letterbox((120, 120), fill_color=(127, 0))(image)
+
+
+def test_rgbd_augmentation(image):
+    depth = np.random.RandomState(0).randint(1, 2**15, image.shape[:2], dtype=np.uint16)
+    depth[:10] = 0
+    rgbd = np.concatenate([image, depth[..., None]], axis=2).astype(np.uint16)
+
+    random.seed(0)
+    out = tf.RandomHSV(0.2, 1.5, 1.5)(rgbd)
+    random.seed(0)
+    ref = tf.RandomHSV(0.2, 1.5, 1.5)(image)
+    assert out.dtype == np.uint16
+    assert np.array_equal(out[..., :3], ref)
+    assert np.array_equal(out[..., 3], depth)
+
+    random.seed(0)
+    out = tf.RandomDepth(scale=0.2)(rgbd)
+    factor = out[10:, :, 3].sum() / depth[10:].sum()
+    assert np.array_equal(out[..., :3], rgbd[..., :3])
+    assert 0.8 <= factor <= 1.2
+    assert np.abs(out[..., 3] - depth * factor).max() <= 0.51
+
+    out = tf.RandomDepth(noise=0.05, holes=0.2)(rgbd)
+    assert (out[:10, :, 3] == 0).all()
+    assert 0.15 < (out[10:, :, 3] == 0).mean() < 0.25
+    valid = out[..., 3] > 0
+    assert 0.03 < np.std(out[..., 3][valid] / depth[valid]) < 0.07
+
+    # Pillow images only get their depth bands modified, the same way as OpenCV images
+    rgbd = np.concatenate([image, (depth[..., None] >> 8)], axis=2).astype(np.uint8)
+    random.seed(0)
+    ref = tf.RandomDepth(scale=0.2, noise=0.05, holes=0.2)(rgbd)
+    random.seed(0)
+    out = tf.RandomDepth(scale=0.2, noise=0.05, holes=0.2)(Image.fromarray(rgbd, 'RGBA'))
+    assert out.mode == 'RGBA'
+    assert np.array_equal(np.asarray(out), ref)
+    assert np.array_equal(np.asarray(out)[..., :3], image)
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16])
+def test_multiband_resize(image, monkeypatch, dtype):
+    img = np.concatenate([image] * 2, axis=2).astype(dtype)
+    lb = tf.Letterbox((96, 96))
+    crop = tf.Crop((96, 96))
+    ref_lb = lb(img)
+    ref_crop = crop(img)
+
+    # PyTorch planar resize, which gets used without OpenCV or with too many channels
+    monkeypatch.setattr(ln.data.transform._preprocess, 'cv2', None)
+    out_lb = lb(img)
+    out_crop = crop(img)
+    assert out_lb.shape == ref_lb.shape == (96, 96, 6) and out_lb.dtype == dtype
+    assert out_crop.shape == ref_crop.shape == (96, 96, 6) and out_crop.dtype == dtype
+    assert np.abs(out_lb.astype(float) - ref_lb).mean() < 1
+    assert np.abs(out_crop.astype(float) - ref_crop).mean() < 1
+    monkeypatch.undo()
+
+    img = np.zeros((40, 60, 600), dtype=dtype)
+    img[..., 300] = 100
+    out = tf.Letterbox((30, 30), fill_color=0)(img)
+    assert out.shape == (30, 30, 600)
+    assert (out[8:22, :, 300] == 100).all() and (out[..., :300] == 0).all()
+
+    # Pillow resizes all bands at once
+    pil_img = Image.fromarray(image)
+    ref = Image.merge('RGB', [b.resize((60, 40)) for b in pil_img.split()])
+    assert np.array_equal(np.asarray(tf.Crop((60, 40))(pil_img)), np.asarray(ref))
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_box_array(image, anno, seed):
+    anno = anno.assign(class_id=[0, 1, 0], ignore=[False, True, False], truncated=[0.0, 0.5, 0.0])
+    boxes = ln.data.BoxArray.from_brambox(anno)
+    transforms = [
+        tf.Crop((64, 64), center=False, intersection_threshold=0.3, crop_anno=True),
+        tf.Letterbox((64, 64)),
+        tf.RandomFlip(0.5, 0.5),
+        tf.RandomJitter(0.3, True, 0.1),
+        tf.RandomRotate(30),
+        tf.RandomWarp((64, 64), jitter=0.3, flip=0.5, rotate=30, crop_anno=True, intersection_threshold=0.1),
+    ]
+
+    for uut in transforms:
+        random.seed(seed)
+        uut(image)
+        ref = uut(anno)
+        out = uut(boxes)
+
+        assert isinstance(out, ln.data.BoxArray)
+        assert out.coords.dtype == np.float32
+        assert np.allclose(out.coords, ref[['x_top_left', 'y_top_left', 'width', 'height']].values, atol=1e-3)
+        assert np.allclose(out.truncated, ref.truncated.values, atol=1e-5)
+        assert np.array_equal(out.class_id, ref.class_id.values)
+        assert np.array_equal(out.ignore, ref.ignore.values)
+
+    # Transforms without a box array implementation convert to brambox
+    class Shift(tf.util.BaseMultiTransform):
+        def _tf_pil(self, img):
+            return img
+
+        def _tf_cv(self, img):
+            return img
+
+        def _tf_anno(self, anno):
+            anno = anno.copy()
+            anno.x_top_left += 1
+            return anno
+
+    out = Shift()(boxes)
+    assert np.array_equal(out.x_top_left, boxes.x_top_left + 1)
+    assert np.array_equal(out.class_id, boxes.class_id)
+
+    target, offsets = ln.data.tensor_collate([boxes, boxes[:1]])
+    ref_target, ref_offsets = ln.data.tensor_collate([anno, anno[:1]])
+    assert torch.equal(target, ref_target)
+    assert torch.equal(offsets, ref_offsets)
+
+
+class ProfileSet(torch.utils.data.Dataset):
+    def __init__(self, tf):
+        self.tf = tf
+
+    def __len__(self):
+        return 8
+
+    def __getitem__(self, index):
+        return self.tf(index)
+
+
+def test_compose_profile(monkeypatch):
+    uut = tf.Compose([lambda n: n + 1, lambda n: np.zeros(2**18) + n], profile=True)
+    loader = torch.utils.data.DataLoader(ProfileSet(uut), batch_size=2, num_workers=2)
+    assert sum(len(batch) for batch in loader) == 8
+
+    stats = uut._stats.numpy()
+    assert (stats[:, 0] == 8).all()
+    assert (stats[:, 1] > 0).all()
+    report = uut.report()
+    assert report.count('<lambda>') == 2
+    assert '[8 calls' in report
+
+    uut.profile = 'memory'
+    for i in range(4):
+        uut(i)
+    stats = uut._stats.numpy()
+    assert (stats[:, 0] == 4).all()
+    assert stats[1, 2] / 4 >= 2**18 * 8
+    assert stats[0, 2] / 4 < 2**10
+
+    # Python < 3.9 has no tracemalloc.reset_peak
+    monkeypatch.delattr(tracemalloc, 'reset_peak', raising=False)
+    uut.reset_profile()
+    for i in range(4):
+        uut(i)
+    stats = uut._stats.numpy()
+    assert stats[1, 2] / 4 >= 2**18 * 8
+    assert stats[0, 2] / 4 < 2**10
+
+    # Profiled pipelines can be copied
+    copied = copy.deepcopy(uut)
+    copied(1)
+    assert copied._stats[0, 0] == 5 and uut._stats[0, 0] == 4
+    copied = pickle.loads(pickle.dumps(tf.Compose([abs], profile=True)))
+    assert copied(-1) == 1
+    assert copied._stats[0, 0] == 1
+
+    uut.profile = False
+    assert uut(1).shape == (2**18,)
+    assert uut.report().endswith('[disabled]')
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_compose_plan(image, anno, seed):
+    rj = tf.RandomJitter(0.2, True, 0.1)
+    rf = tf.RandomFlip(0.5)
+    lb = tf.Letterbox((96, 64))
+    hsv = tf.RandomHSV(0.1, 1.5, 1.5)
+    img_tf = tf.Compose([hsv, rj, rf, lb])
+    anno_tf = tf.Compose([rj, rf, lb])
+
+    uut_img_tf, uut_anno_tf = img_tf.plan(anno_tf)
+    assert [type(t) for t in uut_img_tf] == [tf.RandomHSV, tf.RandomWarp]
+    assert len(uut_anno_tf) == 1 and uut_anno_tf[0] is uut_img_tf[1]
+    assert len(img_tf) == 4 and len(anno_tf) == 3
+
+    random.seed(seed)
+    ref_img = img_tf(image).astype(float)
+    ref_anno = anno_tf(anno)
+    random.seed(seed)
+    out_img = uut_img_tf(image).astype(float)
+    out_anno = uut_anno_tf(anno)
+    assert out_img.shape == ref_img.shape
+    assert np.median(np.abs(out_img - ref_img)) <= 1
+    pd.testing.assert_frame_equal(out_anno, ref_anno, atol=0.5)
+
+    # Transforms that are not shared consistently do not get fused
+    uut_img_tf, uut_anno_tf = img_tf.plan(tf.Compose([rj, lb]))
+    assert uut_img_tf == img_tf
+    assert [type(t) for t in uut_anno_tf] == [tf.RandomJitter, tf.Letterbox]
+
+    # Multi-transforms are not fused without the other pipelines, unless explicitly marked standalone
+    assert img_tf.plan() == img_tf
+    assert [type(t) for t in img_tf.plan(standalone=True)] == [tf.RandomHSV, tf.RandomWarp]
+
+    # Different fill colors cannot be fused
+    assert len(tf.Compose([tf.RandomRotate(5), lb]).plan(standalone=True)) == 2
+    assert len(tf.Compose([tf.RandomRotate(5, fill_color=127), lb]).plan(standalone=True)) == 1
+
+
+def test_compose_plan_to_tensor(image):
+    tvtf = pytest.importorskip('torchvision.transforms')
+    pipeline = tf.Compose([tvtf.ToTensor(), tvtf.Normalize((0.5, 0.4, 0.3), (0.2, 0.3, 0.4))])
+    uut = pipeline.plan()
+    assert len(uut) == 1
+
+    for img in (image, Image.fromarray(image)):
+        out = uut(img)
+        assert out.dtype == torch.float32 and out.shape == (3, 80, 120)
+        assert torch.allclose(out, pipeline(img), atol=1e-5)
+
+    img = image.astype(np.float32) / 255
+    assert torch.allclose(uut(img), pipeline(img))
+
+
+@pytest.mark.parametrize('name, transform, cv_allocs, pil_allocs', [
+    ('crop', tf.Crop((160, 160)), 1, 2),                    # Pillow: resize + crop
+    ('letterbox', tf.Letterbox((160, 160)), 1, 2),          # Pillow: resize + canvas
+    ('flip', tf.RandomFlip(1), 1, 1),
+    ('hsv', tf.RandomHSV(0.1, 1.5, 1.5), 1, 5),             # Pillow: exported data, numpy array, output image
+    ('jitter_inside', tf.RandomJitter(0), 0, 1),
+    ('jitter_outside', tf.RandomJitter(0.1), 1, 1),
+    ('rotate', tf.RandomRotate(10), 1, 1),
+    ('warp', tf.RandomWarp((160, 160), jitter=0.1, flip=1, rotate=10), 1, 1),
+])
+def test_allocations(monkeypatch, name, transform, cv_allocs, pil_allocs):
+    """ Maximal number of image allocations, which are allocations of at least half the input or output image size. """
+    img = np.random.RandomState(0).randint(0, 255, (240, 320, 3), dtype=np.uint8)
+    monkeypatch.setattr(random, 'randint', lambda a, b: a)
+
+    def nbytes(img):
+        if isinstance(img, Image.Image):
+            return img.size[0] * img.size[1] * len(img.getbands())
+        return img.nbytes
+
+    # Count images created by Pillow (only the outer call, as eg. rotate calls transform)
+    pil_images = []
+    depth = [0]
+
+    def count_images(fn):
+        def wrapper(*args, **kwargs):
+            depth[0] += 1
+            try:
+                out = fn(*args, **kwargs)
+            finally:
+                depth[0] -= 1
+            if depth[0] == 0:
+                pil_images.extend(o for o in (out if isinstance(out, tuple) else (out,)) if nbytes(o) >= threshold)
+            return out
+        return wrapper
+
+    for fn in ('new', 'fromarray', 'merge'):
+        monkeypatch.setattr(Image, fn, count_images(getattr(Image, fn)))
+    for fn in ('crop', 'resize', 'rotate', 'transform', 'transpose', 'convert', 'copy', 'point', 'split'):
+        monkeypatch.setattr(Image.Image, fn, count_images(getattr(Image.Image, fn)))
+
+    threshold = 0
+    for data, allocs in ((img, cv_allocs), (Image.fromarray(img), pil_allocs)):
+        threshold = min(nbytes(data), nbytes(transform(data))) // 2
+        pil_images.clear()
+
+        # Count numpy arrays that are returned (snapshot diff) or freed again (peak above the current memory)
+        tracemalloc.stop()      # Restart tracing to reset the peak
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        out = transform(data)
+        current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        kept = sum(t.size >= threshold for t in after.traces) - sum(t.size >= threshold for t in before.traces)
+        freed = (peak - current) // threshold
+
+        uut = kept + freed + len(pil_images)
+        assert uut <= allocs, f'{type(data).__name__}: {uut} image allocations ({kept} kept, {freed} freed, {len(pil_images)} Pillow images)'
+        del out
+
+
+def reference_nms(boxes, nms_thresh, class_nms):
+    """ Original implementation of NonMaxSuppression, which loops over the images and boxes in Python. """
+    keep = torch.zeros(boxes.shape[0]) > 0
+    for batch in torch.unique(boxes[:, 0]):
+        idx = torch.nonzero(boxes[:, 0] == batch)[:, 0]
+        b = boxes[idx]
+        bboxes = torch.cat([b[:, 1:3] - b[:, 3:5] / 2, b[:, 1:3] + b[:, 3:5] / 2], 1)
+        _, order = b[:, 5].sort(0, descending=True)
+        x1, y1, x2, y2 = bboxes[order].split(1, 1)
+        dx = (x2.min(x2.t()) - x1.max(x1.t())).clamp(min=0)
+        dy = (y2.min(y2.t()) - y1.max(y1.t())).clamp(min=0)
+        intersections = dx * dy
+        areas = (x2 - x1) * (y2 - y1)
+        ious = intersections / ((areas + areas.t()) - intersections)
+        conflicting = (ious > nms_thresh).triu(1)
+        if class_nms:
+            classes = b[order, 6]
+            conflicting &= classes[:, None] == classes[None, :]
+
+        suppress = torch.zeros(len(conflicting)) > 0
+        for i, row in enumerate(conflicting):
+            if not suppress[i]:
+                keep[idx[order[i]]] = 1
+                suppress |= row
+
+    return boxes[keep]
+
+
+@pytest.mark.parametrize('class_nms', [True, False])
+def test_nms(class_nms):
+    gen = torch.Generator().manual_seed(0)
+    num = 2000
+    boxes = torch.empty(num, 7)
+    boxes[:, 0] = torch.randint(0, 4, (num,), generator=gen)
+    boxes[:, 1:3] = torch.rand(num, 2, generator=gen)
+    boxes[:, 3:5] = torch.rand(num, 2, generator=gen) * 0.3 + 0.01
+    boxes[:, 5] = torch.randperm(num, generator=gen).float() / num
+    boxes[:, 6] = torch.randint(0, 3, (num,), generator=gen)
+
+    nms = tf.NonMaxSuppression(0.4, class_nms)
+    out = nms(boxes)
+    ref = reference_nms(boxes, 0.4, class_nms)
+    assert 0 < out.shape[0] < num
+    assert torch.equal(out, ref)
+
+    # Chains of boxes that suppress each other
+    chain = torch.tensor([[0, 0.1 + 0.04 * i, 0.5, 0.1, 0.1, 1 - 0.01 * i, 0] for i in range(20)])
+    assert torch.equal(nms(chain), reference_nms(chain, 0.4, class_nms))
+    assert nms(chain).shape[0] == 10
+
+
+def test_nms_bounded():
+    gen = torch.Generator().manual_seed(1)
+    num = 3000
+    boxes = torch.empty(num, 7)
+    boxes[:, 0] = torch.randint(0, 3, (num,), generator=gen)
+    boxes[:, 1:3] = torch.rand(num, 2, generator=gen)
+    boxes[:, 3:5] = torch.rand(num, 2, generator=gen) * 0.3 + 0.01
+    boxes[:, 5] = torch.randperm(num, generator=gen).float() / num
+    boxes[:, 6] = torch.randint(0, 2, (num,), generator=gen)
+    ref = tf.NonMaxSuppression(0.4)(boxes)
+
+    # Tiling does not change the results
+    for tile_size in (1, 1000, 100000):
+        assert torch.equal(tf.NonMaxSuppression(0.4, tile_size=tile_size)(boxes), ref)
+
+    # Top-k per image and class
+    top_k = []
+    for group in torch.unique(boxes[:, [0, 6]], dim=0):
+        mask = (boxes[:, 0] == group[0]) & (boxes[:, 6] == group[1])
+        top_k.append(torch.nonzero(mask)[boxes[mask, 5].argsort(descending=True)[:100], 0])
+    top_k = boxes[torch.cat(top_k).sort()[0]]
+    assert torch.equal(tf.NonMaxSuppression(0.4, top_k=100)(boxes), reference_nms(top_k, 0.4, True))
+
+    # Maximal number of detections per image
+    out = tf.NonMaxSuppression(0.4, max_det=50)(boxes)
+    for batch in range(3):
+        ref_batch = ref[ref[:, 0] == batch]
+        out_batch = out[out[:, 0] == batch]
+        assert out_batch.shape[0] == 50
+        assert torch.equal(out_batch, ref_batch[ref_batch[:, 5] >= ref_batch[:, 5].topk(50)[0][-1]])
+
+
+def test_nms_dense(monkeypatch):
+    # One group with many overlapping boxes, which gives a quadratic number of conflicting pairs
+    gen = torch.Generator().manual_seed(2)
+    num = 2000
+    boxes = torch.zeros(num, 7)
+    boxes[:, 1:3] = torch.rand(num, 2, generator=gen) * 0.4 + 0.3
+    boxes[:, 3:5] = torch.rand(num, 2, generator=gen) * 0.1 + 0.3
+    boxes[:, 5] = torch.randperm(num, generator=gen).float() / num
+    ref = reference_nms(boxes, 0.3, True)
+
+    # Only the conflicting pairs of one tile are kept in memory (measured as live index storage at each tile)
+    def live_indices():
+        storages = {}
+        for obj in gc.get_objects():
+            if isinstance(obj, torch.Tensor) and obj.dtype == torch.int64:
+                storage = obj.untyped_storage() if hasattr(obj, 'untyped_storage') else obj.storage()
+                storages[storage.data_ptr()] = storage.size() * storage.element_size() // 8
+        return sum(storages.values())
+
+    live = []
+    nonzero = torch.Tensor.nonzero
+
+    def count_nonzero(self, *args, **kwargs):
+        live.append(live_indices() - initial)
+        return nonzero(self, *args, **kwargs)
+
+    initial = live_indices()
+    monkeypatch.setattr(torch.Tensor, 'nonzero', count_nonzero)
+    out = tf.NonMaxSuppression(0.3, tile_size=40000)(boxes)
+    assert torch.equal(out, ref)
+    assert out.shape[0] > 1
+    assert len(live) > 50
+    assert max(live) < 5 * 40000
+
+
+def reference_get_boxes(network_output, num_classes, anchors, conf_thresh):
+    """ Original implementation of GetBoundingBoxes, which modifies the network output in place. """
+    anchors = torch.Tensor(anchors)
+    num_anchors = anchors.shape[0]
+    batch, _, h, w = network_output.shape
+
+    lin_x = torch.linspace(0, w-1, w).repeat(h, 1).view(h*w)
+    lin_y = torch.linspace(0, h-1, h).view(h, 1).repeat(1, w).view(h*w)
+    anchor_w = anchors[:, 0].contiguous().view(1, num_anchors, 1)
+    anchor_h = anchors[:, 1].contiguous().view(1, num_anchors, 1)
+
+    network_output = network_output.view(batch, num_anchors, -1, h*w)
+    network_output[:, :, 0, :].sigmoid_().add_(lin_x).div_(w)
+    network_output[:, :, 1, :].sigmoid_().add_(lin_y).div_(h)
+    network_output[:, :, 2, :].exp_().mul_(anchor_w).div_(w)
+    network_output[:, :, 3, :].exp_().mul_(anchor_h).div_(h)
+    network_output[:, :, 4, :].sigmoid_()
+
+    if num_classes > 1:
+        cls_scores = torch.nn.functional.softmax(network_output[:, :, 5:, :], 2)
+        cls_max, cls_max_idx = torch.max(cls_scores, 2)
+        cls_max_idx = cls_max_idx.float()
+        cls_max.mul_(network_output[:, :, 4, :])
+    else:
+        cls_max = network_output[:, :, 4, :]
+        cls_max_idx = torch.zeros_like(cls_max)
+
+    score_thresh = cls_max > conf_thresh
+    coords = network_output.transpose(2, 3)[..., 0:4]
+    coords = coords[score_thresh[..., None].expand_as(coords)].view(-1, 4)
+    batch_num = torch.nonzero(score_thresh)[:, 0]
+    return torch.cat([batch_num[:, None].float(), coords, cls_max[score_thresh][:, None], cls_max_idx[score_thresh][:, None]], dim=1)
+
+
+@pytest.mark.parametrize('num_classes', [1, 4])
+def test_get_bounding_boxes(num_classes):
+    anchors = [(1.0, 1.5), (2.0, 1.0), (3.5, 3.0)]
+    gen = torch.Generator().manual_seed(0)
+    output = torch.randn(2, 3 * (5 + num_classes), 13, 15, generator=gen) * 2
+    original = output.clone()
+
+    uut = tf.GetBoundingBoxes(num_classes, anchors, 0.3)
+    boxes = uut(output)
+    assert torch.equal(output, original)
+    assert boxes.shape[0] > 0
+
+    ref = reference_get_boxes(output.clone(), num_classes, anchors, 0.3)
+    assert boxes.shape == ref.shape
+    assert torch.allclose(boxes, ref, atol=1e-6)
+
+    # Cached grids and single images
+    assert torch.equal(uut(output[1]), boxes[boxes[:, 0] == 1] - torch.tensor([1, 0, 0, 0, 0, 0, 0]))
+    assert len(uut._grids) == 1
+    assert uut(torch.full_like(output, -10)).numel() == 0
+
+
+def test_fused_postprocess():
+    anchors = [(1.0, 1.5), (2.0, 1.0), (3.5, 3.0)]
+    labels = ['a', 'b', 'c', 'd']
+    gen = torch.Generator().manual_seed(0)
+    output = torch.randn(3, 3 * 9, 13, 15, generator=gen) * 2
+    output[1, 4::9] = -10           # No detections in the second image
+
+    chain = tf.Compose([
+        tf.GetBoundingBoxes(4, anchors, 0.3),
+        tf.NonMaxSuppression(0.45),
+        tf.TensorToBrambox((480, 416), labels),
+    ])
+    uut = tf.FusedPostprocess(4, anchors, 0.3, 0.45, (480, 416), offsets=True)
+    det, offsets = uut(output)
+    ref = chain(output.clone())
+
+    assert det.dtype == tf.TensorToArray.dtype
+    assert offsets.tolist() == [0, (ref.image == 0).sum(), (ref.image == 0).sum(), len(ref)]
+    df = tf.ArrayToBrambox(labels)(det)
+    pd.testing.assert_frame_equal(df.reset_index(drop=True), ref.reset_index(drop=True), check_dtype=False, atol=1e-4)
+
+    # Unsorted images and no detections
+    boxes = torch.tensor([[2, 0.5, 0.5, 0.1, 0.1, 0.9, 0], [0, 0.5, 0.5, 0.1, 0.1, 0.8, 1]])
+    assert uut.to_array(boxes)['image'].tolist() == [0, 2]
+    empty, offsets = uut(torch.full_like(output, -10))
+    assert len(empty) == 0 and offsets.tolist() == [0, 0, 0, 0]
+    assert len(tf.ArrayToBrambox(labels)(empty).columns) == len(ref.columns)
+
+
+def reference_reverse_letterbox(boxes, network_size, get_size):
+    """ Original implementation of ReverseLetterbox, which transforms the boxes of each image separately. """
+    def transform(boxes, name):
+        net_w, net_h = network_size
+        im_w, im_h = get_size(name)
+        if im_w == net_w and im_h == net_h:
+            scale = 1
+        elif im_w / net_w >= im_h / net_h:
+            scale = im_w/net_w
+        else:
+            scale = im_h/net_h
+        pad = int((net_w - im_w/scale) / 2), int((net_h - im_h/scale) / 2)
+
+        boxes = boxes.copy()
+        boxes.x_top_left = (boxes.x_top_left - pad[0]) * scale
+        boxes.y_top_left = (boxes.y_top_left - pad[1]) * scale
+        boxes.width *= scale
+        boxes.height *= scale
+        return boxes
+
+    return pd.concat([transform(group, name) for name, group in boxes.groupby('image', observed=True)])
+
+
+@pytest.mark.parametrize('categorical', [False, True])
+def test_reverse_letterbox(categorical):
+    rng = np.random.default_rng(0)
+    sizes = {'img_0': (416, 416), 'img_1': (640, 480), 'img_2': (300, 900), 'img_3': (1920, 1080)}
+    boxes = pd.DataFrame({
+        'image': rng.choice(list(sizes), 50),
+        'class_label': 'a',
+        'x_top_left': rng.uniform(0, 400, 50),
+        'y_top_left': rng.uniform(0, 400, 50),
+        'width': rng.uniform(1, 100, 50),
+        'height': rng.uniform(1, 100, 50),
+        'confidence': rng.uniform(0, 1, 50),
+    })
+    if categorical:
+        boxes.image = boxes.image.astype('category')
+    original = boxes.copy()
+
+    calls = []
+
+    def get_size(name):
+        calls.append(name)
+        return sizes[name]
+
+    ref = reference_reverse_letterbox(boxes, (416, 416), sizes.__getitem__).sort_index()
+    pd.testing.assert_frame_equal(tf.ReverseLetterbox((416, 416), get_size)(boxes), ref)
+    pd.testing.assert_frame_equal(tf.ReverseLetterbox((416, 416), sizes)(boxes), ref)
+    pd.testing.assert_frame_equal(boxes, original)
+    assert sorted(calls) == sorted(set(boxes.image))
+
+    # Tuple size and no boxes
+    tuple_ref = reference_reverse_letterbox(boxes, (416, 416), lambda name: (640, 480)).sort_index()
+    pd.testing.assert_frame_equal(tf.ReverseLetterbox((416, 416), (640, 480))(boxes), tuple_ref)
+    assert len(tf.ReverseLetterbox((416, 416), sizes)(boxes.iloc[:0]).index) == 0
+
+    # Boxes without an image
+    boxes.loc[3, 'image'] = None
+    with pytest.raises(ValueError):
+        tf.ReverseLetterbox((416, 416), sizes)(boxes)